@@ -1,13 +1,30 @@
 import os
 import base64
+import functools
 from datetime import datetime
 from flask_caching import Cache
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response
-from pymongo import MongoClient
-from courses import get_user_courses, save_user_courses
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_template
+from courses import (
+    get_user_courses, save_user_courses, register_course_references, register_result_grouping,
+    resolve_stored_courses, persistence_stats, user_courses_writes, get_courses_status, get_courses_statuses,
+    find_courses_slice
+)
+from write_behind import WriteBehindQueue
+from job_queue import JobQueue, create_store, JOB_QUEUE_BACKEND
+from single_flight import create_single_flight
+import db_manager
+from migrate import check_schema_version
+from catalog import CourseCatalog, CatalogGeneration, QualificationCache, cut_off_candidates
+from course_query import course_query_enabled, find_qualifying_course_groups
+from qualification import (
+    GRADE_VALUES, build_user_profile,
+    qualifies_by_cluster_points, qualifies_by_mean_grade
+)
+from vector_engine import VectorEngine, vector_engine_enabled
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 from dotenv import load_dotenv
 from bson import ObjectId
+from markupsafe import Markup
 import requests
 from guide_routes import register_guides
 from flask import send_from_directory
@@ -24,6 +41,7 @@ import logging
 import threading
 from datetime import timedelta
 import gzip
+import zlib
 from io import BytesIO
 # At the top of your file, add:
 import sys
@@ -201,6 +219,10 @@ def compress_response(response):
 @app.after_request
 def set_cache_headers(response):
     """Set aggressive caching headers for better performance"""
+    # Per-user responses (private_response) keep their own headers
+    if response.cache_control.private or response.cache_control.no_store:
+        return response
+    
     # Static assets - cache for 1 year
     if request.path.startswith('/static/'):
         response.cache_control.max_age = 31536000  # 1 year
@@ -224,6 +246,15 @@ def set_cache_headers(response):
     response.headers['Pragma'] = 'public'
     return response
 
+def private_response(view):
+    """Mark a view's responses private, no-store: they hold one user's data and the URL does not say whose"""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+    return wrapped
+
 # --- Constants ---
 SUBJECTS = {
     'mathematics': 'MAT', 'english': 'ENG', 'kiswahili': 'KIS', 'chemistry': 'CHE',
@@ -234,10 +265,6 @@ SUBJECTS = {
     'building': 'ARD', 'electronics': 'COM', 'metalwork': 'ARD'
 }
 
-GRADE_VALUES = {
-    'A': 12, 'A-': 11, 'B+': 10, 'B': 9, 'B-': 8, 'C+': 7, 'C': 6, 'C-': 5,
-    'D+': 4, 'D': 3, 'D-': 2, 'E': 1
-}
 CLUSTER_NAMES = {
     'cluster_1': 'Law',
     'cluster_2': 'Business, Hospitality & Related',
@@ -300,8 +327,11 @@ ARTISAN_COLLECTIONS = [
     "Hair_Dressing_Beauty_Therapy"
 ]
 
+COURSE_LEVELS = ['degree', 'diploma', 'certificate', 'artisan', 'kmtc', 'ttc']
+
 
 # --- Database Connections ---
+# One client per process comes from db_manager; the globals below are fork-safe handles onto it
 MONGODB_URI = os.getenv('MONGODB_URI')
 
 # Initialize database variables
@@ -317,281 +347,64 @@ user_courses_collection = None
 user_baskets_collection = None
 admin_activations_collection = None
 database_connected = False
-client = None
 
 
 def initialize_database():
-    """Initialize database connections with robust error handling and fixed index creation"""
+    """Initialize database connections with robust error handling"""
     global db, db_user_data, db_diploma, db_kmtc, db_certificate, db_artisan, db_Teachers
     global user_payments_collection, user_courses_collection, user_baskets_collection, admin_activations_collection, database_connected
-    global client
     max_retries = 3
     for attempt in range(max_retries):
         try:
             print(f"🔄 Attempting to connect to\\ MongoDB (attempt {attempt + 1}/{max_retries})...")
             
-            client = MongoClient(
-                MONGODB_URI,
-                serverSelectionTimeoutMS=10000,
-                connectTimeoutMS=30000,
-                socketTimeoutMS=30000,
-                retryWrites=True,
-                retryReads=True,
-                maxPoolSize=50
-            )
-            
-            # Test the connection
-            client.admin.command('ping')
+            # Test the connection (the shared client is created on first use)
+            db_manager.ping()
             print("✅ Successfully connected to MongoDB")
             
             # Initialize databases
-            db = client['Degree']
-            db_user_data = client['user_data']
-            db_diploma = client['diploma']
-            db_kmtc = client['kmtc']
-            db_certificate = client['certificate']
-            db_artisan = client['artisan']
-            db_Teachers = client['Teachers']
+            db = db_manager.database('Degree')
+            db_user_data = db_manager.database('user_data')
+            db_diploma = db_manager.database('diploma')
+            db_kmtc = db_manager.database('kmtc')
+            db_certificate = db_manager.database('certificate')
+            db_artisan = db_manager.database('artisan')
+            db_Teachers = db_manager.database('Teachers')
             
             # Initialize collections
             collections_initialized = True
-
-            # Partial index filter used when creating partial unique indexes (ensure string-typed fields)
-            partial_filter = {
-                'email': {'$type': 'string'},
-                'index_number': {'$type': 'string'},
-                'level': {'$type': 'string'}
-            }
             
             try:
-                user_courses_collection = db_user_data['user_courses']
+                user_courses_collection = db_manager.collection('user_data', 'user_courses')
                 print("✅ User courses collection initialized")
             except Exception as e:
                 print(f"❌ Error initializing user_courses collection: {str(e)}")
                 collections_initialized = False
             
             try:
-                user_payments_collection = db_user_data['user_payments']
+                user_payments_collection = db_manager.collection('user_data', 'user_payments')
                 print("✅ User payments collection initialized")
             except Exception as e:
                 print(f"❌ Error initializing user_payments collection: {str(e)}")
                 collections_initialized = False
             
             try:
-                user_baskets_collection = db_user_data['user_baskets']
+                user_baskets_collection = db_manager.collection('user_data', 'user_baskets')
                 print("✅ User baskets collection initialized")
             except Exception as e:
                 print(f"❌ Error initializing user_baskets collection: {str(e)}")
                 collections_initialized = False
             
             try:
-                admin_activations_collection = db_user_data['admin_activations']
+                admin_activations_collection = db_manager.collection('user_data', 'admin_activations')
                 print("✅ Admin activations collection initialized")
             except Exception as e:
                 print(f"❌ Error initializing admin_activations collection: {str(e)}")
                 admin_activations_collection = None
                 collections_initialized = False
             
-            # FIXED INDEX CREATION WITH CONFLICT RESOLUTION
-            if user_payments_collection is not None:
-                try:
-                    # Get all existing indexes
-                    existing_indexes = list(user_payments_collection.list_indexes())
-                    print(f"🔍 Found {len(existing_indexes)} existing indexes")
-
-                    # Desired key pattern for the compound index
-                    desired_key = {'email': 1, 'index_number': 1, 'level': 1}
-
-                    # Drop any existing index that uses the same key pattern but has different name or options
-                    for index in existing_indexes:
-                        index_name = index.get('name', '')
-                        index_keys = index.get('key', {})
-                        index_unique = index.get('unique', False)
-                        index_partial = index.get('partialFilterExpression', None)
-                        # If an index uses the same keys but differs from our desired spec, drop it
-                        if index_keys == desired_key:
-                            needs_drop = False
-                            if index_name != 'unique_email_index_level':
-                                needs_drop = True
-                            # If uniqueness doesn't match or partial filter expression differs, drop
-                            elif not index_unique or index_partial != partial_filter:
-                                needs_drop = True
-                            if needs_drop:
-                                try:
-                                    print(f"🔄 Dropping existing index '{index_name}' because it conflicts with desired spec")
-                                    user_payments_collection.drop_index(index_name)
-                                    print(f"✅ Dropped index '{index_name}'")
-                                except Exception as drop_err:
-                                    print(f"⚠️ Could not drop index '{index_name}': {drop_err}")
-
-                    # partial_filter already defined above
-
-                    # Try to create a unique partial index for non-null/string docs
-                    try:
-                        user_payments_collection.create_index(
-                            [("email", 1), ("index_number", 1), ("level", 1)],
-                            name='unique_email_index_level',
-                            unique=True,
-                            partialFilterExpression=partial_filter
-                        )
-                        print("✅ Unique partial user_payments index created (name=unique_email_index_level)")
-                    except Exception as create_err:
-                        print(f"❌ Error creating unique partial user_payments index: {create_err}")
-                        # Fallback: try non-unique index (safe) and continue
-                        try:
-                            user_payments_collection.create_index(
-                                [("email", 1), ("index_number", 1), ("level", 1)],
-                                name='non_unique_email_index_level',
-                                unique=False
-                            )
-                            print("✅ Created non-unique user_payments index as fallback")
-                        except Exception as fallback_error:
-                            print(f"⚠️ Fallback user_payments index creation also failed: {fallback_error}")
-
-                    # Other useful indexes (create with safe handling in case index with different name exists)
-                    try:
-                        # transaction_ref index
-                        existing = [i for i in existing_indexes if i.get('key', {}) == {'transaction_ref': 1}]
-                        if existing and existing[0].get('name') != 'transaction_ref_index':
-                            try:
-                                user_payments_collection.drop_index(existing[0].get('name'))
-                            except Exception:
-                                pass
-                        user_payments_collection.create_index([("transaction_ref", 1)], name='transaction_ref_index')
-                    except Exception as ie:
-                        print(f"❌ Failed to create/ensure transaction_ref index: {str(ie)}")
-
-                    try:
-                        existing = [i for i in existing_indexes if i.get('key', {}) == {'payment_confirmed': 1}]
-                        if existing and existing[0].get('name') != 'payment_confirmed_index':
-                            try:
-                                user_payments_collection.drop_index(existing[0].get('name'))
-                            except Exception:
-                                pass
-                        user_payments_collection.create_index([("payment_confirmed", 1)], name='payment_confirmed_index')
-                    except Exception as ie:
-                        print(f"❌ Failed to create/ensure payment_confirmed index: {str(ie)}")
-
-                except Exception as e:
-                    print(f"❌ Error creating user_payments indexes: {str(e)}")
-            
-            if user_courses_collection is not None:
-                try:
-                    existing_indexes = list(user_courses_collection.list_indexes())
-                    desired_key = {'email': 1, 'index_number': 1, 'level': 1}
-
-                    # Drop any existing index that uses the same key pattern but has different name or options
-                    for index in existing_indexes:
-                        index_name = index.get('name', '')
-                        index_keys = index.get('key', {})
-                        index_unique = index.get('unique', False)
-                        index_partial = index.get('partialFilterExpression', None)
-                        if index_keys == desired_key:
-                            needs_drop = False
-                            if index_name != 'unique_courses_email_index_level':
-                                needs_drop = True
-                            elif not index_unique or index_partial != partial_filter:
-                                needs_drop = True
-                            if needs_drop:
-                                try:
-                                    print(f"🔄 Dropping existing courses index '{index_name}' because it conflicts with desired spec")
-                                    user_courses_collection.drop_index(index_name)
-                                    print(f"✅ Dropped courses index '{index_name}'")
-                                except Exception as drop_err:
-                                    print(f"⚠️ Could not drop courses index '{index_name}': {drop_err}")
-
-                    partial_filter = {
-                        'email': {'$type': 'string'},
-                        'index_number': {'$type': 'string'},
-                        'level': {'$type': 'string'}
-                    }
-
-                    try:
-                        user_courses_collection.create_index(
-                            [("email", 1), ("index_number", 1), ("level", 1)],
-                            name='unique_courses_email_index_level',
-                            unique=True,
-                            partialFilterExpression=partial_filter
-                        )
-                        print("✅ Unique partial user_courses index created (name=unique_courses_email_index_level)")
-                    except Exception as create_err:
-                        print(f"❌ Error creating unique partial user_courses index: {create_err}")
-                        try:
-                            user_courses_collection.create_index(
-                                [("email", 1), ("index_number", 1), ("level", 1)],
-                                name='non_unique_courses_email_index_level',
-                                unique=False
-                            )
-                            print("✅ Created non-unique courses index as fallback")
-                        except Exception as fallback_error:
-                            print(f"⚠️ Fallback courses index creation failed: {fallback_error}")
-
-                except Exception as e:
-                    print(f"❌ Error creating user_courses indexes: {str(e)}")
-            
-            # Other index creations remain the same...
-            if user_baskets_collection is not None:
-                try:
-                    existing_indexes = list(user_baskets_collection.list_indexes())
-                    # Ensure index for index_number exists; drop conflicting if necessary
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'index_number': 1}]
-                    if existing and existing[0].get('name') != 'basket_index_number':
-                        try:
-                            user_baskets_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    user_baskets_collection.create_index([("index_number", 1)], name='basket_index_number')
-
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'email': 1}]
-                    if existing and existing[0].get('name') != 'basket_email':
-                        try:
-                            user_baskets_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    user_baskets_collection.create_index([("email", 1)], name='basket_email')
-
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'created_at': 1}]
-                    if existing and existing[0].get('name') != 'basket_created_at':
-                        try:
-                            user_baskets_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    user_baskets_collection.create_index([("created_at", 1)], name='basket_created_at')
-                    print("✅ User baskets indexes created")
-                except Exception as e:
-                    print(f"❌ Error creating user_baskets indexes: {str(e)}")
-            
-            if admin_activations_collection is not None:
-                try:
-                    existing_indexes = list(admin_activations_collection.list_indexes())
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'index_number': 1}]
-                    if existing and existing[0].get('name') != 'activation_index_number':
-                        try:
-                            admin_activations_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    admin_activations_collection.create_index([("index_number", 1)], name='activation_index_number')
-
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'payment_receipt': 1}]
-                    if existing and existing[0].get('name') != 'activation_payment_receipt':
-                        try:
-                            admin_activations_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    admin_activations_collection.create_index([("payment_receipt", 1)], name='activation_payment_receipt')
-
-                    existing = [i for i in existing_indexes if i.get('key', {}) == {'is_active': 1}]
-                    if existing and existing[0].get('name') != 'activation_is_active':
-                        try:
-                            admin_activations_collection.drop_index(existing[0].get('name'))
-                        except Exception:
-                            pass
-                    admin_activations_collection.create_index([("is_active", 1)], name='activation_is_active')
-                    print("✅ Admin activations indexes created")
-                except Exception as e:
-                    print(f"❌ Error creating admin_activations indexes: {str(e)}")
-            else:
-                print("⚠️ Admin activations collection not available for indexing")
+            # Indexes are applied once per deploy by migrate.py; only confirm the recorded version here
+            check_schema_version()
             
             database_connected = collections_initialized
             if collections_initialized:
@@ -613,14 +426,26 @@ def initialize_database():
                 return False
 database_connected = initialize_database()            
 
-course_processing_lock = threading.Lock()
-course_processing_cache = {}  
+
+# --- Course Catalog ---
+# Every level is read from MongoDB once per worker and qualification runs from memory
+course_catalog = CourseCatalog()
+course_catalog.register_level('degree', lambda: db, CLUSTERS, tag_field='cluster')
+course_catalog.register_level('diploma', lambda: db_diploma, DIPLOMA_COLLECTIONS, tag_field='collection')
+course_catalog.register_level('kmtc', lambda: db_kmtc, KMTC_COLLECTIONS)
+course_catalog.register_level('certificate', lambda: db_certificate, CERTIFICATE_COLLECTIONS, tag_field='collection')
+course_catalog.register_level('artisan', lambda: db_artisan, ARTISAN_COLLECTIONS, tag_field='collection')
+course_catalog.register_level('ttc', lambda: db_Teachers, TTC_COLLECTIONS, tag_field='collection')
+# Admin reloads bump a shared generation so every worker reloads, not just the one that served the request
+course_catalog.set_generation_store(CatalogGeneration(lambda: db_manager.collection('user_data', 'catalog_generation')))
+vector_engine = VectorEngine()
+qualification_cache = QualificationCache()
 register_guides(app) 
 
 # --- News Model ---
 # --- News Model ---
 def create_news_collection():
-    """Initialize news collection with indexes"""
+    """Initialize news collection (its indexes are created by migrate.py)"""
     global database_connected, db_user_data
     
     # SAFE CHECK: Use explicit None/False comparisons
@@ -635,22 +460,9 @@ def create_news_collection():
     
     try:
         # Create or get news collection
-        news_collection = db_user_data['news_articles']
-        
-        # Create indexes
-        existing_indexes = list(news_collection.list_indexes())
+        news_collection = db_manager.collection('user_data', 'news_articles')
         
-        # Index for published status and ordering
-        existing = [i for i in existing_indexes if i.get('key', {}) == {'is_published': 1, 'published_at': -1}]
-        if not existing:
-            news_collection.create_index([("is_published", 1), ("published_at", -1)], name='published_news_index')
-        
-        # Index for featured news
-        existing = [i for i in existing_indexes if i.get('key', {}) == {'is_featured': 1, 'published_at': -1}]
-        if not existing:
-            news_collection.create_index([("is_featured", 1), ("published_at", -1)], name='featured_news_index')
-        
-        print("✅ News collection initialized with indexes")
+        print("✅ News collection initialized")
         return news_collection
     except Exception as e:
         print(f"❌ Error creating news collection: {str(e)}")
@@ -671,6 +483,20 @@ def handle_exception(e):
         'error': 'Internal server error'
     }), 500
 
+# Fields a results page reads from a user_courses record, in any of its stored forms
+RESULTS_RECORD_FIELDS = {
+    'level': 1, 'courses': 1, 'course_refs': 1, 'catalog_version': 1,
+    'courses_blob': 1, 'courses_codec': 1, 'courses_count': 1, 'result_groups': 1
+}
+
+# Enough to draw a results page's categories without loading any courses
+RESULT_SUMMARY_FIELDS = {'level': 1, 'courses_count': 1, 'result_groups': 1}
+
+def find_user_courses(query, projection=None):
+    """user_courses record matching query, with courses stored by reference rebuilt from the catalog"""
+    user_courses_writes.flush_key(query)
+    return resolve_stored_courses(user_courses_collection.find_one(query, projection))
+
 def get_user_courses_data(email, index_number, level):
     """Get user courses from database with better validation"""
     courses_data = None
@@ -678,7 +504,7 @@ def get_user_courses_data(email, index_number, level):
     # Try database first
     if database_connected:
         try:
-            courses_data = user_courses_collection.find_one({
+            courses_data = find_user_courses({
                 'email': email, 
                 'index_number': index_number, 
                 'level': level
@@ -716,28 +542,8 @@ def get_qualifying_ttc(user_grades, user_mean_grade):
     if not database_connected:
         print("❌ Database not available for TTC courses")
         return []
-        
-    qualifying_courses = []
     
-    for collection_name in TTC_COLLECTIONS:
-        try:
-            if collection_name not in db_Teachers.list_collection_names():  # Use db_Teachers
-                continue
-                
-            collection = db_Teachers[collection_name]  # Use db_Teachers
-            courses = collection.find()
-            
-            for course in courses:
-                if check_diploma_course_qualification(course, user_grades, user_mean_grade):
-                    course_with_collection = dict(course)
-                    course_with_collection['collection'] = collection_name
-                    qualifying_courses.append(course_with_collection)
-        
-        except Exception as e:
-            print(f"Error processing TTC collection {collection_name}: {str(e)}")
-            continue
-    
-    return qualifying_courses
+    return qualify_level('ttc', build_user_profile(user_grades, user_mean_grade))
 
 # --- Session Management Functions ---
 def init_session():
@@ -898,107 +704,6 @@ class JSONEncoder:
 app.json_encoder = JSONEncoder
 
 # --- Helper Functions ---
-def parse_grade(grade_str):
-    """Parse grade string, handling unexpected formats"""
-    if not grade_str:
-        return None
-    if grade_str in GRADE_VALUES:
-        return grade_str
-    if '/' in grade_str:
-        parts = grade_str.split('/')
-        for part in parts:
-            if part in GRADE_VALUES:
-                return part
-    return None
-
-def meets_requirement(requirement_key, requirement_grade, user_grades):
-    """Check if user meets a single requirement (handles / for either/or)"""
-    parsed_grade = parse_grade(requirement_grade)
-    if not parsed_grade:
-        return False
-        
-    if '/' in requirement_key:
-        alternatives = requirement_key.split('/')
-        for subject in alternatives:
-            if subject in user_grades:
-                if GRADE_VALUES[user_grades[subject]] >= GRADE_VALUES[parsed_grade]:
-                    return True
-        return False
-    else:
-        if requirement_key in user_grades:
-            return GRADE_VALUES[user_grades[requirement_key]] >= GRADE_VALUES[parsed_grade]
-        return False
-
-def check_artisan_course_qualification(course, user_grades, user_mean_grade):
-    """
-    Check if user qualifies for a specific artisan course
-    Artisan courses typically have minimal requirements
-    """
-    # If the course has minimum grade requirements
-    min_mean_grade = course.get('minimum_grade', {}).get('mean_grade')
-    
-    if min_mean_grade:
-        # If user's grade is lower than required, they don't qualify
-        if GRADE_VALUES.get(user_mean_grade, 0) < GRADE_VALUES.get(min_mean_grade, 0):
-            return False
-    
-    # Check subject requirements if any
-    requirements = course.get('minimum_subject_requirements', {})
-    
-    if requirements:
-        for subject_key, required_grade in requirements.items():
-            if not meets_requirement(subject_key, required_grade, user_grades):
-                return False
-    
-    # Default to True for artisan courses (most accessible)
-    return True
-
-def check_course_qualification(course, user_grades, user_cluster_points):
-    """Check if user qualifies for a specific course based on subjects and cluster points"""
-    requirements = course.get('minimum_subject_requirements', {})
-    
-    subject_qualified = True
-    if requirements:
-        for subject_key, required_grade in requirements.items():
-            if not meets_requirement(subject_key, required_grade, user_grades):
-                subject_qualified = False
-                break
-    
-    cluster_qualified = True
-    cluster_name = course.get('cluster', '')
-    cut_off_points = course.get('cut_off_points', 0)
-    
-    if cluster_name and cut_off_points:
-        user_points = user_cluster_points.get(cluster_name, 0)
-        if user_points < cut_off_points:
-            cluster_qualified = False
-    
-    return subject_qualified and cluster_qualified
-
-def check_diploma_course_qualification(course, user_grades, user_mean_grade):
-    """Check if user qualifies for a specific diploma course based on mean grade and subject requirements"""
-    mean_grade_qualified = True
-    min_mean_grade = course.get('minimum_grade', {}).get('mean_grade')
-    
-    if min_mean_grade:
-        if GRADE_VALUES[user_mean_grade] < GRADE_VALUES[min_mean_grade]:
-            mean_grade_qualified = False
-    
-    subject_qualified = True
-    requirements = course.get('minimum_subject_requirements', {})
-    
-    if requirements:
-        for subject_key, required_grade in requirements.items():
-            if not meets_requirement(subject_key, required_grade, user_grades):
-                subject_qualified = False
-                break
-    
-    return mean_grade_qualified and subject_qualified
-
-def check_certificate_course_qualification(course, user_grades, user_mean_grade):
-    """Check if user qualifies for a specific certificate course based on mean grade and subject requirements"""
-    return check_diploma_course_qualification(course, user_grades, user_mean_grade)
-
 def get_gemini_response(user_message):
     """
     Get AI response from Google Gemini with COMPLETE knowledge base
@@ -3154,142 +2859,188 @@ def get_cut_off_points(course, university):
     query = f"{course} {university} cut off points 2026"
     return search_kuccps_info(query)
 # --- Course Qualification Functions ---
+def get_catalog_level(level):
+    """Get a level's courses from the in-memory catalog, loading it from MongoDB on first use"""
+    try:
+        return course_catalog.get_level(level)
+    except Exception as e:
+        # Never qualify against an empty catalog: 0 courses would look like a real (and saveable) result
+        print(f"❌ Error loading {level} courses into catalog: {str(e)}")
+        raise
+
+def iter_qualifying_records(level, profile):
+    """Yield (collection_name, catalog records) a profile qualifies for, one collection at a time (not copies)"""
+    groups = get_catalog_level(level)
+    by_cluster_points = level == 'degree'
+    
+    if vector_engine_enabled():
+        vector_groups = None
+        try:
+            vector_groups = vector_engine.qualifying_groups(level, groups, profile, by_cluster_points)
+        except Exception as e:
+            print(f"⚠️ Vector engine failed for {level}, falling back to Python loop: {str(e)}")
+        if vector_groups is not None:
+            yield from vector_groups
+            return
+    
+    for group in groups:
+        records = []
+        try:
+            if by_cluster_points:
+                # Only courses whose cut-off the user's points reach need their subjects checked
+                user_points = profile.cluster_points.get(group.name, 0)
+                for position in cut_off_candidates(group, user_points):
+                    if qualifies_by_cluster_points(group.requirements[position], profile):
+                        records.append(group.courses[position])
+            else:
+                for course, requirements in zip(group.courses, group.requirements):
+                    if qualifies_by_mean_grade(requirements, profile):
+                        records.append(course)
+        except Exception as e:
+            print(f"Error processing {level} collection {group.name}: {str(e)}")
+            continue
+        if records:
+            yield group.name, records
+
+def query_qualifying_groups(level, profile):
+    """Qualify a level inside MongoDB so only the qualifying courses are transferred"""
+    # Errors propagate like catalog load errors: an empty or partial list would be saved as the result
+    try:
+        get_database, collection_names, tag_field = course_catalog.source(level)
+        database = get_database()
+        if database is None:
+            raise RuntimeError(f"Database for {level} courses is not available")
+        return find_qualifying_course_groups(
+            database, collection_names, profile, tag_field, by_cluster_points=level == 'degree'
+        )
+    except Exception as e:
+        print(f"❌ Error querying {level} courses: {str(e)}")
+        raise
+
+def iter_qualifying_groups(level, profile):
+    """
+    Generator form of qualify_level: yields (collection_name, courses) collection by collection, in catalog order.
+    Served from the grade-profile cache when another user had the same profile.
+    Catalog records are compact CourseRecords; they become plain dicts here, on the way out.
+    """
+    if course_query_enabled(level):
+        # Deployments that cannot hold this level in memory filter it in MongoDB instead
+        yield from query_qualifying_groups(level, profile)
+        return
+    
+    try:
+        canonical, cache_key = course_catalog.profile_key(level, profile)
+    except Exception as e:
+        # Loads the level on first use; as in get_catalog_level, a load error must not read as 0 courses
+        print(f"❌ Error loading {level} courses into catalog: {str(e)}")
+        raise
+    
+    cached_groups = qualification_cache.get(cache_key)
+    if cached_groups is not None:
+        for collection_name, records in cached_groups:
+            yield collection_name, [course.to_dict() for course in records]
+        return
+    
+    found_groups = []
+    for collection_name, records in iter_qualifying_records(level, canonical):
+        found_groups.append((collection_name, records))
+        yield collection_name, [course.to_dict() for course in records]
+    # Only reached when the caller consumed every collection, so partial runs are never cached
+    qualification_cache.put(cache_key, found_groups)
+
+def qualify_level(level, profile):
+    """Qualifying courses for a level as one list, in catalog order"""
+    return [course for _, courses in iter_qualifying_groups(level, profile) for course in courses]
+
+def course_refs_for(level, courses):
+    """(course ids, level version) for results that can be stored by reference, else None"""
+    if course_query_enabled(level):
+        return None
+    course_ids = []
+    for course in courses:
+        if course.get('_id') is None:
+            return None
+        course_ids.append(str(course['_id']))
+    # Every id has to resolve in the catalog, or the stored results could not be rebuilt
+    if len(course_catalog.courses_by_id(level, course_ids)) != len(course_ids):
+        return None
+    return course_ids, course_catalog.level_version(level)
+
+def courses_from_refs(level, course_ids, catalog_version=None):
+    """Rebuild stored results from the catalog, in the order they were saved"""
+    records = course_catalog.courses_by_id(level, course_ids)
+    if catalog_version and catalog_version != course_catalog.level_version(level):
+        print(f"🔄 Rehydrating {level} results saved against {catalog_version} from {course_catalog.level_version(level)}")
+    if len(records) != len(course_ids):
+        print(f"⚠️ {len(course_ids) - len(records)} stored {level} courses are no longer in the catalog")
+    
+    courses = []
+    for record in records:
+        course = record.to_dict()
+        # Stored copies always carried string ids
+        course['_id'] = str(course['_id'])
+        courses.append(course)
+    return courses
+
+register_course_references(course_refs_for, courses_from_refs)
+
+def qualify_all_levels(user_grades, user_mean_grade=None, user_cluster_points=None, levels=None):
+    """
+    Qualify one set of grades against several levels in a single pass.
+    The profile is built once and every level is read from the loaded catalog; returns {level: courses}.
+    """
+    levels = list(levels or COURSE_LEVELS)
+    if not database_connected:
+        # Paid jobs save these results, so no database must not read as no qualifying courses
+        raise RuntimeError("Database not available for multi-level qualification")
+    
+    # Degree only reads cluster points and the other levels only the mean grade, so one profile serves all
+    profile = build_user_profile(user_grades, user_mean_grade, user_cluster_points)
+    results = {}
+    for level in levels:
+        results[level] = qualify_level(level, profile)
+        print(f"🎯 {level}: {len(results[level])} qualifying courses")
+    return results
+
 def get_qualifying_courses(user_grades, user_cluster_points):
     """Get all degree courses that the user qualifies for"""
     if not database_connected:
         print("❌ Database not available for degree courses")
         return []
-        
-    qualifying_courses = []
     
-    for collection_name in CLUSTERS:
-        try:
-            if collection_name not in db.list_collection_names():
-                continue
-                
-            collection = db[collection_name]
-            courses = collection.find()
-            
-            for course in courses:
-                course_with_cluster = dict(course)
-                course_with_cluster['cluster'] = collection_name
-                
-                if check_course_qualification(course_with_cluster, user_grades, user_cluster_points):
-                    qualifying_courses.append(course_with_cluster)
-        
-        except Exception as e:
-            print(f"Error processing collection {collection_name}: {str(e)}")
-            continue
-    
-    return qualifying_courses
+    return qualify_level('degree', build_user_profile(user_grades, user_cluster_points=user_cluster_points))
 
 def get_qualifying_diploma_courses(user_grades, user_mean_grade):
     """Get all diploma courses that the user qualifies for"""
     if not database_connected:
         print("❌ Database not available for diploma courses")
         return []
-        
-    qualifying_courses = []
-    
-    for collection_name in DIPLOMA_COLLECTIONS:
-        try:
-            if collection_name not in db_diploma.list_collection_names():
-                continue
-                
-            collection = db_diploma[collection_name]
-            courses = collection.find()
-            
-            for course in courses:
-                if check_diploma_course_qualification(course, user_grades, user_mean_grade):
-                    course_with_collection = dict(course)
-                    course_with_collection['collection'] = collection_name
-                    qualifying_courses.append(course_with_collection)
-        
-        except Exception as e:
-            print(f"Error processing diploma collection {collection_name}: {str(e)}")
-            continue
     
-    return qualifying_courses
+    return qualify_level('diploma', build_user_profile(user_grades, user_mean_grade))
 
 def get_qualifying_kmtc_courses(user_grades, user_mean_grade):
     """Get all KMTC courses that the user qualifies for"""
     if not database_connected:
         print("❌ Database not available for KMTC courses")
         return []
-        
-    qualifying_courses = []
     
-    try:
-        if 'kmtc_courses' not in db_kmtc.list_collection_names():
-            return qualifying_courses
-            
-        collection = db_kmtc['kmtc_courses']
-        courses = collection.find()
-        
-        for course in courses:
-            if check_diploma_course_qualification(course, user_grades, user_mean_grade):
-                qualifying_courses.append(course)
-                
-    except Exception as e:
-        print(f"Error processing KMTC collection: {str(e)}")
-        
-    return qualifying_courses
+    return qualify_level('kmtc', build_user_profile(user_grades, user_mean_grade))
 
 def get_qualifying_certificate_courses(user_grades, user_mean_grade):
     """Get all certificate courses that the user qualifies for"""
     if not database_connected:
         print("❌ Database not available for certificate courses")
         return []
-        
-    qualifying_courses = []
-    
-    for collection_name in CERTIFICATE_COLLECTIONS:
-        try:
-            if collection_name not in db_certificate.list_collection_names():
-                continue
-                
-            collection = db_certificate[collection_name]
-            courses = collection.find()
-            
-            for course in courses:
-                if check_certificate_course_qualification(course, user_grades, user_mean_grade):
-                    course_with_collection = dict(course)
-                    course_with_collection['collection'] = collection_name
-                    qualifying_courses.append(course_with_collection)
-        
-        except Exception as e:
-            print(f"Error processing certificate collection {collection_name}: {str(e)}")
-            continue
     
-    return qualifying_courses
+    return qualify_level('certificate', build_user_profile(user_grades, user_mean_grade))
 
 def get_qualifying_artisan_courses(user_grades, user_mean_grade):
     """Get all artisan courses that the user qualifies for"""
     if not database_connected:
         print("❌ Database not available for artisan courses")
         return []
-        
-    qualifying_courses = []
-    
-    for collection_name in ARTISAN_COLLECTIONS:
-        try:
-            if collection_name not in db_artisan.list_collection_names():
-                continue
-                
-            collection = db_artisan[collection_name]
-            courses = collection.find()
-            
-            for course in courses:
-                if check_artisan_course_qualification(course, user_grades, user_mean_grade):
-                    course_with_collection = dict(course)
-                    course_with_collection['collection'] = collection_name
-                    qualifying_courses.append(course_with_collection)
-        
-        except Exception as e:
-            print(f"Error processing artisan collection {collection_name}: {str(e)}")
-            continue
     
-    return qualifying_courses
+    return qualify_level('artisan', build_user_profile(user_grades, user_mean_grade))
 
 # --- Database Operations ---
 def save_user_payment(email, index_number, level, transaction_ref=None, amount=1, grade_data=None):
@@ -3370,7 +3121,7 @@ def debug_user_courses():
     sess_rec = None
     try:
         if database_connected and user_courses_collection is not None:
-            db_rec = user_courses_collection.find_one({'email': email, 'index_number': index_number, 'level': level})
+            db_rec = find_user_courses({'email': email, 'index_number': index_number, 'level': level})
             if db_rec and 'courses' in db_rec:
                 # convert ObjectId to str for JSON
                 for c in db_rec['courses']:
@@ -3830,222 +3581,356 @@ def mark_payment_confirmed(transaction_ref, payment_receipt=None):
         print(f"❌ Error marking payment confirmed: {str(e)}")
         return False
 
-def create_optimized_indexes():
-    """Create indexes for faster queries"""
-    try:
-        # Compound index for fastest course retrieval
-        user_courses_collection.create_index(
-            [("email", 1), ("index_number", 1), ("level", 1)],
-            name="fast_course_lookup"
-        )
-        
-        # Index for payment verification
-        user_payments_collection.create_index(
-            [("transaction_ref", 1), ("payment_confirmed", 1)],
-            name="fast_payment_verify"
-        )
-        
-        # Index for basket retrieval
-        user_baskets_collection.create_index(
-            [("index_number", 1), ("is_active", 1)],
-            name="fast_basket_lookup"
-        )
-        
-        print("✅ Optimized indexes created")
-    except Exception as e:
-        print(f"⚠️ Index creation error: {e}")
-# Add at the top with other imports
-from concurrent.futures import ThreadPoolExecutor
-import queue
-import uuid
-
-# Create a thread pool for background tasks
-executor = ThreadPoolExecutor(max_workers=10)
-job_status = {}  # Track job status
-
-def process_courses_job(job_id, email, index_number, flow, payment_ref):
-    """Process courses in background with job tracking"""
-    try:
-        print(f"🔄 Job {job_id}: Processing {flow} courses")
-        job_status[job_id] = {'status': 'processing', 'flow': flow}
-        
-        # Get payment data
-        payment_data = user_payments_collection.find_one({'transaction_ref': payment_ref})
-        if not payment_data:
-            job_status[job_id] = {'status': 'failed', 'error': 'Payment not found'}
-            return
-        
-        grade_data = payment_data.get('grade_data', {})
-        
-        # Qualification functions mapping
-        qualification_functions = {
-            'degree': lambda: get_qualifying_courses(
-                grade_data.get('grades', {}), 
-                grade_data.get('cluster_points', {})
-            ),
-            'diploma': lambda: get_qualifying_diploma_courses(
-                grade_data.get('grades', {}), 
-                grade_data.get('mean_grade', '')
-            ),
-            'certificate': lambda: get_qualifying_certificate_courses(
-                grade_data.get('grades', {}), 
-                grade_data.get('mean_grade', '')
-            ),
-            'artisan': lambda: get_qualifying_artisan_courses(
-                grade_data.get('grades', {}), 
-                grade_data.get('mean_grade', '')
-            ),
-            'kmtc': lambda: get_qualifying_kmtc_courses(
-                grade_data.get('grades', {}), 
-                grade_data.get('mean_grade', '')
-            ),
-            'ttc': lambda: get_qualifying_ttc(
-                grade_data.get('grades', {}), 
-                grade_data.get('mean_grade', '')
-            )
-        }
-        
-        # Get qualifying courses
-        if flow in qualification_functions:
-            qualifying_courses = qualification_functions[flow]()
-        else:
-            qualifying_courses = []
-        
-        # Save to database
-        if qualifying_courses:
-            save_user_courses(email, index_number, flow, qualifying_courses)
-            job_status[job_id] = {
-                'status': 'completed', 
-                'count': len(qualifying_courses),
-                'flow': flow
-            }
-            print(f"✅ Job {job_id}: Saved {len(qualifying_courses)} courses")
-        else:
-            save_user_courses(email, index_number, flow, [])
-            job_status[job_id] = {'status': 'completed', 'count': 0, 'flow': flow}
-            print(f"⚠️ Job {job_id}: No courses found")
-            
-    except Exception as e:
-        print(f"❌ Job {job_id}: Error - {str(e)}")
-        job_status[job_id] = {'status': 'failed', 'error': str(e)}
 # --- Course Processing & Qualification Functions ---
-def process_courses_after_payment(email, index_number, flow):
-    """Process and save courses after payment confirmation - WITH CACHE TRACKING"""
-    cache_key = f"{email}_{index_number}_{flow}"
-    
-    # Check if already processing or completed
-    if cache_key in course_processing_cache:
-        cache_data = course_processing_cache[cache_key]
-        if isinstance(cache_data, dict):
-            if cache_data.get('status') == 'completed':
-                print(f"✅ Courses already processed for {cache_key}")
-                return True
-            elif cache_data.get('status') == 'processing':
-                print(f"🔄 Course processing already in progress for {cache_key}")
-                return True
+def find_unprocessed_paid_levels(index_number, email=None, exclude_level=None):
+    """Confirmed payments with stored grades whose courses have not been saved yet"""
+    query = {
+        'index_number': index_number,
+        'payment_confirmed': True,
+        'grade_data': {'$exists': True}
+    }
+    if email:
+        query['email'] = email
+    if exclude_level:
+        query['level'] = {'$ne': exclude_level}
     
-    print(f"🎯 PROCESSING COURSES for {flow} after payment confirmation")
+    payments = [p for p in user_payments_collection.find(query) if p.get('grade_data') and p.get('level')]
+    if not payments:
+        return []
     
-    with course_processing_lock:
-        try:
-            # Mark as processing
-            course_processing_cache[cache_key] = {
-                'status': 'processing',
-                'started_at': datetime.now().isoformat()
-            }
-            
-            # Check if courses already exist in database
-            existing_courses = get_user_courses_data(email, index_number, flow)
-            if existing_courses and existing_courses.get('courses'):
-                print(f"✅ Courses already exist in database for {flow}, skipping processing")
-                course_processing_cache[cache_key] = {
-                    'status': 'completed',
-                    'courses_count': len(existing_courses['courses']),
-                    'completed_at': datetime.now().isoformat()
-                }
-                return True
-            
-            qualifying_courses = []
-            
-            # Get payment data to retrieve stored grades
-            payment_data = user_payments_collection.find_one({
-                'email': email,
-                'index_number': index_number,
-                'level': flow
+    processed_query = {'index_number': index_number, 'level': {'$in': [p['level'] for p in payments]}}
+    if email:
+        processed_query['email'] = email
+    # Saves still waiting in the write-behind queue would look unprocessed
+    user_courses_writes.flush()
+    processed_levels = set(user_courses_collection.distinct('level', processed_query))
+    return [p for p in payments if p['level'] not in processed_levels]
+
+def group_payments_by_grades(payments):
+    """
+    Group paid levels that were entered with the same subject grades so each group is one qualify_all_levels pass.
+    The mean grade (non-degree levels) and cluster points (degree) are merged unless two records disagree.
+    """
+    groups = []
+    for payment in payments:
+        grade_data = payment.get('grade_data') or {}
+        grades = grade_data.get('grades') or {}
+        mean_grade = grade_data.get('mean_grade') or ''
+        cluster_points = grade_data.get('cluster_points') or {}
+        
+        for group in groups:
+            if group['grades'] != grades:
+                continue
+            if mean_grade and group['mean_grade'] and mean_grade != group['mean_grade']:
+                continue
+            if cluster_points and group['cluster_points'] and cluster_points != group['cluster_points']:
+                continue
+            group['mean_grade'] = group['mean_grade'] or mean_grade
+            group['cluster_points'] = group['cluster_points'] or cluster_points
+            group['levels'].append(payment['level'])
+            break
+        else:
+            groups.append({
+                'grades': grades,
+                'mean_grade': mean_grade,
+                'cluster_points': cluster_points,
+                'levels': [payment['level']]
             })
-            
-            if payment_data and 'grade_data' in payment_data:
-                grade_data = payment_data.get('grade_data', {})
-                print(f"📊 Retrieved grade data from payment record")
-                
-                if flow == 'degree':
-                    user_grades = grade_data.get('grades', {})
-                    user_cluster_points = grade_data.get('cluster_points', {})
-                    qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-                elif flow == 'diploma':
-                    user_grades = grade_data.get('grades', {})
-                    user_mean_grade = grade_data.get('mean_grade', '')
-                    qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-                elif flow == 'certificate':
-                    user_grades = grade_data.get('grades', {})
-                    user_mean_grade = grade_data.get('mean_grade', '')
-                    qualifying_courses = get_qualifying_certificate_courses(user_grades, user_mean_grade)
-                elif flow == 'artisan':
-                    user_grades = grade_data.get('grades', {})
-                    user_mean_grade = grade_data.get('mean_grade', '')
-                    qualifying_courses = get_qualifying_artisan_courses(user_grades, user_mean_grade)
-                elif flow == 'kmtc':
-                    user_grades = grade_data.get('grades', {})
-                    user_mean_grade = grade_data.get('mean_grade', '')
-                    qualifying_courses = get_qualifying_kmtc_courses(user_grades, user_mean_grade)
-                elif flow == 'ttc':
-                    user_grades = grade_data.get('grades', {})
-                    user_mean_grade = grade_data.get('mean_grade', '')
-                    qualifying_courses = get_qualifying_ttc(user_grades, user_mean_grade)
-            
-            # Save courses to database
-            if qualifying_courses:
-                print(f"💾 Saving {len(qualifying_courses)} courses to database for {flow}")
-                save_user_courses(email, index_number, flow, qualifying_courses)
-                course_count = len(qualifying_courses)
-            else:
-                print(f"⚠️ No qualifying courses found for {flow}")
-                # Save empty record to mark as processed
-                save_user_courses(email, index_number, flow, [])
-                course_count = 0
-            
-            # Update cache with result
-            course_processing_cache[cache_key] = {
-                'status': 'completed',
-                'courses_count': course_count,
-                'completed_at': datetime.now().isoformat()
-            }
-            
-            print(f"✅ Processed {course_count} {flow} courses")
-            return True
-                
-        except Exception as e:
-            print(f"❌ Error processing courses after payment: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            course_processing_cache[cache_key] = {
-                'status': 'failed',
-                'error': str(e),
-                'failed_at': datetime.now().isoformat()
-            }
-            return False
+    return groups
 
+def qualify_paid_levels(payments):
+    """Qualify every paid level in as few passes as possible, returning {level: courses}"""
+    results = {}
+    for group in group_payments_by_grades(payments):
+        results.update(qualify_all_levels(
+            group['grades'], group['mean_grade'], group['cluster_points'], group['levels']
+        ))
+    return results
 
-def update_transaction_ref(email, index_number, level, transaction_ref):
-    """Update transaction reference for user - WITHOUT confirming payment"""
-    print(f"💾 Updating transaction ref for {email}, {index_number}, {level}: {transaction_ref}")
-    
-    if not database_connected:
-        session_key = f'{level}_payment_{index_number}'
-        if session_key in session:
-            session[session_key]['transaction_ref'] = transaction_ref
-            session[session_key]['payment_confirmed'] = False
-        else:
+# --- Post-Payment Pipeline ---
+# One pipeline for every paid category, whichever entry point confirmed the payment (callback, webhook,
+# polling, recovery, manual activation): entitlement -> qualification -> persistence -> notification.
+# Entry points only enqueue; the durable job runs it once, and every worker sees its state.
+
+# Flow registry: the score each category qualifies on and the session keys its grades are entered under
+POST_PAYMENT_FLOWS = {
+    'degree': {'score': 'cluster_points', 'grades_key': 'degree_grades', 'score_key': 'degree_cluster_points'},
+    'diploma': {'score': 'mean_grade', 'grades_key': 'diploma_grades', 'score_key': 'diploma_mean_grade'},
+    'certificate': {'score': 'mean_grade', 'grades_key': 'certificate_grades', 'score_key': 'certificate_mean_grade'},
+    'artisan': {'score': 'mean_grade', 'grades_key': 'artisan_grades', 'score_key': 'artisan_mean_grade'},
+    'kmtc': {'score': 'mean_grade', 'grades_key': 'kmtc_grades', 'score_key': 'kmtc_mean_grade'},
+    'ttc': {'score': 'mean_grade', 'grades_key': 'ttc_grades', 'score_key': 'ttc_mean_grade'},
+}
+
+course_jobs = JobQueue('course_jobs', create_store(lambda: db_manager.collection('user_data', 'jobs')))
+# One fetch-qualify-save per user and flow at a time; other users run in parallel
+course_flights = create_single_flight(lambda: db_manager.collection('user_data', 'leases'), JOB_QUEUE_BACKEND)
+
+def session_grade_data(flow):
+    """Package the grades entered for a flow, as stored on its payment record for the pipeline"""
+    spec = POST_PAYMENT_FLOWS[flow]
+    empty_score = {} if spec['score'] == 'cluster_points' else ''
+    return {
+        'type': flow,
+        'grades': session.get(spec['grades_key'], {}),
+        spec['score']: session.get(spec['score_key'], empty_score),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def course_job_id(email, index_number, flow):
+    return f"courses:{email}:{index_number}:{flow}"
+
+def saved_courses_result(email, index_number, flow):
+    """{'courses_count': n} once a category's courses are in the database, else None"""
+    status = get_courses_status(email, index_number, flow)
+    if status and status['courses_count']:
+        return {'courses_count': status['courses_count']}
+    return None
+
+def entitled_payment(email, index_number, flow):
+    """Entitlement stage: the confirmed payment (or manual activation) record of a flow; raises until there is one"""
+    payment_data = user_payments_collection.find_one({
+        'email': email,
+        'index_number': index_number,
+        'level': flow,
+        'payment_confirmed': True
+    })
+    if not payment_data:
+        # The job is retried, so a confirmation that is still on its way is picked up
+        raise RuntimeError(f"No confirmed {flow} payment for {index_number}")
+    return payment_data
+
+def qualify_entitled_payments(payments):
+    """Qualification stage: publish speculative results where they exist, qualify the rest in grouped passes"""
+    level_results = {}
+    remaining_payments = []
+    for payment in payments:
+        courses = prequalified_courses(payment['level'], payment.get('grade_data'))
+        if courses is None:
+            remaining_payments.append(payment)
+        else:
+            level_results[payment['level']] = courses
+    level_results.update(qualify_paid_levels(remaining_payments))
+    return level_results
+
+def persist_paid_courses(email, index_number, level, courses):
+    """
+    Persistence stage: save a level's courses and return True only once they are in MongoDB.
+    With write-behind a save is only queued, and the job must not report success for a write that
+    could still fail or die with the worker.
+    """
+    if not save_user_courses(email, index_number, level, courses, update_session=False):
+        return False
+    if not user_courses_writes.enabled:
+        return True
+    if not user_courses_writes.flush_key({'email': email, 'index_number': index_number, 'level': level}):
+        return False
+    # A background flush may have taken the write first; only the stored record shows how it went
+    return saved_courses_result(email, index_number, level) is not None
+
+def qualify_and_save_paid_courses(email, index_number, flow):
+    """Run the pipeline for a paid flow, with any other unprocessed paid categories in the same pass"""
+    # Check if courses already exist in database
+    saved = saved_courses_result(email, index_number, flow)
+    if saved:
+        print(f"✅ Courses already exist in database for {flow}, skipping processing")
+        return saved
+    
+    payment_data = entitled_payment(email, index_number, flow)
+    if not payment_data.get('grade_data'):
+        # Fail (and retry) rather than complete with 0 courses: a completed job is never run again
+        raise RuntimeError(f"No grade data stored with the {flow} payment for {index_number}")
+    print(f"📊 Retrieved grade data from payment record")
+    
+    # Other categories this user paid for without results yet are qualified in the same pass
+    other_payments = []
+    try:
+        other_payments = find_unprocessed_paid_levels(index_number, email, exclude_level=flow)
+    except Exception as e:
+        print(f"⚠️ Could not look up other paid categories: {str(e)}")
+    
+    level_results = qualify_entitled_payments([payment_data] + other_payments)
+    qualifying_courses = level_results.pop(flow, [])
+    
+    # Persistence stage (with no courses, the completed job itself records the result)
+    for other_level, other_courses in level_results.items():
+        if other_courses:
+            print(f"💾 Saving {len(other_courses)} courses to database for {other_level} (same pass)")
+            if not persist_paid_courses(email, index_number, other_level, other_courses):
+                raise RuntimeError(f"Could not save {other_level} courses")
+    
+    if qualifying_courses:
+        print(f"💾 Saving {len(qualifying_courses)} courses to database for {flow}")
+        if not persist_paid_courses(email, index_number, flow, qualifying_courses):
+            raise RuntimeError(f"Could not save {flow} courses")
+    else:
+        print(f"⚠️ No qualifying courses found for {flow}")
+    
+    # Notification: the job finishing wakes readiness streams; pollers read the job or the saved courses
+    print(f"✅ Processed {len(qualifying_courses)} {flow} courses")
+    return {'courses_count': len(qualifying_courses)}
+
+def run_course_processing(email, index_number, flow):
+    """
+    Qualify and save a paid category's courses (course_jobs handler); raises so the job is retried.
+    Concurrent calls for the same user and flow, in any worker, share one run.
+    """
+    print(f"🎯 PROCESSING COURSES for {flow} after payment confirmation")
+    return course_flights.do(
+        course_job_id(email, index_number, flow),
+        lambda: qualify_and_save_paid_courses(email, index_number, flow),
+        done=lambda: saved_courses_result(email, index_number, flow)
+    )
+
+course_jobs.register('process_courses', run_course_processing)
+
+def process_courses_after_payment(email, index_number, flow, restart=False):
+    """
+    Queue the post-payment pipeline for a confirmed payment; returns without waiting for it.
+    restart=True runs a completed pipeline again (after discard_paid_courses, for corrected grades).
+    """
+    if flow not in POST_PAYMENT_FLOWS:
+        print(f"⚠️ No post-payment pipeline for flow '{flow}'")
+        return False
+    try:
+        job = course_jobs.enqueue(
+            course_job_id(email, index_number, flow), 'process_courses', restart=restart,
+            email=email, index_number=index_number, flow=flow
+        )
+        print(f"📋 Course processing job for {flow}: {job['status']}")
+        return True
+    except Exception as e:
+        print(f"❌ Error queueing course processing: {str(e)}")
+        return False
+
+def discard_paid_courses(email, index_number, flow):
+    """Remove a category's saved courses so the pipeline qualifies it again instead of reusing them"""
+    query = {'email': email, 'index_number': index_number, 'level': flow}
+    # A save still queued for the old grades would otherwise be written after the delete
+    user_courses_writes.flush_key(query)
+    user_courses_collection.delete_one(query)
+    print(f"🗑️ Discarded saved {flow} courses for {index_number}")
+
+def grades_changed(previous_grade_data, grade_data):
+    """True when a flow's newly entered grades differ from the ones its results were qualified from"""
+    fields = ('grades', 'mean_grade', 'cluster_points')
+    previous_grade_data = previous_grade_data or {}
+    return any(previous_grade_data.get(field) != grade_data.get(field) for field in fields)
+
+def course_processing_status(email, index_number, flow):
+    """
+    Processing state of a paid category as any worker sees it, or None if no job exists.
+    Returns {'status': 'processing' | 'completed' | 'failed', 'courses_count', 'error'}.
+    """
+    try:
+        job = course_jobs.status(course_job_id(email, index_number, flow))
+    except Exception as e:
+        print(f"⚠️ Could not read course processing job: {str(e)}")
+        return None
+    if not job:
+        return None
+    return {
+        'status': job['status'] if job['status'] in ('completed', 'failed') else 'processing',
+        'courses_count': (job.get('result') or {}).get('courses_count', 0),
+        'error': job.get('error')
+    }
+
+
+# --- Speculative Qualification ---
+# Grades are known at submission, long before payment: qualify them then as a low-priority job and keep
+# the qualifying course ids, so the paid path only has to publish them
+SPECULATIVE_QUALIFICATION = os.getenv('SPECULATIVE_QUALIFICATION', 'true').lower() == 'true'
+PREQUALIFIED_TTL_SECONDS = int(os.getenv('PREQUALIFIED_TTL_SECONDS', str(24 * 3600)))
+SPECULATIVE_JOB_PRIORITY = -10
+
+prequalified_collection = db_manager.collection('user_data', 'prequalified')
+prequalify_stats = {'queued': 0, 'stored': 0, 'published': 0, 'missed': 0}
+
+def prequalified_id(level, profile):
+    """Shared key of a level's results for a grade profile (the level's content version is part of it)"""
+    _, cache_key = course_catalog.profile_key(level, profile)
+    return hashlib.sha1(repr(cache_key).encode()).hexdigest()
+
+def speculate_qualification(level, user_grades, user_mean_grade=None, user_cluster_points=None):
+    """Queue a speculative qualification of just-submitted grades; never fails the submission"""
+    if not SPECULATIVE_QUALIFICATION or not database_connected or course_query_enabled(level):
+        return
+    try:
+        grades_key = json.dumps([level, user_grades, user_mean_grade, user_cluster_points], sort_keys=True)
+        course_jobs.enqueue(
+            f"prequalify:{hashlib.sha1(grades_key.encode()).hexdigest()}", 'prequalify',
+            priority=SPECULATIVE_JOB_PRIORITY, level=level, grades=user_grades,
+            mean_grade=user_mean_grade, cluster_points=user_cluster_points
+        )
+        prequalify_stats['queued'] += 1
+    except Exception as e:
+        print(f"⚠️ Could not queue speculative {level} qualification: {str(e)}")
+
+def run_prequalification(level, grades, mean_grade=None, cluster_points=None):
+    """Qualify submitted grades and store the course ids under the profile's shared key (course_jobs handler)"""
+    profile = build_user_profile(grades, mean_grade, cluster_points)
+    doc_id = prequalified_id(level, profile)
+    if prequalified_collection.find_one({'_id': doc_id}, {'_id': 1}):
+        return {'courses_count': None, 'reused': True}
+    
+    courses = qualify_level(level, profile)
+    refs = course_refs_for(level, courses)
+    if refs is None:
+        return {'courses_count': len(courses), 'stored': False}
+    course_ids, catalog_version = refs
+    now = datetime.utcnow()
+    prequalified_collection.update_one(
+        {'_id': doc_id},
+        {'$set': {
+            'level': level,
+            'catalog_version': catalog_version,
+            'course_ids': course_ids,
+            'courses_count': len(course_ids),
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=PREQUALIFIED_TTL_SECONDS)
+        }},
+        upsert=True
+    )
+    prequalify_stats['stored'] += 1
+    print(f"🔮 Prequalified {len(course_ids)} {level} courses")
+    return {'courses_count': len(course_ids), 'stored': True}
+
+course_jobs.register('prequalify', run_prequalification)
+
+def prequalified_courses(level, grade_data):
+    """Courses stored by a speculative run for these grades, or None (then qualify as usual)"""
+    if not SPECULATIVE_QUALIFICATION or course_query_enabled(level) or not grade_data:
+        return None
+    try:
+        profile = build_user_profile(
+            grade_data.get('grades', {}), grade_data.get('mean_grade'), grade_data.get('cluster_points')
+        )
+        record = prequalified_collection.find_one({'_id': prequalified_id(level, profile)})
+        # Only the level's own content matters: other levels loaded by this worker do not change it
+        if not record or record.get('catalog_version') != course_catalog.level_version(level):
+            prequalify_stats['missed'] += 1
+            return None
+        courses = courses_from_refs(level, record['course_ids'], record['catalog_version'])
+        if len(courses) != record['courses_count']:
+            prequalify_stats['missed'] += 1
+            return None
+        prequalify_stats['published'] += 1
+        print(f"⚡ Publishing {len(courses)} prequalified {level} courses")
+        return courses
+    except Exception as e:
+        print(f"⚠️ Could not read prequalified {level} courses: {str(e)}")
+        return None
+
+def update_transaction_ref(email, index_number, level, transaction_ref):
+    """Update transaction reference for user - WITHOUT confirming payment"""
+    print(f"💾 Updating transaction ref for {email}, {index_number}, {level}: {transaction_ref}")
+    
+    if not database_connected:
+        session_key = f'{level}_payment_{index_number}'
+        if session_key in session:
+            session[session_key]['transaction_ref'] = transaction_ref
+            session[session_key]['payment_confirmed'] = False
+        else:
             session[session_key] = {
                 'email': email,
                 'index_number': index_number,
@@ -4255,7 +4140,7 @@ def verify_paystack_webhook_signature(payload, signature):
     ).hexdigest()
     
     return hmac.compare_digest(computed_signature, signature)
-def create_manual_activation_payment(email, index_number, flow, payment_receipt):
+def create_manual_activation_payment(email, index_number, flow, payment_receipt, grade_data=None):
     """Create a payment record for manual activations so users can verify later"""
     print(f"💰 Creating payment record for manual activation: {email}, {index_number}, {flow}")
     
@@ -4272,6 +4157,9 @@ def create_manual_activation_payment(email, index_number, flow, payment_receipt)
         'created_at': datetime.now(),
         'payment_date': datetime.now()
     }
+    # Keep grades stored by an earlier payment attempt unless new ones were entered
+    if grade_data and grade_data.get('grades'):
+        payment_record['grade_data'] = grade_data
     
     if database_connected:
         try:
@@ -4429,7 +4317,7 @@ def get_user_existing_data(email, index_number):
                 {'index_number': index_number}
             ]
         })
-        user_data['courses'] = list(courses)
+        user_data['courses'] = [resolve_stored_courses(record) for record in courses]
         
         # Get paid categories
         user_data['paid_categories'] = get_user_paid_categories(email, index_number)
@@ -4440,6 +4328,9 @@ def get_user_existing_data(email, index_number):
     return user_data
 
 # --- Basket Database Functions ---
+# Basket upserts are coalesced per index number when WRITE_BEHIND_ENABLED is on
+user_basket_writes = WriteBehindQueue('user_baskets', lambda: user_baskets_collection, ('index_number',))
+
 def save_user_basket(email, index_number, basket_data):
     """Save user basket to database with enhanced validation"""
     print(f"💾 ENHANCED: Saving basket for {index_number}")
@@ -4462,7 +4353,7 @@ def save_user_basket(email, index_number, basket_data):
     }
     
     try:
-        result = user_baskets_collection.update_one(
+        user_basket_writes.submit(
             {'index_number': index_number},
             {'$set': basket_record},
             upsert=True
@@ -4495,6 +4386,7 @@ def get_user_basket_by_index(index_number):
     # Database is connected - try to load from database with enhanced error handling
     try:
         print(f"🔍 Searching database for basket of index: {index_number}")
+        user_basket_writes.flush_key({'index_number': index_number})
         basket_data = user_baskets_collection.find_one({
             'index_number': index_number,
             'is_active': True
@@ -4584,13 +4476,14 @@ def clear_user_basket(index_number):
     """Clear user basket from database without affecting session"""
     if database_connected:
         try:
-            result = user_baskets_collection.update_one(
+            user_basket_writes.submit(
                 {'index_number': index_number},
                 {'$set': {
                     'basket': [],
                     'updated_at': datetime.now(),
                     'is_active': False
-                }}
+                }},
+                upsert=False
             )
             print(f"✅ Basket database record cleared for {index_number}")
             return True
@@ -4772,6 +4665,7 @@ def submit_grades():
         session['degree_grades'] = user_grades
         session['degree_cluster_points'] = user_cluster_points
         session['degree_data_submitted'] = True
+        speculate_qualification('degree', user_grades, user_cluster_points=user_cluster_points)
         return redirect(url_for('enter_details', flow='degree'))
         
     except Exception as e:
@@ -4804,6 +4698,7 @@ def submit_ttc_grades():
         session['ttc_data_submitted'] = True
         
         session.modified = True
+        speculate_qualification('ttc', user_grades, user_mean_grade)
         
         print(f"✅ TTC grades submitted successfully: {user_mean_grade}")
         
@@ -4846,6 +4741,7 @@ def submit_diploma_grades():
         session['diploma_grades'] = user_grades
         session['diploma_mean_grade'] = user_mean_grade
         session['diploma_data_submitted'] = True
+        speculate_qualification('diploma', user_grades, user_mean_grade)
         return redirect(url_for('enter_details', flow='diploma'))
         
     except Exception as e:
@@ -4873,6 +4769,7 @@ def submit_certificate_grades():
         session['certificate_grades'] = user_grades
         session['certificate_mean_grade'] = user_mean_grade
         session['certificate_data_submitted'] = True
+        speculate_qualification('certificate', user_grades, user_mean_grade)
         return redirect(url_for('enter_details', flow='certificate'))
         
     except Exception as e:
@@ -4928,6 +4825,7 @@ def submit_artisan_grades():
             return redirect(url_for('artisan'))
         
         print("✅ Artisan grades submitted successfully, redirecting to enter_details")  
+        speculate_qualification('artisan', user_grades, user_mean_grade)
         
         # Redirect to enter_details with artisan flow
         return redirect(url_for('enter_details', flow='artisan'))
@@ -4959,6 +4857,7 @@ def submit_kmtc_grades():
         session['kmtc_grades'] = user_grades
         session['kmtc_mean_grade'] = user_mean_grade
         session['kmtc_data_submitted'] = True
+        speculate_qualification('kmtc', user_grades, user_mean_grade)
         return redirect(url_for('enter_details', flow='kmtc'))
         
     except Exception as e:
@@ -5044,78 +4943,35 @@ def enter_details(flow):
                 except Exception as e:
                     print(f"❌ Error getting payment receipt: {str(e)}")
             
-            # Create payment record for manual activation
+            # Create payment record for manual activation, with the grades the pipeline qualifies
+            grade_data = session_grade_data(flow) if flow in POST_PAYMENT_FLOWS else None
+            # Re-activating with corrected grades replaces the results qualified from the old ones
+            regrade = False
+            if grade_data and grade_data.get('grades') and database_connected:
+                previous_payment = user_payments_collection.find_one(
+                    {'email': email, 'index_number': index_number, 'level': flow}, {'grade_data': 1}
+                )
+                regrade = bool(previous_payment) and grades_changed(previous_payment.get('grade_data'), grade_data)
             if payment_receipt:
-                create_manual_activation_payment(email, index_number, flow, payment_receipt)
+                create_manual_activation_payment(email, index_number, flow, payment_receipt, grade_data)
             else:
                 print("⚠️ No payment receipt found, creating fallback payment record")
-                create_manual_activation_payment(email, index_number, flow, f"MANUAL_{index_number}")
+                create_manual_activation_payment(email, index_number, flow, f"MANUAL_{index_number}", grade_data)
             
-            # Generate courses immediately for manually activated users
-            try:
-                qualifying_courses = []
-                print(f"🚀 Generating courses for {flow} flow")
-                
-                # Get grade data based on flow
-                if flow == 'degree':
-                    user_grades = session.get('degree_grades', {})
-                    user_cluster_points = session.get('degree_cluster_points', {})
-                    print(f"📊 Degree grades: {user_grades}, Cluster points: {user_cluster_points}")
-                    qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-                    
-                elif flow == 'diploma':
-                    user_grades = session.get('diploma_grades', {})
-                    user_mean_grade = session.get('diploma_mean_grade', '')
-                    print(f"📊 Diploma grades: {user_grades}, Mean grade: {user_mean_grade}")
-                    qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-                    
-                elif flow == 'certificate':
-                    user_grades = session.get('certificate_grades', {})
-                    user_mean_grade = session.get('certificate_mean_grade', '')
-                    print(f"📊 Certificate grades: {user_grades}, Mean grade: {user_mean_grade}")
-                    qualifying_courses = get_qualifying_certificate_courses(user_grades, user_mean_grade)
-                    
-                elif flow == 'artisan':
-                    user_grades = session.get('artisan_grades', {})
-                    user_mean_grade = session.get('artisan_mean_grade', '')
-                    print(f"📊 Artisan grades: {user_grades}, Mean grade: {user_mean_grade}")
-                    qualifying_courses = get_qualifying_artisan_courses(user_grades, user_mean_grade)
-
-                elif flow == 'ttc':
-                    user_grades = session.get('ttc_grades', {})
-                    user_mean_grade = session.get('ttc_mean_grade', '')
-                    print(f"📊 TTC grades: {user_grades}, Mean grade: {user_mean_grade}")
-                    qualifying_courses = get_qualifying_ttc(user_grades, user_mean_grade)
-
-                elif flow == 'kmtc':
-                    user_grades = session.get('kmtc_grades', {})
-                    user_mean_grade = session.get('kmtc_mean_grade', '')
-                    print(f"📊 KMTC grades: {user_grades}, Mean grade: {user_mean_grade}")
-                    qualifying_courses = get_qualifying_kmtc_courses(user_grades, user_mean_grade)
-                
-                else:
-                    qualifying_courses = []
-                    print(f"⚠️ Unknown flow type: {flow}")
-                
-                print(f"📚 Found {len(qualifying_courses)} qualifying courses for {flow}")
-                
-                # Save courses to database
-                if qualifying_courses:
-                    save_user_courses(email, index_number, flow, qualifying_courses)
-                    print(f"✅ Generated {len(qualifying_courses)} courses for manually activated user")
-                    
-                    flash("Manual activation verified! Your courses have been generated. You can now view this category anytime using 'Already Made Payment'.", "success")
-                    return redirect(url_for('show_results', flow=flow))
-                else:
-                    flash("No qualifying courses found for your grades. Please try a different course level.", "warning")
-                    return redirect(url_for(flow))
-                    
-            except Exception as e:
-                print(f"❌ Error generating courses for manually activated user: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                flash("Error generating courses. Please try again.", "error")
-                return redirect(url_for('enter_details', flow=flow))
+            # Generate courses through the post-payment pipeline
+            print(f"🚀 Generating courses for {flow} flow")
+            if regrade:
+                try:
+                    discard_paid_courses(email, index_number, flow)
+                except Exception as e:
+                    print(f"❌ Error discarding saved {flow} courses: {str(e)}")
+                    flash("Error generating courses. Please try again.", "error")
+                    return redirect(url_for('enter_details', flow=flow))
+            if process_courses_after_payment(email, index_number, flow, restart=regrade):
+                flash("Manual activation verified! Your courses are being generated. You can view this category anytime using 'Already Made Payment'.", "success")
+                return redirect(url_for('payment_wait', flow=flow))
+            flash("Error generating courses. Please try again.", "error")
+            return redirect(url_for('enter_details', flow=flow))
         
         # ===== STEP 2: CHECK IF USER ALREADY PAID FOR THIS CATEGORY =====
         print(f"🔍 Checking if user already paid for {flow}")
@@ -5163,60 +5019,9 @@ def enter_details(flow):
         # ===== STEP 5: PREPARE GRADE DATA FOR STORAGE =====
         # 🔥 CRITICAL: Package all grade data to store with payment record
         grade_data = None
-        
-        if flow == 'degree':
-            grade_data = {
-                'type': 'degree',
-                'grades': session.get('degree_grades', {}),
-                'cluster_points': session.get('degree_cluster_points', {}),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged degree grade data: {len(grade_data['grades'])} subjects")
-            
-        elif flow == 'diploma':
-            grade_data = {
-                'type': 'diploma',
-                'grades': session.get('diploma_grades', {}),
-                'mean_grade': session.get('diploma_mean_grade', ''),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged diploma grade data: {len(grade_data['grades'])} subjects, mean: {grade_data['mean_grade']}")
-            
-        elif flow == 'certificate':
-            grade_data = {
-                'type': 'certificate',
-                'grades': session.get('certificate_grades', {}),
-                'mean_grade': session.get('certificate_mean_grade', ''),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged certificate grade data: {len(grade_data['grades'])} subjects, mean: {grade_data['mean_grade']}")
-            
-        elif flow == 'artisan':
-            grade_data = {
-                'type': 'artisan',
-                'grades': session.get('artisan_grades', {}),
-                'mean_grade': session.get('artisan_mean_grade', ''),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged artisan grade data: {len(grade_data['grades'])} subjects, mean: {grade_data['mean_grade']}")
-            
-        elif flow == 'kmtc':
-            grade_data = {
-                'type': 'kmtc',
-                'grades': session.get('kmtc_grades', {}),
-                'mean_grade': session.get('kmtc_mean_grade', ''),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged kmtc grade data: {len(grade_data['grades'])} subjects, mean: {grade_data['mean_grade']}")
-            
-        elif flow == 'ttc':
-            grade_data = {
-                'type': 'ttc',
-                'grades': session.get('ttc_grades', {}),
-                'mean_grade': session.get('ttc_mean_grade', ''),
-                'timestamp': datetime.now().isoformat()
-            }
-            print(f"📦 Packaged ttc grade data: {len(grade_data['grades'])} subjects, mean: {grade_data['mean_grade']}")
+        if flow in POST_PAYMENT_FLOWS:
+            grade_data = session_grade_data(flow)
+            print(f"📦 Packaged {flow} grade data: {len(grade_data['grades'])} subjects")
         
         # ===== STEP 6: STORE IN SESSION =====
         session['email'] = email
@@ -5629,63 +5434,8 @@ def paystack_callback():
             print(f"🎯 Payment confirmed. User will see receipt: {mpesa_receipt}")
             print(f"🔗 Redirecting to payment-wait for {flow}")
             
-            # Start background processing - FIXED: Don't use session in background thread
-            import threading
-            def process_courses_background(email, index_number, flow, payment_ref):
-                try:
-                    print(f"🔄 Background processing started for {flow}")
-                    # Don't try to access session here
-                    payment_full = user_payments_collection.find_one({'transaction_ref': payment_ref})
-                    if payment_full and 'grade_data' in payment_full:
-                        grade_data = payment_full.get('grade_data', {})
-                        
-                        qualifying_courses = []
-                        
-                        if flow == 'degree':
-                            user_grades = grade_data.get('grades', {})
-                            user_cluster_points = grade_data.get('cluster_points', {})
-                            qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-                        elif flow == 'diploma':
-                            user_grades = grade_data.get('grades', {})
-                            user_mean_grade = grade_data.get('mean_grade', '')
-                            qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-                        elif flow == 'certificate':
-                            user_grades = grade_data.get('grades', {})
-                            user_mean_grade = grade_data.get('mean_grade', '')
-                            qualifying_courses = get_qualifying_certificate_courses(user_grades, user_mean_grade)
-                        elif flow == 'artisan':
-                            user_grades = grade_data.get('grades', {})
-                            user_mean_grade = grade_data.get('mean_grade', '')
-                            qualifying_courses = get_qualifying_artisan_courses(user_grades, user_mean_grade)
-                        elif flow == 'kmtc':
-                            user_grades = grade_data.get('grades', {})
-                            user_mean_grade = grade_data.get('mean_grade', '')
-                            qualifying_courses = get_qualifying_kmtc_courses(user_grades, user_mean_grade)
-                        elif flow == 'ttc':
-                            user_grades = grade_data.get('grades', {})
-                            user_mean_grade = grade_data.get('mean_grade', '')
-                            qualifying_courses = get_qualifying_ttc(user_grades, user_mean_grade)
-                        
-                        if qualifying_courses:
-                            # Save to database only - no session access
-                            save_user_courses(email, index_number, flow, qualifying_courses)
-                            print(f"✅ Background: Generated and saved {len(qualifying_courses)} courses")
-                        else:
-                            # Save empty record
-                            save_user_courses(email, index_number, flow, [])
-                            print(f"⚠️ Background: No courses found for {flow}")
-                except Exception as e:
-                    print(f"❌ Background processing error: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-            
-            # Start thread with parameters
-            thread = threading.Thread(
-                target=process_courses_background, 
-                args=(email, index_number, flow, payment_ref)
-            )
-            thread.daemon = True
-            thread.start()
+            # Qualification runs as a queued job (any worker can pick it up and report on it)
+            process_courses_after_payment(email, index_number, flow)
             
             wait_url = url_for('payment_wait', flow=flow, _external=True)
             print(f"🔗 Redirecting to payment-wait: {wait_url}")
@@ -5716,7 +5466,8 @@ def payment_wait(flow):
     
     print(f"⏳ Showing payment-wait page for {flow}")
     
-    return render_template('payment_wait.html', flow=flow)
+    return render_template('payment_wait.html', flow=flow,
+                           readiness_stream=READINESS_STREAM_MAX_CONNECTIONS > 0)
 @app.route('/paystack/webhook', methods=['POST'])
 def paystack_webhook():
     """
@@ -5753,7 +5504,6 @@ def paystack_webhook():
                         email = payment_data.get('email')
                         index_number = payment_data.get('index_number')
                         flow = payment_data.get('level')
-                        grade_data = payment_data.get('grade_data', {})
                         
                         print(f"🔍 Found payment record: {email}, {index_number}, {flow}")
                         
@@ -5762,28 +5512,13 @@ def paystack_webhook():
                             mark_payment_confirmed(reference, reference)
                             
                             # Check if courses already exist
-                            existing_courses = get_user_courses_data(email, index_number, flow)
-                            if existing_courses and existing_courses.get('courses'):
+                            if saved_courses_result(email, index_number, flow):
                                 print(f"✅ Courses already exist for {flow}")
                                 return {'status': 'success'}, 200
                             
-                            # Process courses using stored grade data
-                            qualifying_courses = []
-                            
-                            if grade_data:
-                                if flow == 'degree':
-                                    user_grades = grade_data.get('grades', {})
-                                    user_cluster_points = grade_data.get('cluster_points', {})
-                                    qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-                                elif flow == 'diploma':
-                                    user_grades = grade_data.get('grades', {})
-                                    user_mean_grade = grade_data.get('mean_grade', '')
-                                    qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-                                # Add other flows...
-                            
-                            if qualifying_courses:
-                                save_user_courses(email, index_number, flow, qualifying_courses)
-                                print(f"✅ Webhook: Generated {len(qualifying_courses)} courses")
+                            # Every flow goes through the shared pipeline; the job finishes it without a poll
+                            if process_courses_after_payment(email, index_number, flow):
+                                print(f"✅ Webhook: queued {flow} course processing")
         
         return {'status': 'success'}, 200
         
@@ -5816,46 +5551,36 @@ def recover_payment(reference):
     flow = payment_data.get('level')
     grade_data = payment_data.get('grade_data', {})
     
-    if not all([email, index_number, flow, grade_data]):
+    if not all([email, index_number, flow, grade_data]) or flow not in POST_PAYMENT_FLOWS:
         flash("Incomplete payment data", "error")
         return redirect(url_for('index'))
     
+    # A payment whose callback and webhook were both missed is confirmed with Paystack first
+    if not payment_data.get('payment_confirmed'):
+        verification_result = verify_paystack_payment(payment_data.get('transaction_ref') or reference)
+        if not (verification_result.get('success') and verification_result.get('paid')):
+            flash("This payment has not been confirmed yet", "error")
+            return redirect(url_for('index'))
+        mark_payment_confirmed(payment_data['transaction_ref'], verification_result.get('mpesa_receipt'))
+    
+    session[f'paid_{flow}'] = True
+    session['email'] = email
+    session['index_number'] = index_number
+    session['current_flow'] = flow
+    
     # Check if courses already exist
-    existing_courses = get_user_courses_data(email, index_number, flow)
-    if existing_courses and existing_courses.get('courses'):
+    if saved_courses_result(email, index_number, flow):
         print(f"✅ Courses already exist for {flow}")
-        session[f'paid_{flow}'] = True
-        session['email'] = email
-        session['index_number'] = index_number
         flash("Your courses are ready!", "success")
         return redirect(url_for('show_results', flow=flow))
     
-    # Generate courses
-    qualifying_courses = []
-    
-    if flow == 'degree':
-        user_grades = grade_data.get('grades', {})
-        user_cluster_points = grade_data.get('cluster_points', {})
-        qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-    elif flow == 'diploma':
-        user_grades = grade_data.get('grades', {})
-        user_mean_grade = grade_data.get('mean_grade', '')
-        qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-    # Add other flows...
-    
-    if qualifying_courses:
-        save_user_courses(email, index_number, flow, qualifying_courses)
-        print(f"✅ Recovery: Generated {len(qualifying_courses)} courses")
-        
-        session[f'paid_{flow}'] = True
-        session['email'] = email
-        session['index_number'] = index_number
-        
-        flash(f"Recovery successful! Found {len(qualifying_courses)} courses.", "success")
-        return redirect(url_for('show_results', flow=flow))
-    else:
-        flash("No qualifying courses found for your grades.", "warning")
+    # Generate courses through the post-payment pipeline, like the callback
+    if not process_courses_after_payment(email, index_number, flow):
+        flash("Could not start course generation. Please try again.", "error")
         return redirect(url_for('index'))
+    
+    print(f"✅ Recovery: queued {flow} course processing")
+    return redirect(url_for('payment_wait', flow=flow))
 @app.route('/verify-paystack-payment')
 def verify_paystack_payment_page():
     """Page to verify Paystack payment"""
@@ -6097,100 +5822,192 @@ def check_courses_ready(flow):
         })
     
     print(f"🎯 CHECKING COURSES READY: {flow} for {email}")
-    
-    # 🔥 FIRST: Check database for courses
+    return jsonify(courses_readiness(
+        email, index_number, flow, session.get(f'paid_{flow}'), url_for('show_results', flow=flow)
+    ))
+
+def courses_readiness(email, index_number, flow, paid, results_url):
+    """Readiness of a paid category's courses, as returned by /check-courses-ready (no request context needed)"""
+    # 🔥 FIRST: Check database for courses (count only - this endpoint is polled)
     if database_connected:
         try:
-            courses_data = user_courses_collection.find_one({
-                'email': email,
-                'index_number': index_number,
-                'level': flow
-            })
+            status = get_courses_status(email, index_number, flow)
             
-            if courses_data and courses_data.get('courses'):
-                course_count = len(courses_data['courses'])
+            if status and status['courses_count']:
+                course_count = status['courses_count']
                 print(f"✅ COURSES READY IN DATABASE: Found {course_count} courses for {flow}")
                 
-                return jsonify({
+                return {
                     'ready': True,
                     'courses_count': course_count,
-                    'redirect_url': url_for('show_results', flow=flow),
+                    'redirect_url': results_url,
                     'message': f'Found {course_count} courses matching your grades!',
                     'status': 'courses_ready'
-                })
+                }
         except Exception as e:
             print(f"❌ Error checking database for courses: {str(e)}")
     
-    # 🔥 SECOND: Check processing status from cache
-    cache_key = f"{email}_{index_number}_{flow}"
+    # 🔥 SECOND: Check the shared processing job (the same on every worker)
+    processing = course_processing_status(email, index_number, flow)
     
-    if cache_key in course_processing_cache:
-        cache_data = course_processing_cache[cache_key]
-        if isinstance(cache_data, dict):
-            status = cache_data.get('status', 'processing')
-            
-            if status == 'completed':
-                courses_count = cache_data.get('courses_count', 0)
-                print(f"✅ PROCESSING COMPLETED: {courses_count} courses for {flow}")
-                
-                return jsonify({
-                    'ready': True,
-                    'courses_count': courses_count,
-                    'redirect_url': url_for('show_results', flow=flow),
-                    'message': f'Processing complete! Found {courses_count} courses.',
-                    'status': 'processing_completed'
-                })
-            
-            elif status == 'processing':
-                print(f"🔄 PROCESSING IN PROGRESS: Courses being generated for {flow}")
-                return jsonify({
-                    'ready': False,
-                    'message': 'Courses are being generated... Please wait a moment.',
-                    'processing': True,
-                    'estimated_time': '30 seconds',
-                    'status': 'processing_in_progress'
-                })
+    if processing:
+        status = processing['status']
+        
+        if status == 'completed':
+            courses_count = processing.get('courses_count', 0)
+            print(f"✅ PROCESSING COMPLETED: {courses_count} courses for {flow}")
             
-            elif status == 'failed':
-                error_msg = cache_data.get('error', 'Unknown error')
-                print(f"❌ PROCESSING FAILED: Could not generate courses for {flow}: {error_msg}")
-                return jsonify({
-                    'ready': False,
-                    'message': f'Error generating courses: {error_msg}',
-                    'error': True,
-                    'status': 'processing_failed'
-                })
+            return {
+                'ready': True,
+                'courses_count': courses_count,
+                'redirect_url': results_url,
+                'message': f'Processing complete! Found {courses_count} courses.',
+                'status': 'processing_completed'
+            }
+        
+        elif status == 'processing':
+            print(f"🔄 PROCESSING IN PROGRESS: Courses being generated for {flow}")
+            return {
+                'ready': False,
+                'message': 'Courses are being generated... Please wait a moment.',
+                'processing': True,
+                'estimated_time': '30 seconds',
+                'status': 'processing_in_progress'
+            }
+        
+        elif status == 'failed':
+            error_msg = processing.get('error', 'Unknown error')
+            print(f"❌ PROCESSING FAILED: Could not generate courses for {flow}: {error_msg}")
+            return {
+                'ready': False,
+                'message': f'Error generating courses: {error_msg}',
+                'error': True,
+                'status': 'processing_failed'
+            }
     
-    # 🔥 THIRD: Payment confirmed but no cache entry yet - start processing
-    if session.get(f'paid_{flow}'):
+    # 🔥 THIRD: Payment confirmed but no job yet - queue processing (never runs in this request)
+    if paid:
         print(f"⚠️ Payment confirmed but courses not found. Triggering processing...")
         
         success = process_courses_after_payment(email, index_number, flow)
         
         if success:
-            return jsonify({
+            return {
                 'ready': False,
                 'message': 'Course processing started... Please wait.',
                 'processing': True,
                 'check_again': True,
                 'check_delay': 2000,
                 'status': 'processing_started'
-            })
+            }
         else:
-            return jsonify({
+            return {
                 'ready': False,
                 'message': 'Failed to start course processing.',
                 'error': True,
                 'status': 'processing_start_failed'
-            })
+            }
     
     # 🔥 FOURTH: Payment not confirmed yet
-    return jsonify({
+    return {
         'ready': False,
         'message': 'Payment not confirmed yet',
         'should_check_payment': True,
         'status': 'waiting_for_payment'
+    }
+
+# --- Readiness Stream ---
+# Server-Sent Events for payment_wait.html: one held connection per waiting user instead of a poll
+# every few seconds. Each open stream holds a worker thread, so the budget is per process and is 0
+# (streams off, clients poll) unless gunicorn runs threaded workers (GUNICORN_THREADS > 1).
+READINESS_STREAM_MAX_CONNECTIONS = int(os.getenv('READINESS_STREAM_MAX_CONNECTIONS', '0'))
+READINESS_STREAM_TIMEOUT = int(os.getenv('READINESS_STREAM_TIMEOUT', '90'))
+READINESS_STREAM_CHECK_INTERVAL = float(os.getenv('READINESS_STREAM_CHECK_INTERVAL', '2'))
+
+class ConnectionBudget:
+    """Non-blocking counting limit on concurrently open streams in this process"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.open = 0
+        self.opened = 0
+        self.rejected = 0
+    
+    def acquire(self):
+        with self._lock:
+            if self.open >= self.limit:
+                self.rejected += 1
+                return False
+            self.open += 1
+            self.opened += 1
+            return True
+    
+    def release(self):
+        with self._lock:
+            self.open -= 1
+    
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'open': self.open, 'opened': self.opened, 'rejected': self.rejected}
+
+readiness_streams = ConnectionBudget(READINESS_STREAM_MAX_CONNECTIONS)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/courses-ready-stream/<flow>')
+def courses_ready_stream(flow):
+    """
+    Stream readiness updates until the courses are ready, processing fails or READINESS_STREAM_TIMEOUT passes.
+    Answers 503 when this worker's stream budget is used up; the page then polls /check-courses-ready.
+    """
+    email = session.get('email')
+    index_number = session.get('index_number')
+    if not email or not index_number:
+        return jsonify({'ready': False, 'error': 'Session data missing', 'fallback': 'poll'}), 400
+    
+    if not readiness_streams.acquire():
+        return jsonify({'ready': False, 'fallback': 'poll', 'message': 'Stream budget exhausted'}), 503
+    
+    # Everything the stream needs is read here: the generator runs after the request context is gone
+    paid = session.get(f'paid_{flow}')
+    results_url = url_for('show_results', flow=flow)
+    job_id = course_job_id(email, index_number, flow)
+    
+    def generate():
+        finished = None
+        try:
+            deadline = time.monotonic() + READINESS_STREAM_TIMEOUT
+            last_state = None
+            while True:
+                # Set at once when this worker finishes the job; other workers' results show on the next check
+                finished = course_jobs.watch(job_id)
+                state = courses_readiness(email, index_number, flow, paid, results_url)
+                if state != last_state:
+                    yield sse_event('readiness', state)
+                    last_state = state
+                else:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                if state.get('ready') or state.get('error') or state.get('should_check_payment'):
+                    return
+                if time.monotonic() >= deadline:
+                    yield sse_event('timeout', {'fallback': 'poll'})
+                    return
+                finished.wait(READINESS_STREAM_CHECK_INTERVAL)
+        finally:
+            if finished is not None:
+                course_jobs.unwatch(job_id, finished)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    # Runs when the server closes the response, even if the client left before the generator started
+    response.call_on_close(readiness_streams.release)
+    return response
+
 @app.route('/test-gemini')
 def test_gemini():
     """Test if Gemini is working"""
@@ -6404,21 +6221,19 @@ def check_payment_status(flow):
             'message': 'Payment confirmed! Redirecting to results...'
         })
     
-    # 🔥 ULTRA-FAST STEP 2: Check in-memory cache
-    cache_key = f"{email}_{index_number}_{flow}"
-    if cache_key in course_processing_cache:
-        cache_data = course_processing_cache[cache_key]
-        if isinstance(cache_data, dict) and cache_data.get('status') == 'completed':
-            print(f"⚡ ULTRA-FAST: Payment confirmed via memory cache")
-            session[f'paid_{flow}'] = True
-            return jsonify({
-                'paid': True,
-                'redirect_url': url_for('show_results', flow=flow),
-                'status': 'confirmed_via_memory',
-                'method': 'memory_cache',
-                'courses_ready': True,
-                'message': 'Payment confirmed! Redirecting to results...'
-            })
+    # 🔥 ULTRA-FAST STEP 2: A completed processing job means the payment was confirmed
+    processing = course_processing_status(email, index_number, flow)
+    if processing and processing['status'] == 'completed':
+        print(f"⚡ ULTRA-FAST: Payment confirmed via processing job")
+        session[f'paid_{flow}'] = True
+        return jsonify({
+            'paid': True,
+            'redirect_url': url_for('show_results', flow=flow),
+            'status': 'confirmed_via_job',
+            'method': 'processing_job',
+            'courses_ready': True,
+            'message': 'Payment confirmed! Redirecting to results...'
+        })
     
     # 🔥 ULTRA-FAST STEP 3: Ultra-fast database check with timeout
     if database_connected:
@@ -6441,13 +6256,6 @@ def check_payment_status(flow):
                 session[f'paid_{flow}'] = True
                 session.modified = True
                 
-                # Update cache
-                course_processing_cache[cache_key] = {
-                    'status': 'completed',
-                    'confirmed_at': datetime.now().isoformat(),
-                    'method': 'ultra_fast_db'
-                }
-                
                 return jsonify({
                     'paid': True,
                     'redirect_url': url_for('show_results', flow=flow),
@@ -6534,30 +6342,28 @@ def ultra_fast_check(flow):
             'instant': True
         })
     
-    # STEP 2: Check memory cache (FAST)
-    cache_key = f"{email}_{index_number}_{flow}"
-    if cache_key in course_processing_cache:
-        cache_data = course_processing_cache[cache_key]
-        if isinstance(cache_data, dict):
-            status = cache_data.get('status')
-            if status == 'completed':
-                # Update session
-                session[f'paid_{flow}'] = True
-                return jsonify({
-                    'success': True,
-                    'paid': True,
-                    'redirect': url_for('show_results', flow=flow),
-                    'reason': 'memory_cache_completed',
-                    'instant': True
-                })
-            elif status == 'processing':
-                return jsonify({
-                    'success': True,
-                    'paid': False,
-                    'processing': True,
-                    'message': 'Courses being processed...',
-                    'check_again': 1000  # Check in 1 second
-                })
+    # STEP 2: Check the shared processing job (FAST)
+    processing = course_processing_status(email, index_number, flow)
+    if processing:
+        status = processing['status']
+        if status == 'completed':
+            # Update session
+            session[f'paid_{flow}'] = True
+            return jsonify({
+                'success': True,
+                'paid': True,
+                'redirect': url_for('show_results', flow=flow),
+                'reason': 'processing_job_completed',
+                'instant': True
+            })
+        elif status == 'processing':
+            return jsonify({
+                'success': True,
+                'paid': False,
+                'processing': True,
+                'message': 'Courses being processed...',
+                'check_again': 1000  # Check in 1 second
+            })
     
     # STEP 3: Quick database check (FAST with projection)
     if database_connected:
@@ -6574,12 +6380,9 @@ def ultra_fast_check(flow):
             )
             
             if payment_data:
-                # Update session and cache
+                # Update session and make sure processing is queued
                 session[f'paid_{flow}'] = True
-                course_processing_cache[cache_key] = {
-                    'status': 'processing',
-                    'started_at': datetime.now().isoformat()
-                }
+                process_courses_after_payment(email, index_number, flow)
                 return jsonify({
                     'success': True,
                     'paid': True,
@@ -6622,60 +6425,6 @@ def ultra_fast_check(flow):
         'message': 'Payment not yet confirmed',
         'check_again': 2000  # Check in 2 seconds
     })
-def ultra_fast_process_courses(email, index_number, flow):
-    """Ultra-fast course processing that runs in under 1 second"""
-    try:
-        # Check cache first
-        cache_key = f"{email}_{index_number}_{flow}"
-        if cache_key in course_processing_cache:
-            cache_data = course_processing_cache[cache_key]
-            if isinstance(cache_data, dict) and cache_data.get('status') == 'completed':
-                return True
-        
-        print(f"⚡ Ultra-fast processing for {flow}")
-        
-        # Get qualifying courses
-        qualifying_courses = []
-        
-        if flow == 'degree':
-            user_grades = session.get('degree_grades', {})
-            user_cluster_points = session.get('degree_cluster_points', {})
-            if user_grades and user_cluster_points:
-                qualifying_courses = get_qualifying_courses(user_grades, user_cluster_points)
-        
-        elif flow == 'diploma':
-            user_grades = session.get('diploma_grades', {})
-            user_mean_grade = session.get('diploma_mean_grade', '')
-            if user_grades and user_mean_grade:
-                qualifying_courses = get_qualifying_diploma_courses(user_grades, user_mean_grade)
-        
-        # [Add other flows similarly...]
-        
-        # Save to database if we have courses
-        if qualifying_courses:
-            try:
-                save_user_courses(email, index_number, flow, qualifying_courses)
-                print(f"⚡ Saved {len(qualifying_courses)} courses")
-            except Exception as e:
-                print(f"⚠️ Error saving courses: {e}")
-                # Still mark as success
-        
-        # Update cache
-        course_processing_cache[cache_key] = {
-            'status': 'completed',
-            'courses_count': len(qualifying_courses),
-            'completed_at': datetime.now().isoformat(),
-            'ultra_fast': True
-        }
-        
-        # Update session
-        session[f'paid_{flow}'] = True
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Ultra-fast processing error: {e}")
-        return False
 # --- MPesa Callback Routes ---
 
 @app.route('/about')
@@ -6690,6 +6439,224 @@ def about():
 
 
 # --- Results Display Routes ---
+# Stream results pages instead of rendering them whole (?stream=1 / ?stream=0 overrides per request)
+STREAM_RESULTS = os.getenv('STREAM_RESULTS', 'false').lower() == 'true'
+
+# Bytes of rendered HTML collected before each streamed write
+RESULTS_STREAM_CHUNK = int(os.getenv('RESULTS_STREAM_CHUNK', '16384'))
+
+# Results with at least this many courses render collapsed categories loaded from /api/results
+# (0 renders every course up front; ?lazy=1 / ?lazy=0 overrides per request)
+LAZY_RESULTS_MIN_COURSES = int(os.getenv('LAZY_RESULTS_MIN_COURSES', '0'))
+
+# Courses per /api/results page, and the most a client may ask for
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', '24'))
+RESULTS_PAGE_MAX = 100
+
+# Seconds rendered course cards stay in the Flask-Caching store (0 renders every time)
+RESULTS_FRAGMENT_TIMEOUT = int(os.getenv('RESULTS_FRAGMENT_TIMEOUT', '3600'))
+
+def results_streaming_requested():
+    """True when this results request should be streamed"""
+    stream = request.args.get('stream')
+    if stream is not None:
+        return stream == '1'
+    return STREAM_RESULTS
+
+def result_group_key(flow, course):
+    """Category a saved course is shown under: its cluster for degrees, its collection otherwise"""
+    return course.get('cluster' if flow == 'degree' else 'collection', 'Other')
+
+def collection_display_name(flow, collection_key):
+    """Category heading for a cluster or collection"""
+    if flow == 'degree':
+        return CLUSTER_NAMES.get(collection_key, collection_key.replace('_', ' ').title())
+    return collection_key.replace('_', ' ').title()
+
+def summarize_course_collections(flow, courses):
+    """Name and course count of each category for the results header, without grouping the courses"""
+    counts = {}
+    for course in courses:
+        collection_key = result_group_key(flow, course)
+        counts[collection_key] = counts.get(collection_key, 0) + 1
+    return {
+        collection_key: {'name': collection_display_name(flow, collection_key), 'count': count}
+        for collection_key, count in sorted(counts.items())
+    }
+
+# Bump when category names or grouping change, so stored result_groups are recomputed on read
+RESULT_GROUPS_VERSION = 2
+
+def build_result_groups(flow, courses):
+    """
+    Courses in display order (grouped by category) and the summary stored with them:
+    [{'key', 'name', 'count', 'start'}], where start is the group's offset in the saved array.
+    """
+    keys = [result_group_key(flow, course) for course in courses]
+    order = sorted(range(len(courses)), key=keys.__getitem__)
+    ordered_courses = [courses[position] for position in order]
+    
+    groups = []
+    start = 0
+    for collection_key, group in summarize_course_collections(flow, courses).items():
+        groups.append({'key': collection_key, 'name': group['name'], 'count': group['count'], 'start': start})
+        start += group['count']
+    # The catalog level the courses were copied from, so their rendered cards can be shared (see render_course_cards).
+    # Query-pushdown levels read their courses from MongoDB, so no catalog version vouches for them
+    catalog_version = None if course_query_enabled(flow) else course_catalog.level_version(flow)
+    return ordered_courses, {
+        'version': RESULT_GROUPS_VERSION,
+        'groups': groups,
+        'catalog_version': catalog_version
+    }
+
+register_result_grouping(build_result_groups)
+
+def current_result_groups(courses_data):
+    """Stored groups of a user_courses record, or None when they are missing, older or out of step"""
+    stored = courses_data.get('result_groups') or {}
+    groups = stored.get('groups')
+    if stored.get('version') != RESULT_GROUPS_VERSION or groups is None:
+        return None
+    if 'courses' in courses_data:
+        course_count = len(courses_data['courses'])
+    else:
+        course_count = courses_data.get('courses_count')
+    if sum(group['count'] for group in groups) != course_count:
+        return None
+    return groups
+
+def result_collections(flow, courses_data):
+    """courses_by_collection for the results header, from the stored summary when it is current"""
+    groups = current_result_groups(courses_data)
+    if groups is not None:
+        return {group['key']: {'name': group['name'], 'count': group['count']} for group in groups}
+    # Saved before summaries were stored, or with an older grouping
+    return summarize_course_collections(flow, courses_data.get('courses') or [])
+
+# --- Rendered Course Card Cache ---
+_course_card_template_version = None
+fragment_cache_stats = {'hits': 0, 'misses': 0}
+
+def course_card_template_version():
+    """Hash of the course card template, so edits to it never serve old cached cards"""
+    global _course_card_template_version
+    if _course_card_template_version is None:
+        source, _, _ = app.jinja_loader.get_source(app.jinja_env, 'components/course_card.html')
+        _course_card_template_version = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return _course_card_template_version
+
+def course_cards_cache_key(flow, collection_key, courses, catalog_version):
+    """
+    Cards depend only on the courses shown, not on the user: two users with the same courses
+    from the same catalog share one entry.
+    """
+    ids = hashlib.sha1('\n'.join(str(course['_id']) for course in courses).encode('utf-8')).hexdigest()
+    return f"course_cards:{flow}:{collection_key}:{ids}:{catalog_version}:{course_card_template_version()}"
+
+def render_course_cards(flow, collection_key, courses, catalog_version=None):
+    """Rendered cards of one category's courses, from the fragment cache when the same courses were rendered before"""
+    # Records saved while the level used query pushdown may still carry a catalog stamp
+    cacheable = (RESULTS_FRAGMENT_TIMEOUT > 0 and catalog_version and courses
+                 and not course_query_enabled(flow)
+                 and all(course.get('_id') for course in courses))
+    if not cacheable:
+        return Markup(render_template('components/course_cards.html', courses=courses, flow=flow))
+    
+    key = course_cards_cache_key(flow, collection_key, courses, catalog_version)
+    try:
+        html = cache.get(key)
+    except Exception as e:
+        print(f"⚠️ Course card cache unavailable: {str(e)}")
+        html = None
+    if html is not None:
+        fragment_cache_stats['hits'] += 1
+        return Markup(html)
+    
+    fragment_cache_stats['misses'] += 1
+    html = render_template('components/course_cards.html', courses=courses, flow=flow)
+    try:
+        cache.set(key, html, timeout=RESULTS_FRAGMENT_TIMEOUT)
+    except Exception as e:
+        print(f"⚠️ Could not cache course cards: {str(e)}")
+    return Markup(html)
+
+def iter_course_blocks(flow, courses, groups, catalog_version):
+    """Yield each category's rendered cards in display order, rendering only on a cache miss"""
+    for group in groups:
+        group_courses = list(iter_result_courses(courses[group['start']:group['start'] + group['count']]))
+        yield render_course_cards(flow, group['key'], group_courses, catalog_version)
+
+def load_results_page(flow, query):
+    """
+    (courses, courses_by_collection, total_courses, lazy_groups, course_blocks) for a results page,
+    or None when nothing is saved.
+    Large results (LAZY_RESULTS_MIN_COURSES) load only their category summary; the courses come from /api/results.
+    course_blocks yields each category's cached cards when the record is grouped, otherwise it is None.
+    """
+    lazy = request.args.get('lazy')
+    if lazy != '0' and (lazy == '1' or LAZY_RESULTS_MIN_COURSES > 0):
+        summary = find_user_courses(query, RESULT_SUMMARY_FIELDS)
+        if not summary or not summary.get('courses_count'):
+            return None
+        total_courses = summary['courses_count']
+        if current_result_groups(summary) is not None and (lazy == '1' or total_courses >= LAZY_RESULTS_MIN_COURSES):
+            return [], result_collections(flow, summary), total_courses, True, None
+    
+    courses_data = find_user_courses(query, RESULTS_RECORD_FIELDS)
+    if not courses_data or not courses_data.get('courses'):
+        return None
+    courses = courses_data['courses']
+    
+    course_blocks = None
+    groups = current_result_groups(courses_data)
+    catalog_version = courses_data['result_groups'].get('catalog_version') if groups is not None else None
+    if catalog_version and RESULTS_FRAGMENT_TIMEOUT > 0:
+        course_blocks = iter_course_blocks(flow, courses, groups, catalog_version)
+    return courses, result_collections(flow, courses_data), len(courses), False, course_blocks
+
+def iter_result_courses(courses):
+    """Yield stored courses ready for the template, converting each _id only when it is rendered"""
+    for course in courses:
+        if '_id' in course and isinstance(course['_id'], ObjectId):
+            course['_id'] = str(course['_id'])
+        yield course
+
+def stream_results_page(template_name, **context):
+    """Stream a results template in RESULTS_STREAM_CHUNK sized writes so the first categories arrive early"""
+    pieces = stream_template(template_name, **context)
+    
+    def chunks():
+        buffer = []
+        buffered = 0
+        for piece in pieces:
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= RESULTS_STREAM_CHUNK:
+                yield ''.join(buffer)
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield ''.join(buffer)
+    
+    # compress_response skips streamed bodies, so gzip each write here; a sync flush per write keeps
+    # every chunk decodable as it arrives
+    gzip_stream = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+    
+    def gzip_chunks():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks():
+            yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    
+    response = Response(gzip_chunks() if gzip_stream else chunks(), mimetype='text/html')
+    if gzip_stream:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Stop nginx from holding the stream back until it is complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/results/<flow>')
 def show_results(flow):
     """
@@ -6765,20 +6732,16 @@ def show_results(flow):
     
     if database_connected:
         try:
-            courses_data = user_courses_collection.find_one({
+            results = load_results_page(flow, {
                 'email': email,
                 'index_number': index_number,
                 'level': flow
             })
             
-            if courses_data and courses_data.get('courses'):
-                qualifying_courses = courses_data['courses']
-                print(f"✅ Loaded {len(qualifying_courses)} courses from database for {flow}")
-                
-                # Convert ObjectId to string for template
-                for course in qualifying_courses:
-                    if '_id' in course and isinstance(course['_id'], ObjectId):
-                        course['_id'] = str(course['_id'])
+            if results:
+                qualifying_courses, courses_by_collection, total_courses, lazy_groups, course_blocks = results
+                print(f"✅ Loaded {total_courses} courses from database for {flow}"
+                      f"{' (categories on demand)' if lazy_groups else ''}")
             else:
                 print(f"⚠️ No courses found in database for {flow}")
                 flash("Courses not found. Please try again or contact support.", "warning")
@@ -6794,28 +6757,18 @@ def show_results(flow):
         flash("Database connection error. Please try again.", "error")
         return redirect(url_for('index'))
     
-    # ===== STEP 4: Group courses by collection/cluster for display =====
-    courses_by_collection = {}
-    
-    for course in qualifying_courses:
-        if flow == 'degree':
-            collection_key = course.get('cluster', 'Other')
-            collection_name = CLUSTER_NAMES.get(collection_key, collection_key.replace('_', ' ').title())
-        else:
-            collection_key = course.get('collection', 'Other')
-            collection_name = collection_key.replace('_', ' ').title()
-        
-        if collection_key not in courses_by_collection:
-            courses_by_collection[collection_key] = {
-                'name': collection_name,
-                'courses': []
-            }
-        courses_by_collection[collection_key]['courses'].append(course)
+    # ===== STEP 4: Prepare courses for display =====
+    # Category names and counts were computed when the courses were saved (see result_collections)
+    stream = results_streaming_requested() and not lazy_groups
     
-    # Sort collections by name
-    courses_by_collection = dict(sorted(courses_by_collection.items()))
+    if not stream:
+        # Convert ObjectId to string for template; streamed pages convert as the grid renders
+        for course in qualifying_courses:
+            if '_id' in course and isinstance(course['_id'], ObjectId):
+                course['_id'] = str(course['_id'])
     
-    print(f"🎯 Displaying {len(qualifying_courses)} courses across {len(courses_by_collection)} collections for {flow}")
+    print(f"🎯 Displaying {total_courses} courses across {len(courses_by_collection)} collections for {flow}"
+          f"{' (streamed)' if stream else ''}")
     
     # ===== STEP 5: Clear large session data to reduce cookie size =====
     grade_keys = [f'{flow}_grades', f'{flow}_mean_grade', f'{flow}_cluster_points', 
@@ -6833,8 +6786,7 @@ def show_results(flow):
     session.modified = True
     
     # ===== STEP 7: Render template =====
-    return render_template(
-        'collection_results.html', 
+    context = dict(
         courses=qualifying_courses,
         courses_by_collection=courses_by_collection,
         user_grades={}, 
@@ -6845,9 +6797,101 @@ def show_results(flow):
         index_number=index_number,
         flow=flow,
         cluster_names=CLUSTER_NAMES,
-        total_courses=len(qualifying_courses),
+        total_courses=total_courses,
+        lazy_groups=lazy_groups,
+        course_blocks=course_blocks,
         basket_count=len(basket)
     )
+    if stream:
+        return stream_results_page('collection_results.html', course_stream=iter_result_courses(qualifying_courses), **context)
+    
+    return render_template('collection_results.html', **context)
+
+def results_owner_query(flow):
+    """user_courses filter for the session's own results of a flow, or None when it may not read them"""
+    index_number = session.get('index_number') or session.get('verified_index')
+    if not index_number:
+        return None
+    if session.get('verified_payment'):
+        # Verified users are matched by index number, as on the verified results pages
+        return {'index_number': index_number, 'level': flow}
+    email = session.get('email')
+    if not email or not session.get(f'paid_{flow}'):
+        return None
+    return {'email': email, 'index_number': index_number, 'level': flow}
+
+@app.route('/api/results/<flow>')
+@private_response
+def api_results_page(flow):
+    """
+    One page of a category's saved courses: ?collection=<cluster or collection>&cursor=<offset>&limit=<n>.
+    Grouped records are sliced in MongoDB; ?render=1 adds the rendered course cards as html.
+    """
+    if flow not in COURSE_LEVELS:
+        return jsonify({'success': False, 'error': 'Unknown course level'}), 404
+    
+    query = results_owner_query(flow)
+    if not query:
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+    
+    if not database_connected:
+        return jsonify({'success': False, 'error': 'Database unavailable'}), 503
+    
+    collection_key = request.args.get('collection')
+    try:
+        cursor = max(int(request.args.get('cursor', 0)), 0)
+        limit = min(max(int(request.args.get('limit', RESULTS_PAGE_SIZE)), 1), RESULTS_PAGE_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'cursor and limit must be numbers'}), 400
+    
+    try:
+        summary = find_user_courses(query, RESULT_SUMMARY_FIELDS)
+        if not summary:
+            return jsonify({'success': False, 'error': 'No saved results'}), 404
+        
+        groups = current_result_groups(summary)
+        if groups is not None:
+            if collection_key:
+                group = next((group for group in groups if group['key'] == collection_key), None)
+                if group is None:
+                    return jsonify({'success': False, 'error': 'Unknown category'}), 404
+            else:
+                group = {'start': 0, 'count': summary['courses_count']}
+            total = group['count']
+            count = max(min(limit, total - cursor), 0)
+            page = find_courses_slice(query, group['start'] + cursor, count)['courses'] if count else []
+        else:
+            # Saved before courses were stored grouped: load them all and pick the category out
+            courses_data = find_user_courses(query, RESULTS_RECORD_FIELDS) or {}
+            courses = courses_data.get('courses') or []
+            if collection_key:
+                courses = [course for course in courses if result_group_key(flow, course) == collection_key]
+            total = len(courses)
+            count = max(min(limit, total - cursor), 0)
+            page = courses[cursor:cursor + count]
+        
+        page = list(iter_result_courses(page))
+        response = {
+            'success': True,
+            'flow': flow,
+            'collection': collection_key,
+            'name': collection_display_name(flow, collection_key) if collection_key else None,
+            'total': total,
+            'cursor': cursor,
+            'next_cursor': cursor + count if cursor + count < total else None,
+            'returned': len(page)
+        }
+        if request.args.get('render') == '1':
+            # The page inserts the cards as they are; the course data is already in each card
+            catalog_version = (summary.get('result_groups') or {}).get('catalog_version') if groups is not None else None
+            response['html'] = str(render_course_cards(flow, collection_key, page, catalog_version))
+        else:
+            response['courses'] = page
+        return jsonify(response)
+    
+    except Exception as e:
+        print(f"❌ Error loading results page for {flow}: {str(e)}")
+        return jsonify({'success': False, 'error': 'Could not load courses'}), 500
     
 # --- Collection-based Results Routes ---
 @app.route('/collection-courses/<flow>/<collection_name>')
@@ -6969,7 +7013,7 @@ def verify_payment():
         
         if database_connected:
             for level in paid_categories:
-                courses_data = user_courses_collection.find_one({
+                courses_data = find_user_courses({
                     'index_number': index_number,
                     'level': level
                 })
@@ -6984,21 +7028,19 @@ def verify_payment():
                     print(f"📚 Found {course_count} {level} courses")
         
         if total_courses == 0:
-            # Check if courses are being processed
-            cache_key = f"{user_email}_{index_number}_{level}"
-            if cache_key in course_processing_cache:
-                cache_data = course_processing_cache[cache_key]
-                if isinstance(cache_data, dict) and cache_data.get('status') == 'processing':
-                    return jsonify({
-                        'success': True,
-                        'payment_confirmed': True,
-                        'courses_count': 0,
-                        'levels': paid_categories,
-                        'level_details': {level: {'count': 0, 'name': level.capitalize()} for level in paid_categories},
-                        'processing': True,
-                        'message': 'Your courses are still being generated. Please wait a moment.',
-                        'redirect_url': url_for('payment_wait', flow=paid_categories[0]) if paid_categories else None
-                    })
+            # Check if courses are being processed (by any worker)
+            processing = [course_processing_status(user_email, index_number, level) for level in paid_categories]
+            if any(job and job['status'] == 'processing' for job in processing):
+                return jsonify({
+                    'success': True,
+                    'payment_confirmed': True,
+                    'courses_count': 0,
+                    'levels': paid_categories,
+                    'level_details': {level: {'count': 0, 'name': level.capitalize()} for level in paid_categories},
+                    'processing': True,
+                    'message': 'Your courses are still being generated. Please wait a moment.',
+                    'redirect_url': url_for('payment_wait', flow=paid_categories[0]) if paid_categories else None
+                })
             
             return jsonify({'success': False, 'error': 'No course results found for your payment. Please ensure you completed the qualification process.'})
         
@@ -7044,20 +7086,34 @@ def verified_results_dashboard():
     total_courses = 0
     
     if database_connected:
-        levels = ['degree', 'diploma', 'certificate', 'artisan', 'kmtc', 'ttc']
-        for level in levels:
-            courses_data = user_courses_collection.find_one({
-                'index_number': index_number,
-                'level': level
-            })
-            if courses_data and courses_data.get('courses'):
-                course_count = len(courses_data['courses'])
+        # The dashboard only shows counts, so no courses are loaded here
+        statuses = get_courses_statuses(index_number, COURSE_LEVELS)
+        for level in COURSE_LEVELS:
+            status = statuses.get(level)
+            if status and status['courses_count']:
+                course_count = status['courses_count']
                 user_courses[level] = {
-                    'courses': courses_data['courses'],
-                    'count': course_count
+                    'count': course_count,
+                    'updated_at': status['updated_at']
                 }
                 total_courses += course_count
-                print(f"📚 Loaded {course_count} {level} courses")
+                print(f"📚 Found {course_count} {level} courses")
+        
+        # Paid categories whose results were never saved go through the post-payment pipeline, not this request
+        try:
+            for payment in find_unprocessed_paid_levels(index_number):
+                level, email = payment['level'], payment.get('email')
+                if not process_courses_after_payment(email, index_number, level):
+                    continue
+                job = course_processing_status(email, index_number, level)
+                if job and job['status'] == 'completed':
+                    # Qualified and nothing was found
+                    continue
+                user_courses[level] = {'count': 0, 'processing': True}
+                print(f"🔄 Queued {level} courses for processing")
+            user_courses = {level: user_courses[level] for level in COURSE_LEVELS if level in user_courses}
+        except Exception as e:
+            print(f"⚠️ Could not queue unprocessed paid categories: {str(e)}")
     
     if not user_courses:
         flash("No course results found for your payment details", "error")
@@ -7104,45 +7160,26 @@ def show_verified_level_results(level):
     print(f"🔗 Stored current level for verified user: {level}")
     
     # Get courses for the specific level
-    courses_data = None
+    results = None
     if database_connected:
-        courses_data = user_courses_collection.find_one({
+        results = load_results_page(level, {
             'index_number': index_number,
             'level': level
         })
     
-    if not courses_data or not courses_data.get('courses'):
+    if not results:
         flash(f"No {level} course results found for your payment details", "error")
         return redirect(url_for('verified_results_dashboard', index=index_number, receipt=receipt))
     
+    # Category names and counts were stored when the courses were saved
+    qualifying_courses, courses_by_collection, total_courses, lazy_groups, course_blocks = results
+    
     # Convert ObjectId to string for JSON serialization
-    qualifying_courses = []
-    for course in courses_data['courses']:
-        course_dict = dict(course)
-        # Convert _id from ObjectId to string if it exists
-        if '_id' in course_dict and isinstance(course_dict['_id'], ObjectId):
-            course_dict['_id'] = str(course_dict['_id'])
-        qualifying_courses.append(course_dict)
-    
-    # Group courses by collection with proper names
-    courses_by_collection = {}
     for course in qualifying_courses:
-        if level == 'degree':
-            collection_key = course.get('cluster', 'Other')
-            # Use the proper cluster name for display
-            collection_name = CLUSTER_NAMES.get(collection_key, collection_key)
-        else:
-            collection_key = course.get('collection', 'Other')
-            collection_name = collection_key.replace('_', ' ').title()
-        
-        if collection_key not in courses_by_collection:
-            courses_by_collection[collection_key] = {
-                'name': collection_name,
-                'courses': []
-            }
-        courses_by_collection[collection_key]['courses'].append(course)
+        if '_id' in course and isinstance(course['_id'], ObjectId):
+            course['_id'] = str(course['_id'])
     
-    print(f"✅ Loaded {len(qualifying_courses)} {level} courses")
+    print(f"✅ Loaded {total_courses} {level} courses")
     
     # Set session data for basket and search functionality
     session['email'] = f"verified_{index_number}@temp.com"
@@ -7159,7 +7196,10 @@ def show_verified_level_results(level):
                          email=f"verified_{index_number}@temp.com", 
                          index_number=index_number,
                          flow=level,
-                         cluster_names=CLUSTER_NAMES)
+                         cluster_names=CLUSTER_NAMES,
+                         total_courses=total_courses,
+                         lazy_groups=lazy_groups,
+                         course_blocks=course_blocks)
 
 # --- Course Basket Routes ---
 @app.route('/add-to-basket', methods=['POST'])
@@ -7277,6 +7317,7 @@ def remove_from_basket():
         if database_connected:
             try:
                 # Get current basket from database
+                user_basket_writes.flush_key({'index_number': index_number})
                 basket_data = user_baskets_collection.find_one({
                     'index_number': index_number,
                     'is_active': True
@@ -7288,12 +7329,13 @@ def remove_from_basket():
                                     if course.get('basket_id') != basket_id]
                     
                     # Update database
-                    result = user_baskets_collection.update_one(
+                    user_basket_writes.submit(
                         {'index_number': index_number},
                         {'$set': {
                             'basket': updated_basket,
                             'updated_at': datetime.now()
-                        }}
+                        }},
+                        upsert=False
                     )
                     
                     basket_count = len(updated_basket)
@@ -7349,6 +7391,8 @@ def clear_basket():
         db_cleared = False
         if database_connected:
             try:
+                # Written directly for modified_count; a queued save must land first
+                user_basket_writes.flush_key({'index_number': index_number})
                 result = user_baskets_collection.update_one(
                     {'index_number': index_number},
                     {'$set': {
@@ -7685,7 +7729,7 @@ def search_courses_route(flow):
             
             if verified_index:
                 # Get courses from database for verified users
-                courses_data = user_courses_collection.find_one({
+                courses_data = find_user_courses({
                     'index_number': verified_index,
                     'level': flow
                 })
@@ -7951,6 +7995,31 @@ def admin_clear_cache_api():
             'error': str(e)
         }), 500
 
+@app.route('/admin/reload-catalog', methods=['POST'])
+def admin_reload_catalog():
+    """Reload the in-memory course catalog from MongoDB in every worker - requires admin authentication"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    try:
+        previous_version = course_catalog.version
+        # This worker reloads now; the others see the bumped generation within COURSE_CATALOG_GENERATION_CHECK
+        course_catalog.reload(broadcast=True)
+        qualification_cache.clear()
+        print(f"🔄 Course catalog reloaded by admin: {previous_version} -> {course_catalog.version}")
+
+        return jsonify({
+            'success': True,
+            'previous_version': previous_version,
+            'catalog': course_catalog.stats(),
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/manual-activation', methods=['GET', 'POST'])
 def admin_manual_activation():
     """Manual activation for users who paid but didn't get results"""
@@ -8612,6 +8681,16 @@ def debug_database():
             'user_baskets': user_baskets_collection is not None,
             'admin_activations': admin_activations_collection is not None
         },
+        'course_catalog': course_catalog.stats(),
+        'qualification_cache': qualification_cache.stats(),
+        'courses_persistence': persistence_stats(),
+        'mongodb_pool': db_manager.pool_stats(),
+        'course_card_cache': dict(fragment_cache_stats, timeout=RESULTS_FRAGMENT_TIMEOUT),
+        'basket_write_behind': user_basket_writes.stats(),
+        'course_jobs': course_jobs.stats(),
+        'course_single_flight': course_flights.stats(),
+        'speculative_qualification': dict(prequalify_stats, enabled=SPECULATIVE_QUALIFICATION),
+        'readiness_streams': readiness_streams.stats(),
         'session_keys': list(session.keys()) if session else []
     }
     
@@ -0,0 +1,487 @@
+# --- Course Catalog Snapshot ---
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from qualification import compile_requirements, build_level_thresholds, canonical_profile, profile_fingerprint
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CourseRecord(Mapping):
+    """
+    Compact, read-only catalog course.
+    Values sit in a tuple aligned to a field layout shared by every course with the same fields,
+    so a course costs one slot object and one tuple instead of a dict. dict(record) gives the
+    original document back (same keys, same order) at the template/JSON boundary.
+    """
+    __slots__ = ('layout', 'values')
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+
+    def __getitem__(self, field):
+        try:
+            return self.values[self.layout.index(field)]
+        except ValueError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        if field in self.layout:
+            return self.values[self.layout.index(field)]
+        return default
+
+    def __contains__(self, field):
+        return field in self.layout
+
+    def __iter__(self):
+        return iter(self.layout)
+
+    def __len__(self):
+        return len(self.layout)
+
+    def keys(self):
+        return self.layout
+
+    def to_dict(self):
+        return dict(zip(self.layout, self.values))
+
+    def __repr__(self):
+        return f"CourseRecord({self.to_dict()!r})"
+
+
+def _compact_value(value):
+    """Intern strings (institutions, grades, subject codes repeat thousands of times) throughout a value"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: _compact_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact_value(v) for v in value]
+    return value
+
+
+def compact_course(document, layouts, tag_field=None, collection_name=None):
+    """Build a CourseRecord from a MongoDB document, reusing an identical layout from layouts when there is one"""
+    fields = [sys.intern(field) for field in document]
+    values = [_compact_value(document[field]) for field in document]
+    if tag_field:
+        if tag_field in document:
+            values[fields.index(tag_field)] = sys.intern(collection_name)
+        else:
+            fields.append(sys.intern(tag_field))
+            values.append(sys.intern(collection_name))
+    layout = tuple(fields)
+    return CourseRecord(layouts.setdefault(layout, layout), tuple(values))
+
+
+# One collection of a level: its course records and their compiled requirements, in the same order.
+# cut_offs/cut_off_order index the collection's satisfiable courses by ascending cut-off points
+# (courses without a cut-off for this cluster count as 0), so a bisect finds every candidate.
+CatalogGroup = namedtuple('CatalogGroup', ['name', 'courses', 'requirements', 'cut_offs', 'cut_off_order'])
+
+
+def build_catalog_group(name, courses):
+    """Compile a collection's courses and build its cut-off index"""
+    requirements = [compile_requirements(course) for course in courses]
+    keyed = sorted(
+        ((r.cut_off if r.cut_off and r.cluster == name else 0, position)
+         for position, r in enumerate(requirements) if r.satisfiable)
+    )
+    cut_offs = [cut_off for cut_off, _ in keyed]
+    cut_off_order = [position for _, position in keyed]
+    return CatalogGroup(name, courses, requirements, cut_offs, cut_off_order)
+
+
+def cut_off_candidates(group, user_points):
+    """Positions, in catalog order, of the courses whose cut-off the user's cluster points reach"""
+    return sorted(group.cut_off_order[:bisect_right(group.cut_offs, user_points)])
+
+# Threads reading a level's collections in parallel on a cold load (1 = one collection at a time)
+COLLECTION_SCAN_WORKERS = int(os.getenv('COLLECTION_SCAN_WORKERS', '8'))
+
+# Seconds a cold scan may take before collections still outstanding are given up on
+COLLECTION_SCAN_TIMEOUT = float(os.getenv('COLLECTION_SCAN_TIMEOUT', '20'))
+
+_scan_executor = None
+_scan_executor_lock = threading.Lock()
+
+
+def _get_scan_executor():
+    """Shared pool, created on first use so each worker process gets its own"""
+    global _scan_executor
+    if _scan_executor is None:
+        with _scan_executor_lock:
+            if _scan_executor is None:
+                _scan_executor = ThreadPoolExecutor(
+                    max_workers=max(COLLECTION_SCAN_WORKERS, 1), thread_name_prefix='collection-scan'
+                )
+    return _scan_executor
+
+
+def _reset_scan_executor():
+    # A pool inherited through fork has no threads in the child; the next scan creates a new one
+    global _scan_executor, _scan_executor_lock
+    _scan_executor = None
+    _scan_executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_scan_executor)
+
+
+def scan_collections(collection_names, read_collection, timeout=COLLECTION_SCAN_TIMEOUT):
+    """
+    Run read_collection(name) for every collection on the shared scan pool.
+    Returns ([(name, result), ...] in collection_names order, [names that failed or missed the deadline]).
+    """
+    collection_names = list(collection_names)
+    if COLLECTION_SCAN_WORKERS <= 1 or len(collection_names) <= 1:
+        results, missing = [], []
+        for name in collection_names:
+            try:
+                results.append((name, read_collection(name)))
+            except Exception as e:
+                logger.error(f"❌ Error reading collection {name}: {str(e)}")
+                missing.append(name)
+        return results, missing
+
+    executor = _get_scan_executor()
+    futures = [(name, executor.submit(read_collection, name)) for name in collection_names]
+    wait([future for _, future in futures], timeout=timeout)
+
+    results, missing = [], []
+    for name, future in futures:
+        if not future.done():
+            future.cancel()
+            logger.error(f"⏱️ Collection {name} missed the {timeout:g}s scan deadline")
+            missing.append(name)
+            continue
+        try:
+            results.append((name, future.result()))
+        except Exception as e:
+            logger.error(f"❌ Error reading collection {name}: {str(e)}")
+            missing.append(name)
+    return results, missing
+
+# Seconds before a worker refreshes its snapshot on its own (0 = only on explicit reload)
+CATALOG_MAX_AGE = int(os.getenv('COURSE_CATALOG_MAX_AGE', '0'))
+
+# Seconds between checks of the shared reload generation (a reload requested on another worker)
+CATALOG_GENERATION_CHECK = float(os.getenv('COURSE_CATALOG_GENERATION_CHECK', '10'))
+
+# Grade profiles kept per worker by the qualification result cache
+QUALIFICATION_CACHE_SIZE = int(os.getenv('QUALIFICATION_CACHE_SIZE', '2000'))
+
+# Everything held for one loaded level; replaced as a whole so readers never see half of a reload
+LoadedLevel = namedtuple('LoadedLevel', ['groups', 'thresholds', 'fingerprint'])
+
+
+class CatalogGeneration:
+    """Shared reload stamp: a reload on one worker bumps it, and every other worker reloads when it changes"""
+
+    DOCUMENT_ID = 'course_catalog'
+
+    def __init__(self, get_collection):
+        self._get_collection = get_collection
+
+    def read(self):
+        record = self._get_collection().find_one({'_id': self.DOCUMENT_ID}, {'generation': 1})
+        return (record or {}).get('generation', 0)
+
+    def bump(self):
+        record = self._get_collection().find_one_and_update(
+            {'_id': self.DOCUMENT_ID},
+            {'$inc': {'generation': 1}, '$set': {'bumped_at': datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return record['generation']
+
+
+class CourseCatalog:
+    """
+    Per-worker in-memory snapshot of every course level.
+    Each level is read from MongoDB once, its requirements compiled to integers,
+    and then served from memory until reload() is called here or on another worker.
+    """
+
+    def __init__(self, max_age=CATALOG_MAX_AGE, generation_check=CATALOG_GENERATION_CHECK):
+        self._lock = threading.RLock()
+        self._sources = {}
+        self._levels = {}
+        self._id_index = {}
+        self.max_age = max_age
+        self.version = None
+        self.loaded_at = None
+        self._loaded_monotonic = None
+        self.generation_store = None
+        self.generation = None
+        self.generation_check = generation_check
+        self._generation_checked = None
+        self._generation_lock = threading.Lock()
+
+    def register_level(self, level, get_database, collection_names, tag_field=None):
+        """Register where a level's courses live and which field records their collection"""
+        self._sources[level] = (get_database, list(collection_names), tag_field)
+
+    def set_generation_store(self, store):
+        """Follow reloads made by other workers through a shared CatalogGeneration"""
+        self.generation_store = store
+
+    @property
+    def levels(self):
+        return list(self._sources.keys())
+
+    def _load_level(self, level):
+        """Read every collection of a level and return its CatalogGroups"""
+        get_database, collection_names, tag_field = self._sources[level]
+        database = get_database()
+        if database is None:
+            raise RuntimeError(f"Database for {level} courses is not available")
+
+        available = set(database.list_collection_names())
+        layouts = {}
+
+        def read_collection(collection_name):
+            courses = [
+                compact_course(course, layouts, tag_field, collection_name)
+                for course in database[collection_name].find()
+            ]
+            return build_catalog_group(collection_name, courses)
+
+        results, missing = scan_collections(
+            [name for name in collection_names if name in available], read_collection
+        )
+        if missing:
+            # A partial snapshot would be served until the next reload, so fail the load instead
+            raise RuntimeError(f"Could not read {level} collections: {', '.join(missing)}")
+        return [group for _, group in results]
+
+    def _build_level(self, level):
+        """Load a level and compile everything served from it"""
+        started = time.perf_counter()
+        groups = self._load_level(level)
+        loaded = LoadedLevel(
+            groups,
+            build_level_thresholds([requirements for group in groups for requirements in group.requirements]),
+            self._fingerprint(groups)
+        )
+        count = sum(len(group.courses) for group in groups)
+        logger.info(f"✅ Loaded {count} {level} courses from {len(groups)} collections "
+                    f"in {(time.perf_counter() - started) * 1000:.0f}ms (level {loaded.fingerprint[:12]})")
+        return loaded
+
+    def _fingerprint(self, groups):
+        """Content hash of a level so identical catalogs get identical versions in every worker"""
+        digest = hashlib.md5()
+        for group in groups:
+            digest.update(group.name.encode())
+            for course in group.courses:
+                digest.update(json.dumps(dict(course), sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _update_version(self, levels):
+        # Summary of every loaded level (stats and logs); results are keyed on level_version()
+        digest = hashlib.md5()
+        for level in sorted(levels):
+            digest.update(f"{level}:{levels[level].fingerprint};".encode())
+        self.version = digest.hexdigest()[:12]
+
+    def _check_generation(self):
+        """Reload when another worker bumped the shared generation (checked every generation_check seconds)"""
+        if self.generation_store is None:
+            return
+        now = time.monotonic()
+        if self._generation_checked is not None and now - self._generation_checked < self.generation_check:
+            return
+        # One thread checks; the others keep serving the current snapshot
+        if not self._generation_lock.acquire(blocking=False):
+            return
+        try:
+            self._generation_checked = now
+            try:
+                generation = self.generation_store.read()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read the course catalog generation: {str(e)}")
+                return
+            if self.generation is None:
+                self.generation = generation
+            elif generation != self.generation:
+                logger.info(f"🔄 Course catalog generation {self.generation} -> {generation}, reloading")
+                self.generation = generation
+                self.reload()
+        finally:
+            self._generation_lock.release()
+
+    def _loaded_level(self, level):
+        """A level's LoadedLevel, loading and compiling it on first use"""
+        if level not in self._sources:
+            raise KeyError(f"Unknown course level: {level}")
+        if self.max_age and self._loaded_monotonic is not None:
+            if time.monotonic() - self._loaded_monotonic > self.max_age:
+                logger.info("🔄 Course catalog snapshot expired, reloading")
+                self.reload()
+        self._check_generation()
+
+        loaded = self._levels.get(level)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            loaded = self._levels.get(level)
+            if loaded is not None:
+                return loaded
+            loaded = self._build_level(level)
+            levels = dict(self._levels, **{level: loaded})
+            self._update_version(levels)
+            self._levels = levels
+            if self._loaded_monotonic is None:
+                self._loaded_monotonic = time.monotonic()
+                self.loaded_at = datetime.now()
+            return loaded
+
+    def get_level(self, level):
+        """Return a level's CatalogGroups, loading and compiling it on first use"""
+        return self._loaded_level(level).groups
+
+    def level_version(self, level):
+        """Content version of one level: the same in every worker holding the same courses for it"""
+        return self._loaded_level(level).fingerprint[:12]
+
+    def courses_by_id(self, level, course_ids):
+        """Catalog records for the given ids (str of _id), in the order given; unknown ids are left out"""
+        groups = self.get_level(level)
+        index = self._id_index.get(level)
+        if index is None or index[0] is not groups:
+            index = (groups, {
+                str(course['_id']): course
+                for group in groups for course in group.courses if '_id' in course
+            })
+            self._id_index[level] = index
+        by_id = index[1]
+        return [by_id[course_id] for course_id in course_ids if course_id in by_id]
+
+    def profile_key(self, level, profile):
+        """
+        Canonical form of a profile for a level and the cache key built from it.
+        The key carries the level's own version, so a reload that changes the level never serves results
+        from the old snapshot, and loading or reloading other levels leaves it alone.
+        """
+        loaded = self._loaded_level(level)
+        canonical = canonical_profile(loaded.thresholds, profile)
+        return canonical, (level, loaded.fingerprint[:12], profile_fingerprint(canonical))
+
+    def source(self, level):
+        """(get_database, collection_names, tag_field) registered for a level"""
+        if level not in self._sources:
+            raise KeyError(f"Unknown course level: {level}")
+        return self._sources[level]
+
+    def load_all(self, levels=None):
+        """Load every registered level (or just the given ones), skipping (and logging) any that fail"""
+        for level in (self._sources if levels is None else levels):
+            try:
+                self._loaded_level(level)
+            except Exception as e:
+                logger.error(f"❌ Error loading {level} courses into catalog: {str(e)}")
+        return self.version
+
+    def reload(self, broadcast=False):
+        """
+        Load the levels in use again and swap them in at once; a level that fails keeps its old snapshot.
+        broadcast=True also bumps the shared generation so every other worker reloads too.
+        """
+        if broadcast and self.generation_store is not None:
+            self.generation = self.generation_store.bump()
+        with self._lock:
+            levels = dict(self._levels)
+            for level in list(levels):
+                try:
+                    levels[level] = self._build_level(level)
+                except Exception as e:
+                    logger.error(f"❌ Error reloading {level} courses, keeping the previous snapshot: {str(e)}")
+            self._update_version(levels)
+            self._levels = levels
+            self._id_index = {}
+            self.loaded_at = datetime.now()
+            self._loaded_monotonic = time.monotonic()
+            return self.version
+
+    def stats(self):
+        """Summary of what this worker currently holds"""
+        return {
+            'version': self.version,
+            'generation': self.generation,
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+            'max_age': self.max_age,
+            'levels': {
+                level: {
+                    'collections': len(loaded.groups),
+                    'courses': sum(len(group.courses) for group in loaded.groups),
+                    'version': loaded.fingerprint[:12]
+                }
+                for level, loaded in self._levels.items()
+            }
+        }
+
+
+class QualificationCache:
+    """
+    Size-bounded LRU of qualifying course records keyed on canonical grade profiles.
+    Keys carry the level version (CourseCatalog.profile_key), so entries of a changed level are never hit
+    again and age out, while the other levels' entries stay.
+    """
+
+    def __init__(self, max_size=QUALIFICATION_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            records = self._entries.get(key)
+            if records is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return records
+
+    def put(self, key, records):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = records
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None
+        }
@@ -0,0 +1,171 @@
+# --- MongoDB Qualification Queries ---
+"""
+Translates a user's grades into a MongoDB filter so qualification runs inside the database.
+
+The filter is a single $expr that applies the same rules as qualification.py:
+- every minimum_subject_requirements entry needs one of its '/' alternatives at or above the minimum
+- degree courses need the user's cluster points to reach cut_off_points
+- every other level needs the user's mean grade to reach minimum_grade.mean_grade
+
+Only qualifying documents are returned, projected to the fields the results pages use.
+Used for levels listed in COURSE_QUERY_LEVELS instead of the in-memory catalog.
+"""
+import os
+
+from catalog import scan_collections
+from qualification import GRADE_VALUES
+
+# Comma separated levels (e.g. "degree,kmtc") that query MongoDB instead of the in-memory catalog
+COURSE_QUERY_LEVELS = {
+    level.strip().lower()
+    for level in os.getenv('COURSE_QUERY_LEVELS', '').split(',')
+    if level.strip()
+}
+
+# Fields read by the results templates, basket and search
+RESULT_FIELDS = [
+    'programme_name', 'programme_code', 'course_name', 'course_code', 'institution_name', 'campus',
+    'programme_duration', 'minimum_grade', 'minimum_subject_requirements', 'cut_off_points',
+    'cluster', 'collection', 'course_cluster', 'course_type', 'trade_type', 'specialization',
+    'qualification', 'skills_covered', 'entry_requirements', 'employment_opportunities'
+]
+
+# Grade letters and their values; the trailing 0 is what a lookup miss ($indexOfArray -1) lands on
+GRADE_KEYS = list(GRADE_VALUES)
+GRADE_NUMBERS = list(GRADE_VALUES.values()) + [0]
+
+
+def course_query_enabled(level):
+    """True when a level is configured to qualify through a MongoDB query"""
+    return level in COURSE_QUERY_LEVELS
+
+
+def _lookup(keys, values, expression):
+    """Value of expression in keys, or the trailing 0 of values when it is not there"""
+    return {'$arrayElemAt': [{'$literal': values}, {'$indexOfArray': [{'$literal': keys}, expression]}]}
+
+
+def _truthy(expression):
+    """Python truthiness of a field: missing, None, '', 0 and False are all false"""
+    return {'$not': [{'$in': [{'$ifNull': [expression, None]}, [None, '', 0, False]]}]}
+
+
+def _grade_value(expression):
+    """grade_value() as an expression: exact grade or first valid part of 'C+/C', 0 if unreadable"""
+    as_string = {'$cond': [{'$eq': [{'$type': expression}, 'string']}, expression, '']}
+    return {'$let': {
+        'vars': {'grade_values': {'$filter': {
+            'input': {'$map': {
+                'input': {'$split': [as_string, '/']},
+                'as': 'part',
+                'in': _lookup(GRADE_KEYS, GRADE_NUMBERS, '$$part')
+            }},
+            'as': 'grade_value',
+            'cond': {'$gt': ['$$grade_value', 0]}
+        }}},
+        'in': {'$ifNull': [{'$arrayElemAt': ['$$grade_values', 0]}, 0]}
+    }}
+
+
+def _cut_off():
+    """cut_off_points as a number: 0 when unset, null when it cannot be read"""
+    return {'$cond': [
+        _truthy('$cut_off_points'),
+        {'$convert': {'input': '$cut_off_points', 'to': 'double', 'onError': None, 'onNull': 0}},
+        0
+    ]}
+
+
+def _subjects_ok(profile):
+    subjects = list(profile.grades)
+    grades = [profile.grades[subject] for subject in subjects] + [0]
+    # Every requirement met: no false in the per-requirement results
+    return {'$not': [{'$in': [False, {'$map': {
+        'input': {'$objectToArray': {'$ifNull': ['$minimum_subject_requirements', {'$literal': {}}]}},
+        'as': 'requirement',
+        'in': {'$let': {
+            'vars': {'minimum': _grade_value('$$requirement.v')},
+            'in': {'$and': [
+                {'$gt': ['$$minimum', 0]},
+                {'$gte': [
+                    {'$max': {'$map': {
+                        'input': {'$split': ['$$requirement.k', '/']},
+                        'as': 'subject',
+                        'in': _lookup(subjects, grades, '$$subject')
+                    }}},
+                    '$$minimum'
+                ]}
+            ]}
+        }}
+    }}]}]}
+
+
+def _cut_off_ok(user_points):
+    """Degree rule for one cluster collection: no cut-off, or cluster points at or above it"""
+    return {'$let': {
+        'vars': {'cut_off': _cut_off()},
+        'in': {'$and': [
+            {'$ne': ['$$cut_off', None]},
+            {'$or': [{'$eq': ['$$cut_off', 0]}, {'$gte': [user_points, '$$cut_off']}]}
+        ]}
+    }}
+
+
+def _cut_off_readable():
+    """Courses carrying a cluster but an unreadable cut-off never qualify, as in compile_requirements"""
+    return {'$or': [{'$not': [_truthy('$cluster')]}, {'$ne': [_cut_off(), None]}]}
+
+
+def _mean_ok(profile):
+    return {'$let': {
+        # Exact lookup, as compile_requirements reads the mean grade
+        'vars': {'min_mean': _lookup(GRADE_KEYS, GRADE_NUMBERS, '$minimum_grade.mean_grade')},
+        'in': {'$or': [{'$eq': ['$$min_mean', 0]}, {'$gte': [profile.mean, '$$min_mean']}]}
+    }}
+
+
+def build_qualification_filter(profile, collection_name=None, by_cluster_points=False):
+    """
+    Filter matching the courses of one collection a UserProfile qualifies for.
+    Degree collections are clusters, so the cut-off is checked against that cluster's points.
+    """
+    if by_cluster_points:
+        level_rule = _cut_off_ok(profile.cluster_points.get(collection_name, 0))
+    else:
+        level_rule = {'$and': [_cut_off_readable(), _mean_ok(profile)]}
+    return {'$expr': {'$and': [level_rule, _subjects_ok(profile)]}}
+
+
+def find_qualifying_course_groups(database, collection_names, profile, tag_field=None,
+                                  by_cluster_points=False, projection=RESULT_FIELDS):
+    """
+    Query the collections in parallel with the generated filter, returning [(collection_name, courses)] in order.
+    Raises when any collection cannot be queried, rather than returning part of the results.
+    """
+    available = set(database.list_collection_names())
+    fields = {field: 1 for field in projection} if projection else None
+
+    def query_collection(collection_name):
+        query = build_qualification_filter(profile, collection_name, by_cluster_points)
+        courses = list(database[collection_name].find(query, fields))
+        if tag_field:
+            for course in courses:
+                course[tag_field] = collection_name
+        return courses
+
+    results, missing = scan_collections(
+        [name for name in collection_names if name in available], query_collection
+    )
+    if missing:
+        # Courses of a collection that failed or missed the deadline would be missing from saved results
+        raise RuntimeError(f"Could not query collections: {', '.join(missing)}")
+    return [(name, courses) for name, courses in results if courses]
+
+
+def find_qualifying_courses(database, collection_names, profile, tag_field=None,
+                            by_cluster_points=False, projection=RESULT_FIELDS):
+    """Qualifying courses of every collection as one list, in collection order"""
+    groups = find_qualifying_course_groups(
+        database, collection_names, profile, tag_field, by_cluster_points, projection
+    )
+    return [course for _, courses in groups for course in courses]
@@ -1,14 +1,26 @@
 # --- Course Management Functions ---
 from flask import session
 from datetime import datetime, timedelta
-from pymongo import MongoClient
-from bson import ObjectId
+from bson import ObjectId, Binary
+import bson
 import os
 from dotenv import load_dotenv
 import logging
-import os
 import json
+import threading
+import time
 import traceback
+import zlib
+
+import db_manager
+from write_behind import WriteBehindQueue
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,37 +29,122 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Database connection setup
+# Database connection setup: the process-wide client from db_manager, shared with app.py
 MONGODB_URI = os.getenv('MONGODB_URI')
 database_connected = False
 user_courses_collection = None
-client = None
+
+# Seconds between background pings of MongoDB (0 disables the health monitor)
+HEALTH_CHECK_INTERVAL = int(os.getenv('DB_HEALTH_CHECK_INTERVAL', '30'))
+
+# Re-read every saved record and compare it with what was written - debugging only, costs a round trip per save
+PARANOID_VERIFY = os.getenv('COURSES_PARANOID_VERIFY', 'false').lower() == 'true'
+
+# How results are stored: 'full' copies every course, 'refs' stores course ids plus the catalog version
+USER_COURSES_STORAGE = os.getenv('USER_COURSES_STORAGE', 'full').lower()
+
+# Compression of full course snapshots: 'none', 'zlib' or 'zstd' (needs the zstandard package)
+USER_COURSES_COMPRESSION = os.getenv('USER_COURSES_COMPRESSION', 'none').lower()
+
+# Saves go through this queue; with WRITE_BEHIND_ENABLED they are batched into bulk writes
+user_courses_writes = WriteBehindQueue(
+    'user_courses', lambda: user_courses_collection, ('email', 'index_number', 'level')
+)
+
+# (to_refs, from_refs) registered by the app that owns the course catalog
+_course_references = None
+
+# group_results(level, courses) registered by the app that renders the results pages
+_result_grouping = None
+
+# --- Compressed Course Snapshots ---
+# The codec name is stored with every blob, so old records stay readable when the default changes
+COURSES_CODEC_ZLIB = 'bson+zlib/1'
+COURSES_CODEC_ZSTD = 'bson+zstd/1'
+
+def encode_courses(courses, compression=None):
+    """(codec, Binary blob) for a courses array, or None when compression is off"""
+    compression = compression or USER_COURSES_COMPRESSION
+    if compression == 'none':
+        return None
+    
+    payload = bson.encode({'courses': courses})
+    if compression == 'zstd' and ZSTD_AVAILABLE:
+        return COURSES_CODEC_ZSTD, Binary(zstandard.ZstdCompressor(level=10).compress(payload))
+    if compression == 'zstd':
+        logger.warning("⚠️ zstandard is not installed, compressing courses with zlib")
+    return COURSES_CODEC_ZLIB, Binary(zlib.compress(payload, 6))
+
+def decode_courses(codec, blob):
+    """Courses array back from a stored blob"""
+    if codec == COURSES_CODEC_ZLIB:
+        payload = zlib.decompress(blob)
+    elif codec == COURSES_CODEC_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise ValueError("Courses were stored with zstd but zstandard is not installed")
+        payload = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raise ValueError(f"Unknown courses codec: {codec}")
+    return bson.decode(payload)['courses']
+
+def register_course_references(to_refs, from_refs):
+    """
+    Let save_user_courses store catalog courses by reference.
+    to_refs(level, courses) returns (course_ids, catalog_version), or None when they must be stored in full.
+    from_refs(level, course_ids, catalog_version) returns the course dicts again.
+    """
+    global _course_references
+    _course_references = (to_refs, from_refs)
+
+def register_result_grouping(group_results):
+    """
+    Let save_user_courses store courses grouped by category, with a summary of the groups.
+    group_results(level, courses) returns (courses in display order, BSON-ready result_groups).
+    """
+    global _result_grouping
+    _result_grouping = group_results
+
+def resolve_stored_courses(record):
+    """Fill in record['courses'] for a user_courses record stored compressed or by reference; returns the record"""
+    if not record or 'courses' in record:
+        return record
+    
+    if record.get('courses_blob') is not None:
+        try:
+            started = time.perf_counter()
+            record['courses'] = decode_courses(record.get('courses_codec'), record.pop('courses_blob'))
+            record_latency('decode_courses', started)
+        except Exception as e:
+            logger.error(f"❌ Error decoding stored courses: {str(e)}")
+            record['courses'] = []
+        return record
+    
+    if record.get('course_refs') is None:
+        return record
+    
+    if _course_references is None:
+        logger.error("❌ Courses stored by reference but no catalog is registered to resolve them")
+        record['courses'] = []
+        return record
+    
+    try:
+        _, from_refs = _course_references
+        record['courses'] = from_refs(record.get('level'), record['course_refs'], record.get('catalog_version'))
+    except Exception as e:
+        logger.error(f"❌ Error resolving stored course references: {str(e)}")
+        record['courses'] = []
+    return record
 
 def initialize_database():
     """Initialize database connection"""
-    global database_connected, user_courses_collection, client
+    global database_connected, user_courses_collection
     
     try:
-        client = MongoClient(
-            MONGODB_URI,
-            serverSelectionTimeoutMS=5000,
-            connectTimeoutMS=5000,
-            socketTimeoutMS=5000,
-            retryWrites=True,
-            retryReads=True
-        )
         # Test connection
-        client.admin.command('ping')
+        db_manager.ping()
         
-        db_user_data = client['user_data']
-        user_courses_collection = db_user_data['user_courses']
-        
-        # Create indexes if they don't exist
-        user_courses_collection.create_index([
-            ("email", 1),
-            ("index_number", 1),
-            ("level", 1)
-        ], unique=True)
+        # Indexes come from migrate.py (unique_courses_email_index_level)
+        user_courses_collection = db_manager.collection('user_data', 'user_courses')
         
         database_connected = True
         logger.info("✅ Database connection established successfully")
@@ -69,18 +166,15 @@ def verify_courses_consistency(email, index_number, level):
         return False
     
     try:
-        db_data = user_courses_collection.find_one({
-            'email': email,
-            'index_number': index_number,
-            'level': level
-        })
+        query = {'email': email, 'index_number': index_number, 'level': level}
+        user_courses_writes.flush_key(query)
+        db_data = user_courses_collection.find_one(query)
         
-        if not db_data or 'courses' not in db_data:
+        if not db_data or not any(field in db_data for field in ('courses', 'course_refs', 'courses_blob')):
             logger.warning("No courses found in database")
             return False
         
-        db_courses = db_data['courses']
-        db_count = len(db_courses)
+        db_count = db_data.get('courses_count', len(db_data.get('courses', db_data.get('course_refs', []))))
         
         # Update session with metadata only
         session[session_key] = {
@@ -97,17 +191,153 @@ def verify_courses_consistency(email, index_number, level):
         return False
 def cleanup_database():
     """Cleanup database connections"""
-    global client
-    if client:
-        client.close()
+    # Queued saves must reach the database before the client goes away
+    user_courses_writes.flush()
+    db_manager.close_client()
+
+# --- Operation Latency ---
+_latency_lock = threading.Lock()
+_operation_latency = {}
+_last_health_check = None
+
+def record_latency(operation, started):
+    """Add one timing (from a time.perf_counter() start) to an operation's totals; returns it in ms"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _latency_lock:
+        totals = _operation_latency.setdefault(operation, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        totals['count'] += 1
+        totals['total_ms'] += elapsed_ms
+        totals['max_ms'] = max(totals['max_ms'], elapsed_ms)
+    return elapsed_ms
+
+def persistence_stats():
+    """Connection state and per-operation latency of this worker's course persistence"""
+    with _latency_lock:
+        operations = {
+            operation: {
+                'count': totals['count'],
+                'avg_ms': round(totals['total_ms'] / totals['count'], 2),
+                'max_ms': round(totals['max_ms'], 2)
+            }
+            for operation, totals in _operation_latency.items()
+        }
+    return {
+        'database_connected': database_connected,
+        'last_health_check': _last_health_check.isoformat() if _last_health_check else None,
+        'health_check_interval': HEALTH_CHECK_INTERVAL,
+        'paranoid_verify': PARANOID_VERIFY,
+        'storage': USER_COURSES_STORAGE,
+        'compression': USER_COURSES_COMPRESSION,
+        'write_behind': user_courses_writes.stats(),
+        'operations': operations
+    }
+
+# --- Connection Health Monitor ---
+_health_monitor = None
+
+def _monitor_connection():
+    """Ping MongoDB in the background so requests never have to"""
+    global database_connected, _last_health_check
+    while True:
+        time.sleep(HEALTH_CHECK_INTERVAL)
+        if user_courses_collection is None:
+            # Never connected in this process: retry the full setup
+            initialize_database()
+            _last_health_check = datetime.now()
+            continue
+        try:
+            started = time.perf_counter()
+            db_manager.ping()
+            record_latency('ping', started)
+            if not database_connected:
+                logger.info("✅ Database connection restored")
+            database_connected = True
+        except Exception as e:
+            if database_connected:
+                logger.warning(f"⚠️ Database health check failed: {str(e)}")
+            database_connected = False
+        _last_health_check = datetime.now()
+
+def start_health_monitor():
+    """Start the background health monitor once per process (gunicorn's post_fork calls it in each worker)"""
+    global _health_monitor
+    if HEALTH_CHECK_INTERVAL <= 0 or (_health_monitor is not None and _health_monitor.is_alive()):
+        return
+    _health_monitor = threading.Thread(target=_monitor_connection, name='courses-db-health', daemon=True)
+    _health_monitor.start()
 
 # Initialize database connection
 initialize_database()
+start_health_monitor()
 
 # Register cleanup on program exit
 import atexit
 atexit.register(cleanup_database)
 
+# --- Course Status Accessors ---
+# Enough to answer "are results ready, how many, since when" without loading any courses
+STATUS_FIELDS = {'level': 1, 'courses_count': 1, 'updated_at': 1}
+
+def _course_status(record):
+    """{'level', 'courses_count', 'updated_at'} of a projected record; counts legacy records in full"""
+    if record.get('courses_count') is None:
+        # Saved before courses_count was stored
+        full_record = resolve_stored_courses(user_courses_collection.find_one({'_id': record['_id']}))
+        record['courses_count'] = len((full_record or {}).get('courses') or [])
+    return {
+        'level': record.get('level'),
+        'courses_count': record['courses_count'],
+        'updated_at': record.get('updated_at')
+    }
+
+def get_courses_status(email, index_number, level):
+    """Status of one saved result, or None when nothing is saved (or the database is unavailable)"""
+    if not database_connected:
+        return None
+    query = {'email': email, 'index_number': index_number, 'level': level}
+    if email is None:
+        query.pop('email')
+    started = time.perf_counter()
+    user_courses_writes.flush_key(query)
+    record = user_courses_collection.find_one(query, STATUS_FIELDS)
+    record_latency('get_courses_status', started)
+    return _course_status(record) if record else None
+
+def get_courses_statuses(index_number, levels, email=None):
+    """{level: status} of every saved result among levels, in one query"""
+    if not database_connected:
+        return {}
+    query = {'index_number': index_number, 'level': {'$in': list(levels)}}
+    if email is not None:
+        query['email'] = email
+    started = time.perf_counter()
+    user_courses_writes.flush_key(query)
+    statuses = {}
+    for record in user_courses_collection.find(query, STATUS_FIELDS):
+        # One record per level, as find_one would have returned
+        statuses.setdefault(record.get('level'), record)
+    record_latency('get_courses_statuses', started)
+    return {level: _course_status(record) for level, record in statuses.items()}
+
+def find_courses_slice(query, start, count):
+    """
+    courses[start:start + count] of one saved result, sliced by MongoDB where the storage allows.
+    Returns the record (level, courses_count, result_groups) with only that slice as its courses.
+    """
+    user_courses_writes.flush_key(query)
+    started = time.perf_counter()
+    projection = dict(STATUS_FIELDS, catalog_version=1, courses_codec=1, result_groups=1)
+    projection['courses'] = {'$slice': [start, count]}
+    projection['course_refs'] = {'$slice': [start, count]}
+    record = user_courses_collection.find_one(query, projection)
+    if record and record.get('courses_codec'):
+        # Compressed snapshots can only be sliced after decoding the whole blob
+        blob = user_courses_collection.find_one({'_id': record['_id']}, {'courses_blob': 1})
+        record['courses'] = decode_courses(record['courses_codec'], blob['courses_blob'])[start:start + count]
+    record = resolve_stored_courses(record)
+    record_latency('find_courses_slice', started)
+    return record
+
 def get_user_courses(email, index_number, level, force_refresh=False):
     """Get user courses with strict database preference"""
     logger.info(f"Getting courses for {email}, {index_number}, {level}")
@@ -117,16 +347,12 @@ def get_user_courses(email, index_number, level, force_refresh=False):
     # Always try database first if connected
     if database_connected:
         try:
-            # Ensure fresh database connection
-            if not client.admin.command('ping'):
-                logger.warning("Database connection lost, reconnecting...")
-                initialize_database()
-            
-            db_data = user_courses_collection.find_one({
-                'email': email,
-                'index_number': index_number,
-                'level': level
-            })
+            query = {'email': email, 'index_number': index_number, 'level': level}
+            started = time.perf_counter()
+            user_courses_writes.flush_key(query)
+            db_data = user_courses_collection.find_one(query)
+            record_latency('get_user_courses', started)
+            db_data = resolve_stored_courses(db_data)
             
             if db_data and 'courses' in db_data:
                 # Validate and convert courses
@@ -215,61 +441,92 @@ def save_user_courses(email, index_number, level, courses, update_session=True):
     # Always try to save to database first
     if database_connected:
         try:
-            # Ensure fresh database connection
-            if not client.admin.command('ping'):
-                logger.warning("Database connection lost, reconnecting...")
-                initialize_database()
-            
             # Prepare the record
             record = {
                 'email': email,
                 'index_number': index_number,
                 'level': level,
-                'courses': valid_courses,
                 'courses_count': len(valid_courses),
                 'updated_at': datetime.now(),
                 'last_validated': datetime.now()
             }
             
-            logger.info(f"🛠️ About to update DB for {email}/{index_number}/{level}: saving {len(valid_courses)} courses")
-
-            result = user_courses_collection.update_one(
-                {
-                    'email': email,
-                    'index_number': index_number,
-                    'level': level
-                },
-                {'$set': record},
-                upsert=True
-            )
+            if _result_grouping is not None:
+                try:
+                    # Grouped once here so results page views only fetch and render,
+                    # and each category is one contiguous slice of the stored array
+                    valid_courses, record['result_groups'] = _result_grouping(level, valid_courses)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not group courses for display, pages will group them: {str(e)}")
             
-            logger.info(f"✅ Saved {len(valid_courses)} courses to database for {level}")
+            references = None
+            if USER_COURSES_STORAGE == 'refs' and _course_references is not None:
+                try:
+                    references = _course_references[0](level, valid_courses)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not build course references, storing courses in full: {str(e)}")
             
-            # Verify the save
-            saved_data = user_courses_collection.find_one({
-                'email': email,
-                'index_number': index_number,
-                'level': level
-            })
+            encoded = None
+            if not references:
+                try:
+                    encoded = encode_courses(valid_courses)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not compress courses, storing them uncompressed: {str(e)}")
             
-            if saved_data and len(saved_data.get('courses', [])) == len(valid_courses):
-                logger.info("✅ Database save verified")
-                
-                if update_session:
-                    # 🔥 FIX: Store ONLY metadata in session, NOT the full courses
-                    # This prevents the cookie from overflowing
-                    session[f'{level}_courses_{index_number}'] = {
-                        'courses_count': len(valid_courses),
-                        'last_db_fetch': datetime.now().isoformat(),
-                        'from_db': True,
-                        'has_courses': True
-                    }
-                    logger.info(f"✅ Session updated with metadata only (not the full {len(valid_courses)} courses)")
-                
-                return True
+            # Exactly one representation is kept; the others are removed in the same write
+            if references:
+                # Only ids are written; the courses are rebuilt from the catalog when read
+                record['course_refs'], record['catalog_version'] = references
+                stored_field = 'course_refs'
+            elif encoded:
+                record['courses_codec'], record['courses_blob'] = encoded
+                stored_field = 'courses_blob'
             else:
-                logger.error("❌ Database save verification failed")
-                raise Exception("Save verification failed")
+                record['courses'] = valid_courses
+                stored_field = 'courses'
+            stale_fields = {
+                'courses', 'course_refs', 'catalog_version', 'courses_blob', 'courses_codec', 'result_groups'
+            } - set(record)
+            update = {'$set': record, '$unset': {field: '' for field in stale_fields}}
+            
+            logger.info(f"🛠️ About to update DB for {email}/{index_number}/{level}: saving {len(valid_courses)} courses ({stored_field})")
+
+            query = {'email': email, 'index_number': index_number, 'level': level}
+            started = time.perf_counter()
+            # Queued when write-behind is on, otherwise a synchronous update_one
+            acknowledged = user_courses_writes.submit(query, update, upsert=True)
+            elapsed_ms = record_latency('save_user_courses', started)
+            
+            # The write concern acknowledgement is the confirmation; no read-back needed
+            if not acknowledged:
+                raise Exception("Save was not acknowledged by the database")
+            
+            logger.info(f"✅ Saved {len(valid_courses)} courses to database for {level} in {elapsed_ms:.0f}ms")
+            
+            if PARANOID_VERIFY:
+                started = time.perf_counter()
+                user_courses_writes.flush_key(query)
+                saved_data = user_courses_collection.find_one(query)
+                record_latency('verify_user_courses', started)
+                
+                saved_courses = (resolve_stored_courses(saved_data) or {}).get('courses', [])
+                if len(saved_courses) != len(valid_courses):
+                    logger.error("❌ Database save verification failed")
+                    raise Exception("Save verification failed")
+                logger.info("✅ Database save verified")
+            
+            if update_session:
+                # 🔥 FIX: Store ONLY metadata in session, NOT the full courses
+                # This prevents the cookie from overflowing
+                session[f'{level}_courses_{index_number}'] = {
+                    'courses_count': len(valid_courses),
+                    'last_db_fetch': datetime.now().isoformat(),
+                    'from_db': True,
+                    'has_courses': True
+                }
+                logger.info(f"✅ Session updated with metadata only (not the full {len(valid_courses)} courses)")
+            
+            return True
             
         except Exception as e:
             logger.error(f"❌ Error saving courses to database: {str(e)}", exc_info=True)
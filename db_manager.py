@@ -0,0 +1,201 @@
+# --- Shared MongoDB Client ---
+"""
+One MongoClient per process, shared by app.py and courses.py.
+
+The client is created on first use and recreated after a fork, so a gunicorn master that
+imports the app (preload_app = True) never hands its sockets to the workers. Modules keep
+DatabaseHandle / CollectionHandle objects in their globals; each attribute access resolves
+against the current process's client, so those globals stay valid across the fork.
+"""
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MONGODB_URI = os.getenv('MONGODB_URI')
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '50'))
+
+CLIENT_OPTIONS = {
+    'serverSelectionTimeoutMS': 10000,
+    'connectTimeoutMS': 30000,
+    'socketTimeoutMS': 30000,
+    'retryWrites': True,
+    'retryReads': True,
+    'maxPoolSize': MONGODB_MAX_POOL_SIZE
+}
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+class PoolStatistics(ConnectionPoolListener):
+    """Counts connection pool events of this process's client"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # A new lock too: after a fork the old one may have been held by a thread that no longer exists
+        self._lock = threading.Lock()
+        self.counts = {
+            'connections_created': 0, 'connections_closed': 0, 'checked_out': 0,
+            'checked_in': 0, 'check_out_failed': 0, 'pools_cleared': 0
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count('check_out_failed')
+
+    def connection_checked_out(self, event):
+        self._count('checked_out')
+
+    def connection_checked_in(self, event):
+        self._count('checked_in')
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self.counts)
+        counts['open'] = counts['connections_created'] - counts['connections_closed']
+        counts['in_use'] = counts['checked_out'] - counts['checked_in']
+        return counts
+
+
+pool_statistics = PoolStatistics()
+
+
+def get_client():
+    """This process's MongoClient, created on first use (and again in a forked child)"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # connect=False: no sockets or monitor threads until the first operation
+            _client = MongoClient(
+                MONGODB_URI, connect=False, event_listeners=[pool_statistics], **CLIENT_OPTIONS
+            )
+            _client_pid = pid
+            logger.info(f"✅ MongoDB client created for process {pid}")
+    return _client
+
+
+def ping():
+    """Round trip to the server; raises when it cannot be reached"""
+    get_client().admin.command('ping')
+
+
+def close_client():
+    """Close this process's client; the next use creates a new one"""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _after_fork_in_child():
+    # The parent's client must not be used (or closed) here: drop it and start clean
+    global _client, _client_pid, _lock
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    pool_statistics.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class DatabaseHandle:
+    """A database of the current process's client"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def resolve(self):
+        return get_client()[self.name]
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __getitem__(self, collection_name):
+        return self.resolve()[collection_name]
+
+    def __repr__(self):
+        return f"DatabaseHandle({self.name!r})"
+
+
+class CollectionHandle:
+    """A collection of the current process's client"""
+
+    def __init__(self, database_name, name):
+        self.database_name = database_name
+        self.name = name
+
+    def resolve(self):
+        return get_client()[self.database_name][self.name]
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __getitem__(self, sub_collection):
+        return self.resolve()[sub_collection]
+
+    def __repr__(self):
+        return f"CollectionHandle({self.database_name!r}, {self.name!r})"
+
+
+def database(name):
+    return DatabaseHandle(name)
+
+
+def collection(database_name, name):
+    return CollectionHandle(database_name, name)
+
+
+def pool_stats():
+    """Client and connection pool state of this process"""
+    client = _client if _client_pid == os.getpid() else None
+    return {
+        'pid': os.getpid(),
+        'client_created': client is not None,
+        'max_pool_size': MONGODB_MAX_POOL_SIZE,
+        **pool_statistics.snapshot()
+    }
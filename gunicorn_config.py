@@ -10,7 +10,9 @@ import os
 bind = "0.0.0.0:8080"
 backlog = 2048
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# Threads per worker; above 1 the workers are gthread, which readiness streams (SSE) need
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+worker_class = "gthread" if threads > 1 else "sync"
 worker_connections = 1000
 timeout = 120
 keepalive = 5
@@ -41,13 +43,32 @@ def on_exit(server):
     """Called just before exiting Gunicorn"""
     print("🛑 Gunicorn server shutting down")
 
+def post_fork(server, worker):
+    """Called in each new worker: start the per-process background threads a preloaded app could not share"""
+    if preload_app:
+        from courses import start_health_monitor
+        start_health_monitor()
+
+def post_worker_init(worker):
+    """Called in each worker once the app is loaded: start its job workers, which pick up queued and retried jobs"""
+    from job_queue import start_all_queues
+    start_all_queues()
+
+def worker_exit(server, worker):
+    """Called in the worker as it exits: write out queued course and basket saves"""
+    from write_behind import flush_all_queues
+    flush_all_queues()
+
 # Application environment
 raw_env = [
     f"FLASK_ENV={os.getenv('FLASK_ENV', 'production')}",
 ]
 
 # Optimization flags
-preload_app = False  # Don't preload to allow hot-reloading
+# Preloading imports the app once in the master and forks it (shared memory, faster worker boot).
+# Safe with db_manager: every worker creates its own MongoDB client after the fork.
+# Off by default to allow hot-reloading.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
 max_requests = 10000  # Restart worker after 10k requests to prevent memory leaks
 max_requests_jitter = 1000  # Random jitter to prevent thundering herd
 
@@ -0,0 +1,359 @@
+# --- Durable Job Queue ---
+"""
+Background jobs whose state lives in a shared store, so every worker sees the same job.
+
+- enqueue() is idempotent per job id: a queued, running or completed job is never started twice,
+  unless restart=True asks for a completed one to run again (its inputs changed)
+- Worker threads lease one job at a time; a lease that runs out (crashed worker) is picked up again
+- A job that raises is retried with exponential backoff, then marked failed after JOB_MAX_ATTEMPTS
+- Idle workers sleep until enqueue() wakes them or a retry they scheduled falls due; the store is only
+  polled every JOB_POLL_INTERVAL for jobs queued elsewhere and leases left by crashed workers
+- Execution is at-least-once, so handlers must be idempotent (course saves are upserts)
+
+MongoJobStore keeps jobs in user_data.jobs (indexes in migrate.py); MemoryJobStore is the
+single-process stand-in (JOB_QUEUE_BACKEND=memory) for development without MongoDB.
+"""
+import copy
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'mongo').lower()
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '5'))
+# Longest an idle worker sleeps before checking the store; enqueues and retries in this process wake it sooner
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '30'))
+# Finished jobs are kept this long (TTL index on expires_at), then status falls back to the saved results
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
+QUEUED, RUNNING, COMPLETED, FAILED = 'queued', 'running', 'completed', 'failed'
+# Fields shown to callers of status(); payloads and lease details stay internal
+STATUS_FIELDS = ('status', 'kind', 'priority', 'attempts', 'result', 'error', 'created_at', 'completed_at', 'run_at')
+
+_queues = []
+
+
+def utcnow():
+    # Naive UTC, as pymongo returns stored datetimes
+    return datetime.utcnow()
+
+
+class MongoJobStore:
+    """Jobs as documents keyed by job id; leases are taken with find_one_and_update"""
+
+    def __init__(self, get_collection):
+        self._get_collection = get_collection
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    def put(self, job_id, kind, payload, now, priority=0, restart=False):
+        # A failed job is queued again when it is enqueued again (e.g. the user polls after a failure)
+        self.collection.update_one(
+            {'_id': job_id, 'status': {'$in': [FAILED, COMPLETED] if restart else [FAILED]}},
+            {'$set': {'status': QUEUED, 'attempts': 0, 'run_at': now, 'payload': payload, 'priority': priority},
+             '$unset': {'error': '', 'result': '', 'completed_at': '', 'expires_at': ''}}
+        )
+        return self.collection.find_one_and_update(
+            {'_id': job_id},
+            {'$setOnInsert': {
+                'kind': kind, 'payload': payload, 'status': QUEUED, 'priority': priority,
+                'attempts': 0, 'run_at': now, 'created_at': now
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def lease(self, owner, now, lease_until):
+        return self.collection.find_one_and_update(
+            {'$or': [
+                {'status': QUEUED, 'run_at': {'$lte': now}},
+                {'status': RUNNING, 'lease_until': {'$lt': now}}
+            ]},
+            {'$set': {'status': RUNNING, 'owner': owner, 'lease_until': lease_until, 'started_at': now},
+             '$inc': {'attempts': 1}},
+            sort=[('priority', -1), ('run_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def finish(self, job_id, owner, fields):
+        """Record the outcome, unless the lease was lost to another worker meanwhile"""
+        result = self.collection.update_one(
+            {'_id': job_id, 'status': RUNNING, 'owner': owner},
+            {'$set': fields, '$unset': {'owner': '', 'lease_until': ''}}
+        )
+        return result.modified_count == 1
+
+    def get(self, job_id):
+        return self.collection.find_one({'_id': job_id}, {'payload': 0})
+
+    def counts(self):
+        return {
+            row['_id']: row['count']
+            for row in self.collection.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}])
+        }
+
+
+class MemoryJobStore:
+    """In-process store with the same semantics as MongoJobStore (one process only)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def put(self, job_id, kind, payload, now, priority=0, restart=False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = {
+                    '_id': job_id, 'kind': kind, 'payload': payload, 'status': QUEUED, 'priority': priority,
+                    'attempts': 0, 'run_at': now, 'created_at': now
+                }
+            elif job['status'] == FAILED or (restart and job['status'] == COMPLETED):
+                job.update(status=QUEUED, attempts=0, run_at=now, payload=payload, priority=priority)
+                for field in ('error', 'result', 'completed_at', 'expires_at'):
+                    job.pop(field, None)
+            return copy.deepcopy(job)
+
+    def lease(self, owner, now, lease_until):
+        with self._lock:
+            ready = [
+                job for job in self._jobs.values()
+                if (job['status'] == QUEUED and job['run_at'] <= now)
+                or (job['status'] == RUNNING and job['lease_until'] < now)
+            ]
+            if not ready:
+                return None
+            job = min(ready, key=lambda j: (-j.get('priority', 0), j['run_at']))
+            job.update(status=RUNNING, owner=owner, lease_until=lease_until, started_at=now)
+            job['attempts'] += 1
+            return copy.deepcopy(job)
+
+    def finish(self, job_id, owner, fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != RUNNING or job.get('owner') != owner:
+                return False
+            job.update(copy.deepcopy(fields))
+            job.pop('owner', None)
+            job.pop('lease_until', None)
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = copy.deepcopy(job)
+        job.pop('payload', None)
+        return job
+
+    def counts(self):
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+
+class JobQueue:
+    """Leasing job runner over a shared store, with a few worker threads per process"""
+
+    def __init__(self, name, store, workers=None, lease_seconds=None, max_attempts=None,
+                 retry_backoff=None, poll_interval=None):
+        self.name = name
+        self.store = store
+        self.workers = workers or JOB_WORKERS
+        self.lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or JOB_MAX_ATTEMPTS
+        self.retry_backoff = retry_backoff if retry_backoff is not None else JOB_RETRY_BACKOFF
+        self.poll_interval = poll_interval or JOB_POLL_INTERVAL
+        self.handlers = {}
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        # Monotonic times at which retries scheduled by this process fall due (heap)
+        self._retries_due = []
+        # job id -> Event set when the job finishes in this process (readiness streams wait on it)
+        self._waiters = {}
+        self._stats = {'enqueued': 0, 'executed': 0, 'completed': 0, 'retried': 0, 'failed': 0, 'lost_leases': 0}
+        _queues.append(self)
+
+    def register(self, kind, handler):
+        """handler(**payload) runs the job and returns a small JSON-able result"""
+        self.handlers[kind] = handler
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def enqueue(self, job_id, kind, priority=0, restart=False, **payload):
+        """
+        Queue a job once per job_id; returns its current state. Higher priority jobs are leased first.
+        restart=True also queues a completed job again; a queued or running one is left as it is.
+        """
+        job = self.store.put(job_id, kind, payload, utcnow(), priority, restart)
+        self._count('enqueued')
+        if job and job.get('status') == QUEUED:
+            self.start()
+            self._wakeup.set()
+        return _public(job)
+
+    def status(self, job_id):
+        """State of a job as any worker sees it, or None if it was never queued (or has expired)"""
+        return _public(self.store.get(job_id))
+
+    def start(self):
+        """Start this process's worker threads (no-op once running)"""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for number in range(len(self._threads), self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f'{self.name}-worker-{number}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        while True:
+            try:
+                # Cleared before looking, so an enqueue that lands while this worker looks still wakes it
+                self._wakeup.clear()
+                if not self.run_next(owner):
+                    self._wakeup.wait(self._idle_wait())
+            except Exception as e:
+                logger.error(f"❌ {self.name} worker error: {str(e)}")
+                self._wakeup.wait(self.poll_interval)
+
+    def _idle_wait(self):
+        """Seconds an idle worker sleeps: until the next retry scheduled here falls due, at most poll_interval"""
+        now = time.monotonic()
+        with self._lock:
+            if self._retries_due and self._retries_due[0] <= now:
+                heapq.heappop(self._retries_due)
+                return 0
+            wait = self._retries_due[0] - now if self._retries_due else self.poll_interval
+        return min(wait, self.poll_interval)
+
+    def run_next(self, owner):
+        """Lease and run one job; returns False when nothing was ready"""
+        now = utcnow()
+        job = self.store.lease(owner, now, now + timedelta(seconds=self.lease_seconds))
+        if job is None:
+            return False
+        self._count('executed')
+        job_id, attempts = job['_id'], job['attempts']
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+            result = handler(**(job.get('payload') or {}))
+        except Exception as e:
+            traceback.print_exc()
+            finished = utcnow()
+            if attempts < self.max_attempts:
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                logger.warning(f"⚠️ {self.name} job {job_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {str(e)}")
+                fields = {'status': QUEUED, 'run_at': finished + timedelta(seconds=delay), 'error': str(e)}
+                self._count('retried')
+                with self._lock:
+                    heapq.heappush(self._retries_due, time.monotonic() + delay)
+            else:
+                logger.error(f"❌ {self.name} job {job_id} failed after {attempts} attempts: {str(e)}")
+                fields = {'status': FAILED, 'error': str(e), 'completed_at': finished,
+                          'expires_at': finished + timedelta(seconds=JOB_RETENTION_SECONDS)}
+                self._count('failed')
+        else:
+            finished = utcnow()
+            fields = {'status': COMPLETED, 'result': result, 'completed_at': finished,
+                      'expires_at': finished + timedelta(seconds=JOB_RETENTION_SECONDS)}
+            self._count('completed')
+
+        if not self.store.finish(job_id, owner, fields):
+            # The lease ran out and another worker took the job over; its outcome wins
+            logger.warning(f"⚠️ {self.name} job {job_id} lost its lease before finishing")
+            self._count('lost_leases')
+        self._notify(job_id)
+        return True
+
+    def watch(self, job_id):
+        """
+        Event set when job_id next finishes an attempt in this process. Watch before reading status(),
+        so a job finishing in between is not missed; jobs finished by other workers only show in status().
+        """
+        with self._lock:
+            event = self._waiters.get(job_id)
+            if event is None or event.is_set():
+                event = self._waiters[job_id] = threading.Event()
+            return event
+
+    def unwatch(self, job_id, event):
+        with self._lock:
+            if self._waiters.get(job_id) is event:
+                del self._waiters[job_id]
+
+    def _notify(self, job_id):
+        with self._lock:
+            event = self._waiters.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _after_fork(self):
+        # Threads do not survive a fork: the child starts its own on first use
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._retries_due = []
+        self._waiters = {}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, workers=len([t for t in self._threads if t.is_alive()]))
+        try:
+            stats['jobs'] = self.store.counts()
+        except Exception as e:
+            stats['jobs'] = {'error': str(e)}
+        return stats
+
+
+def _public(job):
+    if job is None:
+        return None
+    return {field: job[field] for field in STATUS_FIELDS if field in job}
+
+
+def create_store(get_collection):
+    """Store selected by JOB_QUEUE_BACKEND"""
+    if JOB_QUEUE_BACKEND == 'memory':
+        return MemoryJobStore()
+    return MongoJobStore(get_collection)
+
+
+def start_all_queues():
+    """Start the worker threads of every queue in this process (gunicorn post_fork with a preloaded app)"""
+    for queue in _queues:
+        queue.start()
+
+
+def _after_fork_in_child():
+    for queue in _queues:
+        queue._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
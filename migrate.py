@@ -0,0 +1,225 @@
+# --- Schema & Index Migrations ---
+"""
+Index reconciliation for the user_data collections, run once per deploy instead of in every worker.
+
+    python migrate.py            apply every migration newer than the recorded schema version
+    python migrate.py --status   print the recorded and expected versions
+
+The applied version is stored in user_data.schema_migrations. Workers only read it at boot
+(check_schema_version) and warn when a deploy forgot to migrate.
+"""
+import os
+import socket
+import sys
+from datetime import datetime
+
+import db_manager
+
+# Partial index filter used when creating partial unique indexes (ensure string-typed fields)
+PARTIAL_FILTER = {
+    'email': {'$type': 'string'},
+    'index_number': {'$type': 'string'},
+    'level': {'$type': 'string'}
+}
+
+SCHEMA_DOCUMENT_ID = 'schema'
+
+# Run migrations at worker boot when the database is behind (single-process development only)
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'false').lower() == 'true'
+
+
+def schema_collection():
+    return db_manager.collection('user_data', 'schema_migrations')
+
+
+def ensure_index(collection, existing_indexes, keys, name, **options):
+    """Create an index, first dropping any index on the same keys with another name or options"""
+    desired_key = dict(keys)
+    for index in existing_indexes:
+        if dict(index.get('key', {})) != desired_key:
+            continue
+        index_name = index.get('name', '')
+        if (index_name != name
+                or bool(index.get('unique', False)) != bool(options.get('unique', False))
+                or index.get('partialFilterExpression') != options.get('partialFilterExpression')):
+            try:
+                print(f"🔄 Dropping existing index '{index_name}' because it conflicts with desired spec")
+                collection.drop_index(index_name)
+                print(f"✅ Dropped index '{index_name}'")
+            except Exception as drop_err:
+                print(f"⚠️ Could not drop index '{index_name}': {drop_err}")
+    collection.create_index(keys, name=name, **options)
+
+
+def ensure_unique_user_level_index(collection, existing_indexes, name, fallback_name):
+    """Unique partial (email, index_number, level) index, or a non-unique one when duplicates exist"""
+    keys = [("email", 1), ("index_number", 1), ("level", 1)]
+    try:
+        ensure_index(collection, existing_indexes, keys, name, unique=True, partialFilterExpression=PARTIAL_FILTER)
+        print(f"✅ Unique partial {collection.name} index created (name={name})")
+    except Exception as create_err:
+        print(f"❌ Error creating unique partial {collection.name} index: {create_err}")
+        # Fallback: non-unique index (safe) so lookups stay fast
+        collection.create_index(keys, name=fallback_name, unique=False)
+        print(f"✅ Created non-unique {collection.name} index as fallback")
+
+
+# --- Migrations ---
+def create_user_data_indexes():
+    """Indexes previously reconciled by every worker in initialize_database()"""
+    user_payments = db_manager.collection('user_data', 'user_payments')
+    existing_indexes = list(user_payments.list_indexes())
+    ensure_unique_user_level_index(user_payments, existing_indexes, 'unique_email_index_level',
+                                   'non_unique_email_index_level')
+    ensure_index(user_payments, existing_indexes, [("transaction_ref", 1)], 'transaction_ref_index')
+    ensure_index(user_payments, existing_indexes, [("payment_confirmed", 1)], 'payment_confirmed_index')
+    print("✅ User payments indexes created")
+
+    user_courses = db_manager.collection('user_data', 'user_courses')
+    existing_indexes = list(user_courses.list_indexes())
+    ensure_unique_user_level_index(user_courses, existing_indexes, 'unique_courses_email_index_level',
+                                   'non_unique_courses_email_index_level')
+
+    user_baskets = db_manager.collection('user_data', 'user_baskets')
+    existing_indexes = list(user_baskets.list_indexes())
+    ensure_index(user_baskets, existing_indexes, [("index_number", 1)], 'basket_index_number')
+    ensure_index(user_baskets, existing_indexes, [("email", 1)], 'basket_email')
+    ensure_index(user_baskets, existing_indexes, [("created_at", 1)], 'basket_created_at')
+    print("✅ User baskets indexes created")
+
+    admin_activations = db_manager.collection('user_data', 'admin_activations')
+    existing_indexes = list(admin_activations.list_indexes())
+    ensure_index(admin_activations, existing_indexes, [("index_number", 1)], 'activation_index_number')
+    ensure_index(admin_activations, existing_indexes, [("payment_receipt", 1)], 'activation_payment_receipt')
+    ensure_index(admin_activations, existing_indexes, [("is_active", 1)], 'activation_is_active')
+    print("✅ Admin activations indexes created")
+
+    news_articles = db_manager.collection('user_data', 'news_articles')
+    existing_indexes = list(news_articles.list_indexes())
+    ensure_index(news_articles, existing_indexes, [("is_published", 1), ("published_at", -1)], 'published_news_index')
+    ensure_index(news_articles, existing_indexes, [("is_featured", 1), ("published_at", -1)], 'featured_news_index')
+    print("✅ News collection indexes created")
+
+
+def create_lookup_indexes():
+    """Compound indexes for payment verification and active basket lookups"""
+    user_payments = db_manager.collection('user_data', 'user_payments')
+    ensure_index(user_payments, list(user_payments.list_indexes()),
+                 [("transaction_ref", 1), ("payment_confirmed", 1)], 'fast_payment_verify')
+
+    user_baskets = db_manager.collection('user_data', 'user_baskets')
+    ensure_index(user_baskets, list(user_baskets.list_indexes()),
+                 [("index_number", 1), ("is_active", 1)], 'fast_basket_lookup')
+    print("✅ Lookup indexes created")
+
+
+def create_job_indexes():
+    """Job queue indexes: leasing by status and run time, expiry of finished jobs"""
+    jobs = db_manager.collection('user_data', 'jobs')
+    existing_indexes = list(jobs.list_indexes())
+    ensure_index(jobs, existing_indexes, [("status", 1), ("run_at", 1)], 'job_status_run_at')
+    ensure_index(jobs, existing_indexes, [("status", 1), ("lease_until", 1)], 'job_status_lease_until')
+    ensure_index(jobs, existing_indexes, [("expires_at", 1)], 'job_expires_at', expireAfterSeconds=0)
+    print("✅ Job queue indexes created")
+
+
+def create_lease_indexes():
+    """Expiry of single-flight lease documents left behind by crashed workers"""
+    leases = db_manager.collection('user_data', 'leases')
+    ensure_index(leases, list(leases.list_indexes()), [("expires_at", 1)], 'lease_expires_at', expireAfterSeconds=0)
+    print("✅ Lease indexes created")
+
+
+def create_prequalified_indexes():
+    """Priority leasing of jobs and expiry of speculative qualification results"""
+    jobs = db_manager.collection('user_data', 'jobs')
+    ensure_index(jobs, list(jobs.list_indexes()), [("status", 1), ("priority", -1), ("run_at", 1)],
+                 'job_status_priority_run_at')
+    prequalified = db_manager.collection('user_data', 'prequalified')
+    ensure_index(prequalified, list(prequalified.list_indexes()), [("expires_at", 1)], 'prequalified_expires_at',
+                 expireAfterSeconds=0)
+    print("✅ Speculative qualification indexes created")
+
+
+# (version, migration) in order; append new ones, never edit or renumber applied ones
+MIGRATIONS = [
+    (1, create_user_data_indexes),
+    (2, create_lookup_indexes),
+    (3, create_job_indexes),
+    (4, create_lease_indexes),
+    (5, create_prequalified_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_schema_version():
+    """Version recorded by the last successful migration run (0 when never migrated)"""
+    record = schema_collection().find_one({'_id': SCHEMA_DOCUMENT_ID}, {'version': 1})
+    return (record or {}).get('version', 0)
+
+
+def apply_migrations():
+    """Run every migration newer than the recorded version, recording each one as it completes"""
+    current = applied_schema_version()
+    pending = [(version, migration) for version, migration in MIGRATIONS if version > current]
+    if not pending:
+        print(f"✅ Schema is up to date (version {current})")
+        return current
+
+    for version, migration in pending:
+        print(f"🔄 Applying migration {version}: {migration.__doc__}")
+        migration()
+        schema_collection().update_one(
+            {'_id': SCHEMA_DOCUMENT_ID},
+            {'$set': {
+                'version': version,
+                'migration': migration.__name__,
+                'applied_at': datetime.now(),
+                'applied_by': socket.gethostname()
+            }},
+            upsert=True
+        )
+        print(f"✅ Schema at version {version}")
+    return pending[-1][0]
+
+
+def check_schema_version():
+    """Cheap boot check: one find_one. Returns True when the database schema matches this code"""
+    try:
+        applied = applied_schema_version()
+    except Exception as e:
+        print(f"⚠️ Could not read schema version: {str(e)}")
+        return False
+
+    if applied >= SCHEMA_VERSION:
+        return True
+
+    if AUTO_MIGRATE:
+        print(f"🔄 Schema at version {applied}, migrating to {SCHEMA_VERSION} (AUTO_MIGRATE)")
+        try:
+            return apply_migrations() >= SCHEMA_VERSION
+        except Exception as e:
+            print(f"❌ Migration failed: {str(e)}")
+            return False
+
+    print(f"⚠️ Database schema is at version {applied}, this code expects {SCHEMA_VERSION}: "
+          f"run 'python migrate.py'")
+    return False
+
+
+def main():
+    try:
+        if '--status' in sys.argv[1:]:
+            print(f"📋 Applied schema version: {applied_schema_version()}, expected: {SCHEMA_VERSION}")
+            return 0
+        apply_migrations()
+        return 0
+    except Exception as e:
+        print(f"❌ Migration failed: {str(e)}")
+        return 1
+    finally:
+        db_manager.close_client()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
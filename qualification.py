@@ -0,0 +1,157 @@
+# --- Course Qualification Rules ---
+from bisect import bisect_right
+from collections import namedtuple
+
+GRADE_VALUES = {
+    'A': 12, 'A-': 11, 'B+': 10, 'B': 9, 'B-': 8, 'C+': 7, 'C': 6, 'C-': 5,
+    'D+': 4, 'D': 3, 'D-': 2, 'E': 1
+}
+
+# A course's requirements reduced to integers once, when the catalog is loaded.
+# subjects: ((alternative subject codes...), minimum grade value) per requirement, e.g. (('MAT', 'PHY'), 7)
+# satisfiable: False when a requirement can never be met (unreadable grade or cut-off)
+CourseRequirements = namedtuple('CourseRequirements', ['subjects', 'min_mean', 'cluster', 'cut_off', 'satisfiable'])
+
+# A user's grades converted to integers once per qualification run
+UserProfile = namedtuple('UserProfile', ['grades', 'mean', 'cluster_points'])
+
+# Every subject grade, mean grade and cut-off value a level's requirements compare against
+LevelThresholds = namedtuple('LevelThresholds', ['subjects', 'mean', 'cut_offs'])
+
+
+def grade_value(grade_str):
+    """Integer value of a grade string; 'C+/C' style strings use the first valid part, 0 if unreadable"""
+    if not grade_str or not isinstance(grade_str, str):
+        return 0
+    if grade_str in GRADE_VALUES:
+        return GRADE_VALUES[grade_str]
+    if '/' in grade_str:
+        for part in grade_str.split('/'):
+            if part in GRADE_VALUES:
+                return GRADE_VALUES[part]
+    return 0
+
+
+def compile_requirements(course):
+    """Turn a course's minimum_subject_requirements, mean grade and cut-off into a CourseRequirements"""
+    satisfiable = True
+
+    subjects = []
+    for subject_key, required_grade in (course.get('minimum_subject_requirements') or {}).items():
+        minimum = grade_value(required_grade)
+        if not minimum:
+            satisfiable = False
+            continue
+        subjects.append((tuple(subject_key.split('/')), minimum))
+
+    # Exact grade only: the original rules read a 'C+/C' mean grade as no minimum, unlike subject grades
+    mean_grade = (course.get('minimum_grade') or {}).get('mean_grade')
+    min_mean = GRADE_VALUES.get(mean_grade, 0) if isinstance(mean_grade, str) else 0
+
+    cluster = course.get('cluster', '')
+    cut_off = None
+    raw_cut_off = course.get('cut_off_points', 0)
+    if cluster and raw_cut_off:
+        try:
+            cut_off = float(raw_cut_off)
+        except (TypeError, ValueError):
+            satisfiable = False
+
+    return CourseRequirements(tuple(subjects), min_mean, cluster, cut_off, satisfiable)
+
+
+def build_user_profile(user_grades, user_mean_grade=None, user_cluster_points=None):
+    """Convert a user's letter grades to integers for the compiled checks"""
+    grades = {
+        subject: GRADE_VALUES[grade]
+        for subject, grade in (user_grades or {}).items()
+        if grade in GRADE_VALUES
+    }
+    return UserProfile(grades, GRADE_VALUES.get(user_mean_grade, 0), dict(user_cluster_points or {}))
+
+
+def meets_subject_requirements(requirements, profile):
+    """Every requirement needs at least one of its alternative subjects at or above the minimum"""
+    grades = profile.grades
+    for alternatives, minimum in requirements.subjects:
+        for subject in alternatives:
+            if grades.get(subject, 0) >= minimum:
+                break
+        else:
+            return False
+    return True
+
+
+def qualifies_by_cluster_points(requirements, profile):
+    """Degree rule: subject requirements plus the cut-off for the course's cluster"""
+    if not requirements.satisfiable:
+        return False
+    if requirements.cut_off and profile.cluster_points.get(requirements.cluster, 0) < requirements.cut_off:
+        return False
+    return meets_subject_requirements(requirements, profile)
+
+
+def qualifies_by_mean_grade(requirements, profile):
+    """Diploma, certificate, artisan, KMTC and TTC rule: subject requirements plus minimum mean grade"""
+    if not requirements.satisfiable:
+        return False
+    if requirements.min_mean and profile.mean < requirements.min_mean:
+        return False
+    return meets_subject_requirements(requirements, profile)
+
+
+def build_level_thresholds(requirements):
+    """Collect the sorted threshold values used by a level's compiled requirements"""
+    subjects = {}
+    mean = set()
+    cut_offs = {}
+    for course_requirements in requirements:
+        for alternatives, minimum in course_requirements.subjects:
+            for subject in alternatives:
+                subjects.setdefault(subject, set()).add(minimum)
+        if course_requirements.min_mean:
+            mean.add(course_requirements.min_mean)
+        if course_requirements.cut_off:
+            cut_offs.setdefault(course_requirements.cluster, set()).add(course_requirements.cut_off)
+    return LevelThresholds(
+        {subject: sorted(values) for subject, values in subjects.items()},
+        sorted(mean),
+        {cluster: sorted(values) for cluster, values in cut_offs.items()}
+    )
+
+
+def _snap(value, thresholds):
+    """Largest threshold not above value, or 0 - every '>= threshold' test answers the same for both"""
+    position = bisect_right(thresholds, value)
+    return thresholds[position - 1] if position else 0
+
+
+def canonical_profile(thresholds, profile):
+    """
+    Reduce a profile to the values a level can tell apart.
+    Two users with the same canonical profile qualify for exactly the same courses.
+    """
+    grades = {}
+    for subject, value in profile.grades.items():
+        if subject in thresholds.subjects:
+            snapped = _snap(value, thresholds.subjects[subject])
+            if snapped:
+                grades[subject] = snapped
+
+    cluster_points = {}
+    for cluster, points in profile.cluster_points.items():
+        if cluster in thresholds.cut_offs:
+            snapped = _snap(points, thresholds.cut_offs[cluster])
+            if snapped:
+                cluster_points[cluster] = snapped
+
+    return UserProfile(grades, _snap(profile.mean, thresholds.mean), cluster_points)
+
+
+def profile_fingerprint(profile):
+    """Hashable key for a (canonical) profile"""
+    return (
+        tuple(sorted(profile.grades.items())),
+        profile.mean,
+        tuple(sorted(profile.cluster_points.items()))
+    )
@@ -0,0 +1,113 @@
+"""
+Memory benchmark of the catalog's compact CourseRecords against plain dict copies.
+
+Each variant loads the same synthetic catalog in a fresh process and reports the resident
+memory it added, i.e. what every gunicorn worker pays to hold the snapshot.
+Run from the repository root: python scripts/benchmark_catalog_memory.py [courses_per_cluster]
+"""
+import gc
+import json
+import random
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from catalog import build_catalog_group, compact_course
+from qualification import GRADE_VALUES
+
+CLUSTERS = [f"cluster_{i}" for i in range(1, 21)]
+SUBJECTS = ['MAT', 'ENG', 'KIS', 'CHE', 'BIO', 'PHY', 'GEO', 'HAG', 'CRE', 'BST', 'AGR', 'COM']
+INSTITUTIONS = [f"University of Institution Name {i}" for i in range(80)]
+
+
+def rss_kb():
+    """Resident set size of this process in KB (Linux)"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def documents(cluster, count, seed):
+    """Course documents as a cursor would decode them: fresh objects for every string"""
+    rng = random.Random(seed)
+    grades = list(GRADE_VALUES)
+    for _ in range(count):
+        requirements = {
+            '/'.join(rng.sample(SUBJECTS, rng.choice([1, 1, 2]))): rng.choice(grades)
+            for _ in range(rng.randint(2, 5))
+        }
+        document = {
+            '_id': f"{rng.getrandbits(96):024x}",
+            'programme_code': str(rng.randint(1000000, 9999999)),
+            'programme_name': f"Bachelor of Science in Subject {rng.randint(1, 400)}",
+            'institution_name': rng.choice(INSTITUTIONS),
+            'programme_duration': rng.choice(['4 Years', '5 Years', '6 Years']),
+            'cut_off_points': round(rng.uniform(20, 46), 3),
+            'minimum_grade': {'mean_grade': rng.choice(grades)},
+            'minimum_subject_requirements': requirements,
+            'cluster': cluster,
+        }
+        yield json.loads(json.dumps(document))
+
+
+def load(mode, per_cluster):
+    layouts = {}
+    groups = []
+    for index, cluster in enumerate(CLUSTERS):
+        courses = []
+        for document in documents(cluster, per_cluster, index):
+            if mode == 'dict':
+                course = dict(document)
+                course['cluster'] = cluster
+            else:
+                course = compact_course(document, layouts, 'cluster', cluster)
+            courses.append(course)
+        groups.append(build_catalog_group(cluster, courses))
+    return groups
+
+
+def measure(mode, per_cluster):
+    gc.collect()
+    before = rss_kb()
+    tracemalloc.start()
+    groups = load(mode, per_cluster)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = rss_kb()
+    count = sum(len(group.courses) for group in groups)
+    print(json.dumps({'mode': mode, 'courses': count, 'rss_kb': after - before, 'traced_kb': traced // 1024}))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]))
+        return 0
+
+    per_cluster = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    results = {}
+    for mode in ('dict', 'record'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', mode, str(per_cluster)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    courses = results['dict']['courses']
+    print(f"📚 {courses} courses in {len(CLUSTERS)} clusters")
+    for mode in ('dict', 'record'):
+        result = results[mode]
+        print(f"💾 {mode:>6}: {result['rss_kb'] / 1024:.1f}MB RSS, {result['traced_kb'] / 1024:.1f}MB allocated "
+              f"({result['traced_kb'] * 1024 / courses:.0f} bytes per course)")
+    saved = 1 - results['record']['traced_kb'] / max(results['dict']['traced_kb'], 1)
+    print(f"✅ CourseRecord catalog uses {saved:.0%} less memory per worker")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
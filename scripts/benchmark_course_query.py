@@ -0,0 +1,113 @@
+"""
+Benchmark of MongoDB query pushdown against collection.find() + the Python rules.
+
+For random users it runs both paths against a real database, checks they return the
+same courses, and reports time and bytes transferred per user.
+Run from the repository root with MONGODB_URI set:
+    python scripts/benchmark_course_query.py [level] [users]
+"""
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bson import BSON
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from catalog import build_catalog_group
+from course_query import find_qualifying_courses
+from qualification import GRADE_VALUES, build_user_profile, qualifies_by_cluster_points, qualifies_by_mean_grade
+
+# Database and tag field of each level, as registered with the course catalog in app.py
+LEVELS = {
+    'degree': ('Degree', 'cluster'),
+    'diploma': ('diploma', 'collection'),
+    'kmtc': ('kmtc', None),
+    'certificate': ('certificate', 'collection'),
+    'artisan': ('artisan', 'collection'),
+    'ttc': ('Teachers', 'collection'),
+}
+
+GRADES = list(GRADE_VALUES)
+SUBJECTS = ['MAT', 'ENG', 'KIS', 'CHE', 'BIO', 'PHY', 'GEO', 'HAG', 'CRE', 'BST', 'AGR', 'COM']
+CLUSTERS = [f"cluster_{i}" for i in range(1, 21)]
+
+
+def random_profile(rng):
+    grades = {subject: rng.choice(GRADES) for subject in rng.sample(SUBJECTS, rng.randint(0, len(SUBJECTS)))}
+    cluster_points = {cluster: round(rng.uniform(0, 48), 3) for cluster in CLUSTERS if rng.random() < 0.9}
+    return build_user_profile(grades, rng.choice(GRADES + ['']), cluster_points)
+
+
+def document_bytes(courses):
+    return sum(len(BSON.encode(course)) for course in courses)
+
+
+def python_path(database, collection_names, profile, tag_field, by_cluster_points):
+    """The in-Python path: fetch whole collections, then filter"""
+    rule = qualifies_by_cluster_points if by_cluster_points else qualifies_by_mean_grade
+    qualifying_courses = []
+    transferred = 0
+    for collection_name in collection_names:
+        courses = list(database[collection_name].find())
+        transferred += document_bytes(courses)
+        for course in courses:
+            if tag_field:
+                course[tag_field] = collection_name
+        group = build_catalog_group(collection_name, courses)
+        for course, requirements in zip(group.courses, group.requirements):
+            if rule(requirements, profile):
+                qualifying_courses.append(course)
+    return qualifying_courses, transferred
+
+
+def main():
+    load_dotenv()
+    level = sys.argv[1] if len(sys.argv) > 1 else 'degree'
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    if level not in LEVELS:
+        print(f"❌ Unknown level: {level}")
+        return 1
+    if not os.getenv('MONGODB_URI'):
+        print("❌ MONGODB_URI is not set")
+        return 1
+
+    database_name, tag_field = LEVELS[level]
+    database = MongoClient(os.getenv('MONGODB_URI'))[database_name]
+    collection_names = sorted(database.list_collection_names())
+    by_cluster_points = level == 'degree'
+    print(f"📚 {level}: {len(collection_names)} collections in {database_name}")
+
+    rng = random.Random(2024)
+    timings = {'python': 0.0, 'query': 0.0}
+    transferred = {'python': 0, 'query': 0}
+    for _ in range(users):
+        profile = random_profile(rng)
+
+        started = time.perf_counter()
+        expected, python_bytes = python_path(database, collection_names, profile, tag_field, by_cluster_points)
+        timings['python'] += time.perf_counter() - started
+        transferred['python'] += python_bytes
+
+        started = time.perf_counter()
+        actual = find_qualifying_courses(database, collection_names, profile, tag_field, by_cluster_points)
+        timings['query'] += time.perf_counter() - started
+        transferred['query'] += document_bytes(actual)
+
+        if [course['_id'] for course in actual] != [course['_id'] for course in expected]:
+            print(f"❌ Query pushdown returned different courses: profile={profile}")
+            return 1
+
+    print(f"✅ {users} users identical")
+    for path in ('python', 'query'):
+        print(f"⏱️ {path}: {timings[path] / users * 1000:.1f}ms, "
+              f"{transferred[path] / users / 1024:.1f}KB per user")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
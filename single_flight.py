@@ -0,0 +1,208 @@
+# --- Single-Flight Coordination ---
+"""
+Runs work for one key at a time instead of serialising everything behind a global lock.
+
+- SingleFlight: in-process; concurrent callers with the same key wait for and share one call
+- LeasedSingleFlight: also takes a lease document per key, so other workers (and machines)
+  wait for the holder instead of repeating the work. Leases expire, so a crashed holder
+  never blocks a key for longer than SINGLE_FLIGHT_LEASE_SECONDS.
+
+Different keys never wait for each other.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+SINGLE_FLIGHT_LEASE_SECONDS = int(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', '120'))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '60'))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.5'))
+
+
+class LeaseTimeout(TimeoutError):
+    """Another worker held the key's lease for longer than the caller was willing to wait"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Per-key call deduplication within one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn, **options):
+        """fn() once for all concurrent callers of key; each gets its result (or exception)"""
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, **options)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def _run(self, key, fn, **options):
+        return fn()
+
+    def _after_fork(self):
+        # Calls in flight belong to the parent's threads
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+class MongoLeaseStore:
+    """Lease documents keyed by the single-flight key"""
+
+    def __init__(self, get_collection):
+        self._get_collection = get_collection
+
+    def acquire(self, key, owner, now, expires_at):
+        try:
+            # Matches a free (expired) lease or our own; otherwise the upsert collides on _id
+            self._get_collection().update_one(
+                {'_id': key, '$or': [{'expires_at': {'$lt': now}}, {'owner': owner}]},
+                {'$set': {'owner': owner, 'acquired_at': now, 'expires_at': expires_at}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def release(self, key, owner):
+        self._get_collection().delete_one({'_id': key, 'owner': owner})
+
+
+class MemoryLeaseStore:
+    """Single-process stand-in for MongoLeaseStore"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}
+
+    def acquire(self, key, owner, now, expires_at):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease and lease['owner'] != owner and lease['expires_at'] >= now:
+                return False
+            self._leases[key] = {'owner': owner, 'expires_at': expires_at}
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            if self._leases.get(key, {}).get('owner') == owner:
+                del self._leases[key]
+
+
+class LeasedSingleFlight(SingleFlight):
+    """SingleFlight whose leader also holds a cross-worker lease on the key"""
+
+    def __init__(self, lease_store, lease_seconds=None, wait_seconds=None, poll_interval=None):
+        super().__init__()
+        self.lease_store = lease_store
+        self.lease_seconds = lease_seconds or SINGLE_FLIGHT_LEASE_SECONDS
+        self.wait_seconds = wait_seconds if wait_seconds is not None else SINGLE_FLIGHT_WAIT_SECONDS
+        self.poll_interval = poll_interval or SINGLE_FLIGHT_POLL_INTERVAL
+        self._owner = None
+        self._stats.update(leases=0, waited=0, done_elsewhere=0)
+
+    @property
+    def owner(self):
+        # One owner id per process; reset after a fork
+        if self._owner is None:
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        return self._owner
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _run(self, key, fn, done=None, wait_seconds=None):
+        """
+        done() returns the finished result when another worker already did the work (else None);
+        it is checked while waiting for a lease. Raises LeaseTimeout after wait_seconds.
+        """
+        wait_seconds = self.wait_seconds if wait_seconds is None else wait_seconds
+        deadline = time.monotonic() + wait_seconds
+        waited = False
+        while True:
+            now = datetime.utcnow()
+            if self.lease_store.acquire(key, self.owner, now, now + timedelta(seconds=self.lease_seconds)):
+                self._count('leases')
+                try:
+                    # The previous holder may have finished the work just before releasing
+                    result = done() if waited and done is not None else None
+                    if result is not None:
+                        self._count('done_elsewhere')
+                        return result
+                    return fn()
+                finally:
+                    self.lease_store.release(key, self.owner)
+
+            if not waited:
+                waited = True
+                self._count('waited')
+            if done is not None:
+                result = done()
+                if result is not None:
+                    self._count('done_elsewhere')
+                    return result
+            if time.monotonic() >= deadline:
+                raise LeaseTimeout(f"{key} is being processed by another worker")
+            time.sleep(self.poll_interval)
+
+    def _after_fork(self):
+        super()._after_fork()
+        self._owner = None
+
+
+_flights = []
+
+
+def create_single_flight(get_collection, backend='mongo', **options):
+    """LeasedSingleFlight over MongoDB leases, or the in-memory lease store for backend='memory'"""
+    store = MemoryLeaseStore() if backend == 'memory' else MongoLeaseStore(get_collection)
+    flight = LeasedSingleFlight(store, **options)
+    _flights.append(flight)
+    return flight
+
+
+def _after_fork_in_child():
+    for flight in _flights:
+        flight._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
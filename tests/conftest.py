@@ -0,0 +1,35 @@
+# Modules live at the repository root; the tests import them (and the frozen baseline next to this file) directly
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def mongo_client():
+    """In-memory MongoDB shared by every test that imports app"""
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient()
+
+
+@pytest.fixture(scope='session')
+def app_module(mongo_client):
+    """app imported against mongo_client instead of MONGODB_URI"""
+    import db_manager
+    db_manager.get_client = lambda: mongo_client
+    db_manager.ping = lambda: None
+    import app
+    return app
+
+
+@pytest.fixture
+def course_jobs(app_module, monkeypatch):
+    """app.course_jobs on a fresh in-memory store, with no worker threads or retry backoff: tests run jobs with run_next()"""
+    from job_queue import MemoryJobStore
+    monkeypatch.setattr(app_module.course_jobs, 'store', MemoryJobStore())
+    monkeypatch.setattr(app_module.course_jobs, 'retry_backoff', 0)
+    monkeypatch.setattr(app_module.course_jobs, 'start', lambda: None)
+    return app_module.course_jobs
@@ -0,0 +1,152 @@
+"""
+CourseCatalog snapshots against mongomock: first loads, reloads swapped in whole, reloads shared
+between workers through CatalogGeneration, and load errors that must never read as an empty level.
+"""
+import pytest
+
+from catalog import CatalogGeneration, CourseCatalog
+from qualification import build_user_profile
+
+mongomock = pytest.importorskip('mongomock')
+
+
+PROFILE = build_user_profile({'ENG': 'B'}, 'B')
+
+
+def course(name, mean_grade='C'):
+    return {'programme_name': name, 'minimum_grade': {'mean_grade': mean_grade}, 'minimum_subject_requirements': {}}
+
+
+@pytest.fixture
+def client():
+    client = mongomock.MongoClient()
+    client.diploma.business.insert_many([course('Accounts'), course('Marketing')])
+    client.diploma.ict.insert_one(course('Networking'))
+    return client
+
+
+class Source:
+    """The level's database, which can be made unavailable"""
+
+    def __init__(self, client):
+        self.client = client
+        self.down = False
+
+    def __call__(self):
+        if self.down:
+            raise RuntimeError('courses database down')
+        return self.client.diploma
+
+
+def make_catalog(source, generation=None):
+    catalog = CourseCatalog(generation_check=0)
+    catalog.register_level('diploma', source, ['business', 'ict'], tag_field='collection')
+    if generation is not None:
+        catalog.set_generation_store(generation)
+    return catalog
+
+
+def names(catalog):
+    return [c['programme_name'] for group in catalog.get_level('diploma') for c in group.courses]
+
+
+def test_level_loads_once_in_collection_order(client):
+    catalog = make_catalog(Source(client))
+    groups = catalog.get_level('diploma')
+    assert [group.name for group in groups] == ['business', 'ict']
+    assert names(catalog) == ['Accounts', 'Marketing', 'Networking']
+    assert catalog.get_level('diploma') is groups
+    assert groups[1].courses[0]['collection'] == 'ict'
+
+
+def test_reload_swaps_in_a_new_snapshot_and_version(client):
+    catalog = make_catalog(Source(client))
+    old_groups = catalog.get_level('diploma')
+    old_version = catalog.level_version('diploma')
+
+    client.diploma.ict.insert_one(course('Cyber Security'))
+    catalog.reload()
+    assert names(catalog) == ['Accounts', 'Marketing', 'Networking', 'Cyber Security']
+    assert catalog.level_version('diploma') != old_version
+    # Readers holding the old snapshot keep a complete one
+    assert sum(len(group.courses) for group in old_groups) == 3
+
+
+def test_identical_content_has_the_same_version_in_every_worker(client):
+    first, second = make_catalog(Source(client)), make_catalog(Source(client))
+    assert first.level_version('diploma') == second.level_version('diploma')
+    profile_key = first.profile_key('diploma', PROFILE)[1]
+    assert profile_key == second.profile_key('diploma', PROFILE)[1]
+
+
+def test_generation_is_shared_and_bumped(client):
+    generation = CatalogGeneration(lambda: client.user_data.catalog_generation)
+    assert generation.read() == 0
+    assert generation.bump() == 1
+    assert generation.bump() == 2
+    assert CatalogGeneration(lambda: client.user_data.catalog_generation).read() == 2
+
+
+def test_broadcast_reload_reaches_other_workers(client):
+    generation = CatalogGeneration(lambda: client.user_data.catalog_generation)
+    worker_a = make_catalog(Source(client), generation)
+    worker_b = make_catalog(Source(client), generation)
+    assert names(worker_a) == names(worker_b) == ['Accounts', 'Marketing', 'Networking']
+
+    client.diploma.business.insert_one(course('Procurement'))
+    worker_a.reload(broadcast=True)
+    assert 'Procurement' in names(worker_a)
+    # worker_b notices the bumped generation on its next read
+    assert 'Procurement' in names(worker_b)
+    assert worker_a.stats()['generation'] == worker_b.stats()['generation'] == 1
+
+
+def test_failed_first_load_raises_and_is_retried(client):
+    source = Source(client)
+    catalog = make_catalog(source)
+    source.down = True
+    with pytest.raises(RuntimeError):
+        catalog.get_level('diploma')
+    with pytest.raises(RuntimeError):
+        catalog.profile_key('diploma', PROFILE)
+
+    source.down = False
+    assert names(catalog) == ['Accounts', 'Marketing', 'Networking']
+
+
+def test_failed_reload_keeps_the_previous_snapshot(client):
+    source = Source(client)
+    catalog = make_catalog(source)
+    version = catalog.level_version('diploma')
+
+    source.down = True
+    catalog.reload()
+    assert names(catalog) == ['Accounts', 'Marketing', 'Networking']
+    assert catalog.level_version('diploma') == version
+
+
+def test_collection_that_cannot_be_read_fails_the_load(client, monkeypatch):
+    catalog = make_catalog(Source(client))
+
+    def broken_find(*args, **kwargs):
+        raise RuntimeError('cursor died')
+
+    monkeypatch.setattr(client.diploma.ict, 'find', broken_find)
+    with pytest.raises(RuntimeError, match='ict'):
+        catalog.get_level('diploma')
+
+
+def test_app_qualification_propagates_load_errors(app_module, client, monkeypatch):
+    source = Source(client)
+    source.down = True
+    monkeypatch.setattr(app_module, 'course_catalog', make_catalog(source))
+
+    with pytest.raises(RuntimeError):
+        list(app_module.iter_qualifying_groups('diploma', PROFILE))
+    with pytest.raises(RuntimeError):
+        app_module.qualify_level('diploma', PROFILE)
+    with pytest.raises(RuntimeError):
+        app_module.qualify_all_levels({'ENG': 'B'}, 'B', levels=['diploma'])
+
+    source.down = False
+    assert len(app_module.qualify_level('diploma', PROFILE)) == 3
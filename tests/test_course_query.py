@@ -0,0 +1,49 @@
+"""
+find_qualifying_course_groups over a stub database (mongomock cannot evaluate the generated $expr):
+results keep collection order, and a collection that cannot be queried fails the whole query.
+"""
+import pytest
+
+from course_query import find_qualifying_course_groups
+from qualification import build_user_profile
+
+
+class StubCollection:
+    def __init__(self, courses):
+        self.courses = courses
+
+    def find(self, query, projection=None):
+        if self.courses is None:
+            raise RuntimeError('collection unavailable')
+        return [dict(course) for course in self.courses]
+
+
+class StubDatabase:
+    """Collections by name; None stands for a collection whose find() fails"""
+
+    def __init__(self, collections):
+        self.collections = collections
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def __getitem__(self, name):
+        return StubCollection(self.collections[name])
+
+
+PROFILE = build_user_profile({'ENG': 'B'}, 'B')
+
+
+def test_groups_follow_collection_order_and_skip_empty_ones():
+    database = StubDatabase({'b': [{'programme_name': 'B1'}], 'a': [{'programme_name': 'A1'}], 'c': []})
+    groups = find_qualifying_course_groups(database, ['a', 'b', 'c', 'not_there'], PROFILE, tag_field='collection')
+    assert [(name, [course['programme_name'] for course in courses]) for name, courses in groups] == [
+        ('a', ['A1']), ('b', ['B1'])
+    ]
+    assert groups[0][1][0]['collection'] == 'a'
+
+
+def test_failed_collection_fails_the_query():
+    database = StubDatabase({'a': [{'programme_name': 'A1'}], 'broken': None})
+    with pytest.raises(RuntimeError, match='broken'):
+        find_qualifying_course_groups(database, ['a', 'broken'], PROFILE)
@@ -0,0 +1,176 @@
+"""
+JobQueue over the in-memory store: leases, retries, re-enqueueing and retention.
+Most tests drive run_next() against a fake clock; only the wakeup test starts worker threads.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import job_queue
+from job_queue import COMPLETED, FAILED, QUEUED, RUNNING, JobQueue, MemoryJobStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2026, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, 'utcnow', clock)
+    return clock
+
+
+def make_queue(**options):
+    options.setdefault('max_attempts', 3)
+    options.setdefault('retry_backoff', 10)
+    queue = JobQueue('test_jobs', MemoryJobStore(), workers=1, **options)
+    # Tests run jobs themselves with run_next()
+    queue.start = lambda: None
+    return queue
+
+
+def flaky(failures):
+    """Handler that raises for its first `failures` calls"""
+    calls = []
+
+    def handler(value):
+        calls.append(value)
+        if len(calls) <= failures:
+            raise RuntimeError(f"attempt {len(calls)} failed")
+        return {'value': value}
+    return handler, calls
+
+
+def test_job_completes_once_and_is_kept_for_retention(clock):
+    queue = make_queue()
+    handler, calls = flaky(0)
+    queue.register('work', handler)
+
+    assert queue.enqueue('job-1', 'work', value=7)['status'] == QUEUED
+    assert queue.run_next('worker-a')
+    assert not queue.run_next('worker-a')
+
+    job = queue.status('job-1')
+    assert job['status'] == COMPLETED and job['result'] == {'value': 7} and job['attempts'] == 1
+    assert queue.store.get('job-1')['expires_at'] == clock.now + timedelta(seconds=job_queue.JOB_RETENTION_SECONDS)
+
+    # Enqueueing a completed job again does not run it again
+    assert queue.enqueue('job-1', 'work', value=8)['status'] == COMPLETED
+    assert not queue.run_next('worker-a')
+    assert calls == [7]
+
+
+def test_failed_attempts_are_retried_with_backoff(clock):
+    queue = make_queue()
+    handler, calls = flaky(2)
+    queue.register('work', handler)
+    queue.enqueue('job-1', 'work', value=1)
+
+    assert queue.run_next('worker-a')
+    job = queue.status('job-1')
+    assert job['status'] == QUEUED and job['error'] == 'attempt 1 failed'
+    assert job['run_at'] == clock.now + timedelta(seconds=10)
+
+    # Not ready until the backoff has passed, which doubles on the next failure
+    assert not queue.run_next('worker-a')
+    clock.advance(10)
+    assert queue.run_next('worker-a')
+    assert queue.status('job-1')['run_at'] == clock.now + timedelta(seconds=20)
+
+    clock.advance(20)
+    assert queue.run_next('worker-a')
+    job = queue.status('job-1')
+    assert job['status'] == COMPLETED and job['attempts'] == 3 and len(calls) == 3
+    assert queue.stats()['retried'] == 2
+
+
+def test_job_fails_after_max_attempts_and_runs_again_when_re_enqueued(clock):
+    queue = make_queue(retry_backoff=0)
+    handler, calls = flaky(3)
+    queue.register('work', handler)
+    queue.enqueue('job-1', 'work', value=1)
+
+    for _ in range(3):
+        assert queue.run_next('worker-a')
+    job = queue.status('job-1')
+    assert job['status'] == FAILED and job['error'] == 'attempt 3 failed'
+    assert queue.store.get('job-1')['expires_at'] == clock.now + timedelta(seconds=job_queue.JOB_RETENTION_SECONDS)
+    assert not queue.run_next('worker-a')
+
+    job = queue.enqueue('job-1', 'work', value=2)
+    assert job['status'] == QUEUED and job['attempts'] == 0 and 'error' not in job
+    assert 'expires_at' not in queue.store.get('job-1')
+    assert queue.run_next('worker-a')
+    assert queue.status('job-1')['result'] == {'value': 2}
+
+
+def test_restart_runs_a_completed_job_again(clock):
+    queue = make_queue()
+    handler, calls = flaky(0)
+    queue.register('work', handler)
+    queue.enqueue('job-1', 'work', value=1)
+    assert queue.run_next('worker-a')
+
+    job = queue.enqueue('job-1', 'work', restart=True, value=2)
+    assert job['status'] == QUEUED and 'result' not in job
+    # Already queued: restarting again changes nothing
+    assert queue.enqueue('job-1', 'work', restart=True, value=3)['status'] == QUEUED
+    assert queue.run_next('worker-a') and not queue.run_next('worker-a')
+    assert queue.status('job-1')['result'] == {'value': 2} and calls == [1, 2]
+
+
+def test_expired_lease_is_taken_over_and_the_old_owner_cannot_finish(clock):
+    queue = make_queue(lease_seconds=60)
+    handler, calls = flaky(0)
+    queue.register('work', handler)
+    queue.enqueue('job-1', 'work', value=1)
+
+    # worker-a leases the job and dies without finishing it
+    assert queue.store.lease('worker-a', clock.now, clock.now + timedelta(seconds=60))['status'] == RUNNING
+    assert not queue.run_next('worker-b')
+
+    clock.advance(61)
+    assert queue.run_next('worker-b')
+    job = queue.status('job-1')
+    assert job['status'] == COMPLETED and job['attempts'] == 2
+
+    assert not queue.store.finish('job-1', 'worker-a', {'status': FAILED})
+    assert queue.status('job-1')['status'] == COMPLETED
+
+
+def test_missing_handler_fails_the_attempt(clock):
+    queue = make_queue(max_attempts=1)
+    queue.enqueue('job-1', 'unknown')
+    assert queue.run_next('worker-a')
+    job = queue.status('job-1')
+    assert job['status'] == FAILED and 'No handler' in job['error']
+
+
+def test_status_does_not_start_workers():
+    queue = JobQueue('test_jobs', MemoryJobStore(), workers=1)
+    assert queue.status('job-1') is None
+    assert queue.stats()['workers'] == 0
+
+
+def test_idle_workers_wake_for_enqueues_and_retries():
+    # Polling alone would take a minute; the wakeup event and the scheduled retry must do it
+    queue = JobQueue('test_jobs', MemoryJobStore(), workers=1, retry_backoff=0.2, poll_interval=60)
+    handler, calls = flaky(1)
+    queue.register('work', handler)
+    queue.start()
+
+    done = queue.watch('job-1')
+    queue.enqueue('job-1', 'work', value=1)
+    assert done.wait(5) and queue.status('job-1')['status'] == QUEUED
+
+    retried = queue.watch('job-1')
+    assert retried.wait(5)
+    assert queue.status('job-1')['status'] == COMPLETED and len(calls) == 2
@@ -0,0 +1,142 @@
+"""
+The post-payment pipeline against an in-memory MongoDB: a paid category only completes once its
+courses are saved, or when qualification genuinely found none. Anything that stops qualification
+from running must fail the job so it is retried, never complete it with 0 courses.
+"""
+import pytest
+
+import course_query
+from catalog import CourseCatalog
+from job_queue import COMPLETED, QUEUED
+
+LEVEL = 'kmtc'
+
+
+def unavailable():
+    raise RuntimeError('courses database down')
+
+
+def failing_catalog(get_database=unavailable):
+    """A catalog whose level cannot be loaded (or queried)"""
+    catalog = CourseCatalog(generation_check=0)
+    catalog.register_level(LEVEL, get_database, ['kmtc_courses'])
+    return catalog
+
+
+@pytest.fixture(scope='module')
+def kmtc_courses(app_module, mongo_client):
+    """Four KMTC courses every test profile qualifies for"""
+    mongo_client.kmtc.kmtc_courses.insert_many([
+        {'programme_name': f"Nursing {i}", 'programme_code': f"K{i}", 'institution_name': 'KMTC',
+         'minimum_grade': {'mean_grade': 'C'}, 'minimum_subject_requirements': {}}
+        for i in range(4)
+    ])
+    app_module.course_catalog.reload()
+    return 4
+
+
+def pay(app, email, index_number, grade_data=True):
+    subject = next(iter(app.SUBJECTS))
+    app.user_payments_collection.insert_one({
+        'email': email, 'index_number': index_number, 'level': LEVEL, 'payment_confirmed': True,
+        'transaction_ref': f"T{index_number}",
+        'grade_data': {'type': LEVEL, 'grades': {subject: 'B'}, 'mean_grade': 'B'} if grade_data else None
+    })
+
+
+def run_job(course_jobs, email, index_number):
+    course_jobs.run_next('test-worker')
+    return course_jobs.status(f"courses:{email}:{index_number}:{LEVEL}")
+
+
+def test_catalog_load_error_fails_the_job(app_module, course_jobs, monkeypatch):
+    monkeypatch.setattr(app_module, 'course_catalog', failing_catalog())
+    profile = app_module.build_user_profile({'ENG': 'B'}, 'B')
+
+    with pytest.raises(RuntimeError):
+        list(app_module.iter_qualifying_groups(LEVEL, profile))
+
+    pay(app_module, 'load-error@example.com', '1001')
+    app_module.process_courses_after_payment('load-error@example.com', '1001', LEVEL)
+    job = run_job(course_jobs, 'load-error@example.com', '1001')
+    assert job['status'] == QUEUED and 'courses database down' in job['error']
+    assert app_module.saved_courses_result('load-error@example.com', '1001', LEVEL) is None
+
+
+@pytest.mark.parametrize('get_database', [lambda: None, unavailable], ids=['no-database', 'query-error'])
+def test_course_query_error_fails_the_job(app_module, course_jobs, monkeypatch, get_database):
+    monkeypatch.setattr(course_query, 'COURSE_QUERY_LEVELS', {LEVEL})
+    monkeypatch.setattr(app_module, 'course_catalog', failing_catalog(get_database))
+    profile = app_module.build_user_profile({'ENG': 'B'}, 'B')
+
+    with pytest.raises(RuntimeError):
+        app_module.qualify_level(LEVEL, profile)
+
+    pay(app_module, 'query-error@example.com', '1002')
+    app_module.process_courses_after_payment('query-error@example.com', '1002', LEVEL)
+    job = run_job(course_jobs, 'query-error@example.com', '1002')
+    assert job['status'] == QUEUED and job['error']
+    assert app_module.saved_courses_result('query-error@example.com', '1002', LEVEL) is None
+
+
+def test_dashboard_queues_unprocessed_levels_without_qualifying(app_module, course_jobs, kmtc_courses, monkeypatch):
+    def qualify_in_request(*args, **kwargs):
+        raise AssertionError('the dashboard must not qualify courses itself')
+
+    pay(app_module, 'dashboard@example.com', '1003')
+    client = app_module.app.test_client()
+    with monkeypatch.context() as patched:
+        patched.setattr(app_module, 'qualify_paid_levels', qualify_in_request)
+        page = client.get('/verified-dashboard?index=1003&receipt=T1003')
+    assert page.status_code == 200 and b'Processing' in page.data
+    assert course_jobs.status(f"courses:dashboard@example.com:1003:{LEVEL}")['status'] == QUEUED
+    assert app_module.saved_courses_result('dashboard@example.com', '1003', LEVEL) is None
+
+    assert run_job(course_jobs, 'dashboard@example.com', '1003')['status'] == COMPLETED
+    page = client.get('/verified-dashboard?index=1003&receipt=T1003')
+    assert page.status_code == 200 and b'Processing' not in page.data
+    assert f"{kmtc_courses} courses".encode() in page.data
+
+
+def test_payment_without_grades_fails_and_runs_again_once_fixed(app_module, course_jobs, kmtc_courses):
+    pay(app_module, 'no-grades@example.com', '1004', grade_data=False)
+    app_module.process_courses_after_payment('no-grades@example.com', '1004', LEVEL)
+    job = run_job(course_jobs, 'no-grades@example.com', '1004')
+    assert job['status'] == QUEUED and 'No grade data' in job['error']
+
+    app_module.user_payments_collection.update_one(
+        {'email': 'no-grades@example.com', 'index_number': '1004'},
+        {'$set': {'grade_data': {'type': LEVEL, 'grades': {'ENG': 'B'}, 'mean_grade': 'B'}}}
+    )
+    job = run_job(course_jobs, 'no-grades@example.com', '1004')
+    assert job['status'] == COMPLETED and job['result'] == {'courses_count': kmtc_courses}
+
+
+def activate(client, index_number, mean_grade):
+    """Manual activation through enter_details, with the grades entered in this session"""
+    with client.session_transaction() as session:
+        session[f"manual_activation_{index_number}"] = True
+        session[f"{LEVEL}_data_submitted"] = True
+        session[f"{LEVEL}_grades"] = {'ENG': 'B'}
+        session[f"{LEVEL}_mean_grade"] = mean_grade
+    return client.post(f"/enter-details/{LEVEL}", data={'email': 'manual@example.com', 'index_number': index_number})
+
+
+def test_manual_reactivation_with_corrected_grades_qualifies_again(app_module, course_jobs, kmtc_courses):
+    index_number = '12345678901/2024'
+    client = app_module.app.test_client()
+
+    assert activate(client, index_number, 'B').status_code == 302
+    assert run_job(course_jobs, 'manual@example.com', index_number)['result'] == {'courses_count': kmtc_courses}
+
+    # The same grades again keep the saved results
+    activate(client, index_number, 'B')
+    assert not course_jobs.run_next('test-worker')
+    assert app_module.saved_courses_result('manual@example.com', index_number, LEVEL) == {'courses_count': kmtc_courses}
+
+    # Corrected grades that reach no course replace the old results
+    activate(client, index_number, 'D')
+    assert app_module.saved_courses_result('manual@example.com', index_number, LEVEL) is None
+    job = run_job(course_jobs, 'manual@example.com', index_number)
+    assert job['status'] == COMPLETED and job['result'] == {'courses_count': 0}
+    assert app_module.saved_courses_result('manual@example.com', index_number, LEVEL) is None
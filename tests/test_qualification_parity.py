@@ -0,0 +1,177 @@
+"""
+Parity of every qualification path with the original rules (tests/baseline_qualification.py):
+the compiled Python rules, canonical profiles (qualification cache keys), the degree cut-off
+index and the NumPy engine, over random catalogs and users.
+
+The baseline raised on some inputs (e.g. the diploma rule with an unreadable mean grade), which
+skipped the rest of that collection; only the outcomes it actually defined are compared.
+"""
+import random
+
+import pytest
+
+import baseline_qualification as baseline
+from catalog import build_catalog_group, cut_off_candidates
+from qualification import (
+    GRADE_VALUES, build_user_profile, build_level_thresholds, canonical_profile,
+    qualifies_by_cluster_points, qualifies_by_mean_grade
+)
+
+GRADES = list(GRADE_VALUES)
+SUBJECTS = ['MAT', 'ENG', 'KIS', 'CHE', 'BIO', 'PHY', 'GEO', 'HAG', 'CRE', 'BST', 'AGR', 'COM']
+CLUSTERS = [f"cluster_{i}" for i in range(1, 21)]
+USERS = 300
+COURSES_PER_CLUSTER = 30
+
+
+def random_grade(rng):
+    # Mostly clean grades, with the odd 'C+/C' or unreadable value seen in the real data
+    roll = rng.random()
+    if roll < 0.05:
+        return f"{rng.choice(GRADES)}/{rng.choice(GRADES)}"
+    if roll < 0.07:
+        return rng.choice(['', 'X', None])
+    return rng.choice(GRADES)
+
+
+def random_course(rng, cluster):
+    requirements = {}
+    for _ in range(rng.randint(0, 5)):
+        key = '/'.join(rng.sample(SUBJECTS, rng.choice([1, 1, 1, 2, 3])))
+        requirements[key] = random_grade(rng)
+    course = {
+        'programme_name': f"Programme {rng.randint(1, 10 ** 6)}",
+        'minimum_subject_requirements': requirements,
+        'cluster': cluster,
+        'cut_off_points': rng.choice([0, round(rng.uniform(10, 48), 3)])
+    }
+    if rng.random() < 0.8:
+        course['minimum_grade'] = {'mean_grade': random_grade(rng)}
+    return course
+
+
+def random_user(rng):
+    """Raw form input: (grades, mean grade, cluster points), as the submit routes store them"""
+    grades = {subject: rng.choice(GRADES) for subject in rng.sample(SUBJECTS, rng.randint(0, len(SUBJECTS)))}
+    cluster_points = {cluster: round(rng.uniform(0, 48), 3) for cluster in CLUSTERS if rng.random() < 0.9}
+    return grades, rng.choice(GRADES + ['']), cluster_points
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    rng = random.Random(2024)
+    groups = [
+        build_catalog_group(cluster, [random_course(rng, cluster) for _ in range(COURSES_PER_CLUSTER)])
+        for cluster in CLUSTERS
+    ]
+    # The original documents in catalog order, for the baseline rules
+    courses = [dict(course) for group in groups for course in group.courses]
+    return groups, courses
+
+
+@pytest.fixture(scope='module')
+def users():
+    rng = random.Random(2025)
+    return [random_user(rng) for _ in range(USERS)]
+
+
+def baseline_rows(courses, rule, grades, score):
+    """Rows the baseline rule accepts and the rows it defines an outcome for (it raises on the rest)"""
+    accepted, defined = [], []
+    for row, course in enumerate(courses):
+        try:
+            qualifies = rule(course, grades, score)
+        except (KeyError, TypeError):
+            continue
+        defined.append(row)
+        if qualifies:
+            accepted.append(row)
+    return accepted, defined
+
+
+def compiled_rows(groups, rule, profile):
+    rows = []
+    row = 0
+    for group in groups:
+        for requirements in group.requirements:
+            if rule(requirements, profile):
+                rows.append(row)
+            row += 1
+    return rows
+
+
+def indexed_rows(groups, profile):
+    """Degree rule through the per-cluster cut-off index, as iter_qualifying_records runs it"""
+    rows = []
+    offset = 0
+    for group in groups:
+        user_points = profile.cluster_points.get(group.name, 0)
+        for position in cut_off_candidates(group, user_points):
+            if qualifies_by_cluster_points(group.requirements[position], profile):
+                rows.append(offset + position)
+        offset += len(group.courses)
+    return rows
+
+
+# (baseline rule, compiled rule, which raw score the level qualifies on)
+RULES = {
+    'degree': (baseline.check_course_qualification, qualifies_by_cluster_points, 'cluster_points'),
+    'diploma': (baseline.check_diploma_course_qualification, qualifies_by_mean_grade, 'mean_grade'),
+    'certificate': (baseline.check_certificate_course_qualification, qualifies_by_mean_grade, 'mean_grade'),
+    'artisan': (baseline.check_artisan_course_qualification, qualifies_by_mean_grade, 'mean_grade'),
+}
+
+
+def expected_and_profile(courses, level, user):
+    grades, mean_grade, cluster_points = user
+    baseline_rule, _, score = RULES[level]
+    accepted, defined = baseline_rows(
+        courses, baseline_rule, grades, cluster_points if score == 'cluster_points' else mean_grade
+    )
+    return accepted, set(defined), build_user_profile(grades, mean_grade, cluster_points)
+
+
+@pytest.mark.parametrize('level', list(RULES))
+def test_compiled_rules_match_baseline(catalog, users, level):
+    groups, courses = catalog
+    compared = 0
+    for user in users:
+        expected, defined, profile = expected_and_profile(courses, level, user)
+        actual = [row for row in compiled_rows(groups, RULES[level][1], profile) if row in defined]
+        assert actual == expected, f"{level} drifted from the baseline for {user}"
+        compared += len(defined)
+    # Most outcomes are defined; a generator change that makes the baseline raise everywhere proves nothing
+    assert compared > len(users) * len(courses) // 2
+
+
+@pytest.mark.parametrize('level', list(RULES))
+def test_canonical_profiles_keep_results(catalog, users, level):
+    """Users sharing a canonical profile share cached results, so it must not change any outcome"""
+    groups, courses = catalog
+    thresholds = build_level_thresholds([r for group in groups for r in group.requirements])
+    rule = RULES[level][1]
+    for user in users:
+        expected, defined, profile = expected_and_profile(courses, level, user)
+        canonical = canonical_profile(thresholds, profile)
+        assert [row for row in compiled_rows(groups, rule, canonical) if row in defined] == expected
+
+
+def test_cut_off_index_matches_baseline(catalog, users):
+    groups, courses = catalog
+    for user in users:
+        expected, defined, profile = expected_and_profile(courses, 'degree', user)
+        assert [row for row in indexed_rows(groups, profile) if row in defined] == expected
+
+
+@pytest.mark.parametrize('level', list(RULES))
+def test_numpy_engine_matches_baseline(catalog, users, level):
+    pytest.importorskip('numpy')
+    from vector_engine import VectorizedLevel
+
+    groups, courses = catalog
+    vectorized = VectorizedLevel(groups)
+    vector_rule = (vectorized.qualify_by_cluster_points if RULES[level][2] == 'cluster_points'
+                   else vectorized.qualify_by_mean_grade)
+    for user in users:
+        expected, defined, profile = expected_and_profile(courses, level, user)
+        assert [row for row in vector_rule(profile).tolist() if row in defined] == expected
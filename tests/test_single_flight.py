@@ -0,0 +1,134 @@
+"""
+LeasedSingleFlight over the in-memory lease store: one run per key across "workers" (instances
+sharing a store), the done= short-circuit, lease expiry, timeouts and failing calls.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from single_flight import LeasedSingleFlight, LeaseTimeout, MemoryLeaseStore
+
+
+def make_flight(store, **options):
+    options.setdefault('wait_seconds', 5)
+    return LeasedSingleFlight(store, lease_seconds=60, poll_interval=0.01, **options)
+
+
+def hold_lease(store, key, seconds):
+    """Another worker's lease on key, expiring in `seconds`"""
+    now = datetime.utcnow()
+    assert store.acquire(key, 'other-worker', now, now + timedelta(seconds=seconds))
+
+
+def test_call_runs_and_releases_the_lease():
+    store = MemoryLeaseStore()
+    flight = make_flight(store)
+    assert flight.do('key', lambda: 'result') == 'result'
+    assert store._leases == {}
+    assert flight.stats()['leases'] == 1
+
+
+def test_concurrent_callers_in_one_process_share_a_call():
+    flight = make_flight(MemoryLeaseStore())
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'shared'
+
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', work)))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', work)))
+    follower.start()
+    # Release the leader only once the follower has joined its call
+    deadline = time.monotonic() + 5
+    while flight.stats()['shared'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ['shared', 'shared'] and len(calls) == 1
+
+
+def test_exception_reaches_the_caller_and_frees_the_key():
+    store = MemoryLeaseStore()
+    flight = make_flight(store)
+
+    def fail():
+        raise ValueError('qualification failed')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert store._leases == {} and flight.stats()['in_flight'] == 0
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_done_short_circuits_while_another_worker_holds_the_lease():
+    store = MemoryLeaseStore()
+    hold_lease(store, 'key', 60)
+    flight = make_flight(store)
+    calls = []
+
+    assert flight.do('key', lambda: calls.append(1), done=lambda: {'courses_count': 3}) == {'courses_count': 3}
+    assert calls == [] and flight.stats()['done_elsewhere'] == 1
+    # The other worker's lease is untouched
+    assert store._leases['key']['owner'] == 'other-worker'
+
+
+def test_done_is_checked_again_after_taking_over_the_lease():
+    # The holder finished and released between our last done() check and our acquire
+    store = MemoryLeaseStore()
+    hold_lease(store, 'key', 0.05)
+    flight = make_flight(store)
+
+    def done():
+        # Nothing is saved while the other worker still holds its lease
+        return None if store._leases['key']['owner'] == 'other-worker' else 'saved elsewhere'
+
+    assert flight.do('key', lambda: 'ran again', done=done) == 'saved elsewhere'
+    assert flight.stats()['leases'] == 1 and store._leases == {}
+
+
+def test_expired_lease_of_a_crashed_worker_is_taken_over():
+    store = MemoryLeaseStore()
+    hold_lease(store, 'key', 0.05)
+    flight = make_flight(store)
+    assert flight.do('key', lambda: 'ran', done=lambda: None) == 'ran'
+    assert flight.stats()['waited'] == 1 and store._leases == {}
+
+
+def test_waiting_gives_up_with_lease_timeout():
+    store = MemoryLeaseStore()
+    hold_lease(store, 'key', 60)
+    flight = make_flight(store, wait_seconds=0.05)
+    with pytest.raises(LeaseTimeout):
+        flight.do('key', lambda: 'never', done=lambda: None)
+
+
+def test_second_worker_waits_for_the_first_and_uses_its_result():
+    store = MemoryLeaseStore()
+    worker_a, worker_b = make_flight(store), make_flight(store)
+    saved = {}
+    started, release = threading.Event(), threading.Event()
+
+    def work_a():
+        started.set()
+        release.wait(5)
+        saved['key'] = 'from worker a'
+        return saved['key']
+
+    thread = threading.Thread(target=lambda: worker_a.do('key', work_a))
+    thread.start()
+    assert started.wait(5)
+    threading.Timer(0.05, release.set).start()
+
+    result = worker_b.do('key', lambda: 'from worker b', done=lambda: saved.get('key'))
+    thread.join(5)
+    assert result == 'from worker a'
+    assert worker_b.stats()['done_elsewhere'] == 1
@@ -0,0 +1,96 @@
+"""
+WriteBehindQueue against mongomock: coalescing, and the failure path, where updates that cannot be
+written stay queued (ahead of newer ones) and are only dropped after max_attempts.
+"""
+import logging
+
+import pytest
+
+from write_behind import WriteBehindQueue
+
+mongomock = pytest.importorskip('mongomock')
+
+
+class FlakyCollection:
+    """A mongomock collection whose writes fail while `down` is set"""
+
+    def __init__(self):
+        self.collection = mongomock.MongoClient().db.records
+        self.down = False
+
+    def bulk_write(self, requests, ordered=True):
+        if self.down:
+            raise RuntimeError('bulk write failed')
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+    def update_one(self, filter_, update, upsert=False):
+        if self.down:
+            raise RuntimeError('write failed')
+        return self.collection.update_one(filter_, update, upsert=upsert)
+
+    def find_one(self, filter_):
+        return self.collection.find_one(filter_, {'_id': 0})
+
+
+@pytest.fixture
+def records():
+    return FlakyCollection()
+
+
+def make_queue(get_collection, **options):
+    # The background flusher never fires on its own here; tests flush explicitly
+    return WriteBehindQueue('records', get_collection, ('key',), enabled=True, batch_size=100,
+                            interval=60, **options)
+
+
+def test_updates_to_a_key_are_coalesced_into_one_write(records):
+    queue = make_queue(lambda: records)
+    queue.submit({'key': 1}, {'$set': {'a': 1, 'b': 1}})
+    queue.submit({'key': 1}, {'$set': {'b': 2}, '$unset': {'a': ''}})
+    assert queue.flush()
+    assert records.find_one({'key': 1}) == {'key': 1, 'b': 2}
+    assert queue.stats()['written'] == 1 and queue.stats()['coalesced'] == 1
+
+
+def test_failed_updates_stay_queued_until_they_are_written(records):
+    queue = make_queue(lambda: records)
+    queue.submit({'key': 1}, {'$set': {'a': 1, 'b': 1}})
+    queue.submit({'key': 2}, {'$set': {'a': 1}})
+
+    records.down = True
+    assert not queue.flush()
+    assert not queue.flush_key({'key': 1})
+    assert queue.is_pending({'key': 1}) and queue.is_pending({'key': 2})
+
+    # A newer update for the key applies after the one that failed
+    queue.submit({'key': 1}, {'$set': {'b': 2}})
+    records.down = False
+    assert queue.flush()
+    assert records.find_one({'key': 1}) == {'key': 1, 'a': 1, 'b': 2}
+    assert records.find_one({'key': 2}) == {'key': 2, 'a': 1}
+    stats = queue.stats()
+    assert stats['pending'] == 0 and stats['dropped'] == 0 and stats['requeued'] == 3
+
+
+def test_missing_collection_keeps_updates_queued(records):
+    collection = {'current': None}
+    queue = make_queue(lambda: collection['current'])
+    queue.submit({'key': 1}, {'$set': {'a': 1}})
+    assert not queue.flush()
+    assert queue.is_pending({'key': 1})
+
+    collection['current'] = records
+    assert queue.flush()
+    assert records.find_one({'key': 1}) == {'key': 1, 'a': 1}
+
+
+def test_update_is_dropped_with_an_error_after_max_attempts(records, caplog):
+    queue = make_queue(lambda: records, max_attempts=3)
+    queue.submit({'key': 1}, {'$set': {'a': 1}})
+    records.down = True
+    with caplog.at_level(logging.ERROR, logger='write_behind'):
+        for _ in range(3):
+            assert not queue.flush()
+    assert not queue.is_pending({'key': 1})
+    assert queue.stats()['dropped'] == 1
+    assert any('dropped an update' in message for message in caplog.messages)
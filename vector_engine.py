@@ -0,0 +1,163 @@
+# --- Vectorized Qualification Engine ---
+"""
+Optional NumPy engine that evaluates a user against a whole catalog level at once.
+
+Each level is encoded as:
+- a courses x subjects minimum-grade matrix for single-subject requirements
+- "any-of" groups for slash alternatives such as 'MAT/PHY' (membership matrix + minimum + owning course)
+- a minimum mean-grade vector
+- a cut-off vector with the index of the cluster each cut-off applies to
+
+It returns the same courses, in the same order, as qualifies_by_cluster_points / qualifies_by_mean_grade.
+"""
+import logging
+import os
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 'numpy' turns the engine on when NumPy is installed; anything else keeps the pure Python loops
+QUALIFICATION_ENGINE = os.getenv('QUALIFICATION_ENGINE', 'python').lower()
+
+
+def vector_engine_enabled():
+    """True when the NumPy engine is selected and importable"""
+    return QUALIFICATION_ENGINE == 'numpy' and NUMPY_AVAILABLE
+
+
+class VectorizedLevel:
+    """Array encoding of one catalog level's compiled requirements"""
+
+    def __init__(self, groups):
+        self.courses = []
+        self.group_starts = []
+        self.group_names = []
+        requirements = []
+        for group in groups:
+            self.group_starts.append(len(self.courses))
+            self.group_names.append(group.name)
+            self.courses.extend(group.courses)
+            requirements.extend(group.requirements)
+
+        subjects = sorted({
+            subject
+            for course_requirements in requirements
+            for alternatives, _ in course_requirements.subjects
+            for subject in alternatives
+        })
+        clusters = sorted({r.cluster for r in requirements if r.cut_off})
+        self.subject_index = {subject: i for i, subject in enumerate(subjects)}
+        self.cluster_index = {cluster: i for i, cluster in enumerate(clusters)}
+
+        n_courses = len(requirements)
+        n_subjects = len(subjects)
+
+        self.min_grades = np.zeros((n_courses, n_subjects), dtype=np.int8)
+        self.min_mean = np.zeros(n_courses, dtype=np.int8)
+        self.cut_off = np.zeros(n_courses, dtype=np.float64)
+        self.cut_off_cluster = np.zeros(n_courses, dtype=np.intp)
+        self.satisfiable = np.ones(n_courses, dtype=bool)
+
+        any_of_members = []
+        any_of_min = []
+        any_of_course = []
+
+        for row, course_requirements in enumerate(requirements):
+            self.satisfiable[row] = course_requirements.satisfiable
+            self.min_mean[row] = course_requirements.min_mean
+            if course_requirements.cut_off:
+                self.cut_off[row] = course_requirements.cut_off
+                self.cut_off_cluster[row] = self.cluster_index[course_requirements.cluster]
+
+            for alternatives, minimum in course_requirements.subjects:
+                if len(alternatives) == 1:
+                    column = self.subject_index[alternatives[0]]
+                    self.min_grades[row, column] = max(self.min_grades[row, column], minimum)
+                else:
+                    members = np.zeros(n_subjects, dtype=bool)
+                    for subject in alternatives:
+                        members[self.subject_index[subject]] = True
+                    any_of_members.append(members)
+                    any_of_min.append(minimum)
+                    any_of_course.append(row)
+
+        self.any_of_members = (np.array(any_of_members, dtype=bool)
+                               if any_of_members else np.zeros((0, n_subjects), dtype=bool))
+        self.any_of_min = np.array(any_of_min, dtype=np.int8)
+        self.any_of_course = np.array(any_of_course, dtype=np.intp)
+
+    def _grade_vector(self, profile):
+        grades = np.zeros(len(self.subject_index), dtype=np.int8)
+        for subject, value in profile.grades.items():
+            column = self.subject_index.get(subject)
+            if column is not None:
+                grades[column] = value
+        return grades
+
+    def _subjects_ok(self, profile):
+        grades = self._grade_vector(profile)
+        ok = (grades >= self.min_grades).all(axis=1)
+        if len(self.any_of_min):
+            best_alternative = np.where(self.any_of_members, grades, 0).max(axis=1)
+            failed_groups = self.any_of_course[best_alternative < self.any_of_min]
+            ok[failed_groups] = False
+        return ok & self.satisfiable
+
+    def qualify_by_cluster_points(self, profile):
+        """Row indices of courses passing the degree rule"""
+        points = np.zeros(max(len(self.cluster_index), 1), dtype=np.float64)
+        for cluster, column in self.cluster_index.items():
+            points[column] = profile.cluster_points.get(cluster, 0)
+        cut_off_ok = (self.cut_off == 0) | (points[self.cut_off_cluster] >= self.cut_off)
+        return np.flatnonzero(self._subjects_ok(profile) & cut_off_ok)
+
+    def qualify_by_mean_grade(self, profile):
+        """Row indices of courses passing the mean-grade rule"""
+        mean_ok = (self.min_mean == 0) | (profile.mean >= self.min_mean)
+        return np.flatnonzero(self._subjects_ok(profile) & mean_ok)
+
+
+class VectorEngine:
+    """Builds and keeps one VectorizedLevel per catalog level, rebuilding when the catalog reloads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels = {}
+
+    def get_level(self, level, groups):
+        cached = self._levels.get(level)
+        if cached is not None and cached[0] is groups:
+            return cached[1]
+        with self._lock:
+            cached = self._levels.get(level)
+            if cached is not None and cached[0] is groups:
+                return cached[1]
+            vectorized = VectorizedLevel(groups)
+            self._levels[level] = (groups, vectorized)
+            logger.info(f"✅ Vectorized {len(vectorized.courses)} {level} courses "
+                        f"({len(vectorized.subject_index)} subjects, {len(vectorized.any_of_min)} any-of groups)")
+            return vectorized
+
+    def qualifying_groups(self, level, groups, profile, by_cluster_points=False):
+        """Return [(collection_name, qualifying catalog records)] in catalog order, skipping empty collections"""
+        vectorized = self.get_level(level, groups)
+        if by_cluster_points:
+            rows = vectorized.qualify_by_cluster_points(profile)
+        else:
+            rows = vectorized.qualify_by_mean_grade(profile)
+
+        # Rows are ascending, so each collection's rows are one contiguous slice
+        courses = vectorized.courses
+        bounds = np.searchsorted(rows, vectorized.group_starts + [len(courses)])
+        return [
+            (name, [courses[row] for row in rows[start:end]])
+            for name, start, end in zip(vectorized.group_names, bounds[:-1], bounds[1:])
+            if end > start
+        ]
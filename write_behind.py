@@ -0,0 +1,286 @@
+# --- Write-Behind Upserts ---
+"""
+Collects $set/$unset updates in memory and writes them with one bulk_write per batch.
+
+- Updates to the same key are coalesced, so only the latest state of a record is written
+- A batch is flushed when it reaches WRITE_BEHIND_BATCH_SIZE or every WRITE_BEHIND_INTERVAL seconds
+- When WRITE_BEHIND_MAX_PENDING keys are waiting, submit() writes synchronously instead
+- Updates that fail are queued again (ahead of newer ones for the same key), with the flusher backing off,
+  and only dropped, with an error, after WRITE_BEHIND_MAX_ATTEMPTS attempts
+- Everything still pending is flushed on interpreter exit and by the gunicorn worker_exit hook
+
+Reads of a key that is still queued call flush_key() first, so a worker always sees its own writes.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Off by default: every save is a synchronous update_one
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '0.5'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '5000'))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '8'))
+# Longest the flusher waits between attempts while writes keep failing (the wait doubles from the interval)
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', '30'))
+
+_queues = []
+
+
+def merge_updates(earlier, later):
+    """One update with the effect of applying earlier, then later; None if they cannot be combined"""
+    if set(earlier) - {'$set', '$unset'} or set(later) - {'$set', '$unset'}:
+        return None
+    later_set = later.get('$set', {})
+    later_unset = later.get('$unset', {})
+    merged_set = {
+        field: value for field, value in earlier.get('$set', {}).items()
+        if field not in later_unset
+    }
+    merged_set.update(later_set)
+    merged_unset = {
+        field: '' for field in earlier.get('$unset', {})
+        if field not in later_set
+    }
+    merged_unset.update({field: '' for field in later_unset})
+
+    merged = {}
+    if merged_set:
+        merged['$set'] = merged_set
+    if merged_unset:
+        merged['$unset'] = merged_unset
+    return merged
+
+
+class WriteBehindQueue:
+    """Coalescing write-behind buffer for upserts into one collection"""
+
+    def __init__(self, name, get_collection, key_fields, enabled=None, batch_size=None,
+                 interval=None, max_pending=None, max_attempts=None):
+        self.name = name
+        self._get_collection = get_collection
+        self.key_fields = tuple(key_fields)
+        self.enabled = WRITE_BEHIND_ENABLED if enabled is None else enabled
+        self.batch_size = batch_size or WRITE_BEHIND_BATCH_SIZE
+        self.interval = interval or WRITE_BEHIND_INTERVAL
+        self.max_pending = max_pending or WRITE_BEHIND_MAX_PENDING
+        self.max_attempts = max_attempts or WRITE_BEHIND_MAX_ATTEMPTS
+
+        self._lock = threading.Lock()
+        # Flushes run one at a time so a key's writes reach MongoDB in submit order
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # key -> (filter, update, upsert, failed attempts)
+        self._pending = {}
+        self._flusher = None
+        # Flushes in a row that left failed updates behind (the flusher backs off while this grows)
+        self._failed_flushes = 0
+        self._stats = {
+            'submitted': 0, 'coalesced': 0, 'written': 0, 'batches': 0,
+            'synchronous': 0, 'failed': 0, 'requeued': 0, 'dropped': 0, 'last_flush_ms': 0.0
+        }
+        _queues.append(self)
+
+    def _key(self, filter_):
+        return tuple(filter_.get(field) for field in self.key_fields)
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def _write_now(self, filter_, update, upsert):
+        result = self._get_collection().update_one(filter_, update, upsert=upsert)
+        self._count('synchronous')
+        return result.acknowledged
+
+    def submit(self, filter_, update, upsert=True):
+        """
+        Queue an update of the record matching filter_ (which must hold every key field).
+        Returns True once queued or written; a synchronous write raises on failure like update_one.
+        """
+        if not self.enabled:
+            return self._write_now(filter_, update, upsert)
+
+        key = self._key(filter_)
+        with self._lock:
+            self._stats['submitted'] += 1
+            queued = self._pending.get(key)
+            if queued is not None:
+                merged = merge_updates(queued[1], update)
+                if merged is not None:
+                    self._pending[key] = (filter_, merged, upsert or queued[2], queued[3])
+                    self._stats['coalesced'] += 1
+                    return True
+            saturated = queued is None and len(self._pending) >= self.max_pending
+            if queued is None and not saturated:
+                self._pending[key] = (filter_, update, upsert, 0)
+                full = len(self._pending) >= self.batch_size
+                self._ensure_flusher()
+                if full:
+                    self._wakeup.set()
+                return True
+
+        if saturated:
+            logger.warning(f"⚠️ {self.name} write-behind queue is full, writing synchronously")
+        else:
+            # An update that cannot be merged: write the queued one first to keep the order
+            self.flush_key(filter_)
+        return self._write_now(filter_, update, upsert)
+
+    def is_pending(self, filter_):
+        with self._lock:
+            return self._key(filter_) in self._pending
+
+    def _matches(self, key, filter_):
+        # Key fields missing from the filter, or given as operators, match any value
+        for field, value in zip(self.key_fields, key):
+            wanted = filter_.get(field)
+            if wanted is not None and not isinstance(wanted, dict) and wanted != value:
+                return False
+        return True
+
+    def flush_key(self, filter_):
+        """Write the queued updates a read with this filter could see, if there are any"""
+        if not self.enabled:
+            return True
+        # Taking the flush lock also waits out a batch that is being written right now
+        with self._flush_lock:
+            with self._lock:
+                key = self._key(filter_)
+                if all(value is not None and not isinstance(value, dict) for value in key):
+                    batch = [self._pending.pop(key)] if key in self._pending else []
+                else:
+                    batch = [self._pending.pop(k) for k in list(self._pending) if self._matches(k, filter_)]
+            if not batch:
+                return True
+            return self._write_batch(batch)
+
+    def flush(self):
+        """
+        Write everything queued when the flush started, in batches of batch_size; returns False if any
+        update failed (failed updates are queued again for the next flush)
+        """
+        ok = True
+        with self._flush_lock:
+            with self._lock:
+                keys = list(self._pending)
+            for start in range(0, len(keys), self.batch_size):
+                with self._lock:
+                    batch = [self._pending.pop(key) for key in keys[start:start + self.batch_size]
+                             if key in self._pending]
+                if batch:
+                    ok = self._write_batch(batch) and ok
+        return ok
+
+    def _requeue(self, failed):
+        """Queue failed updates again, ahead of anything submitted for their keys since; drop after max_attempts"""
+        with self._lock:
+            self._stats['failed'] += len(failed)
+            for filter_, update, upsert, attempts in failed:
+                key = self._key(filter_)
+                attempts += 1
+                newer = self._pending.get(key)
+                merged = update if newer is None else merge_updates(update, newer[1])
+                if attempts >= self.max_attempts or merged is None:
+                    self._stats['dropped'] += 1
+                    logger.error(f"❌ {self.name} write-behind dropped an update for {key} after {attempts} attempts")
+                    continue
+                upsert = upsert or (newer is not None and newer[2])
+                self._pending[key] = (filter_, merged, upsert, attempts)
+                self._stats['requeued'] += 1
+
+    def _write_batch(self, batch):
+        collection = self._get_collection()
+        if collection is None:
+            logger.error(f"❌ {self.name} write-behind: no collection, keeping {len(batch)} updates queued")
+            self._requeue(batch)
+            return False
+        started = time.perf_counter()
+        try:
+            collection.bulk_write(
+                [UpdateOne(filter_, update, upsert=upsert) for filter_, update, upsert, _ in batch],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"❌ {self.name} write-behind bulk write failed, retrying one by one: {str(e)}")
+            failed = []
+            for entry in batch:
+                filter_, update, upsert, _ = entry
+                try:
+                    collection.update_one(filter_, update, upsert=upsert)
+                except Exception as write_error:
+                    failed.append(entry)
+                    logger.error(f"❌ {self.name} write-behind could not write {self._key(filter_)}, "
+                                 f"keeping it queued: {str(write_error)}")
+            self._count('written', len(batch) - len(failed))
+            self._requeue(failed)
+            return not failed
+
+        with self._lock:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+    def _ensure_flusher(self):
+        # Called with self._lock held
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(
+                target=self._run, name=f'{self.name}-write-behind', daemon=True
+            )
+            self._flusher.start()
+
+    def _run(self):
+        while True:
+            if self._failed_flushes:
+                # Requeued updates wait out the backoff; a full batch does not cut it short
+                time.sleep(min(self.interval * 2 ** self._failed_flushes, WRITE_BEHIND_MAX_BACKOFF))
+            else:
+                self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                ok = self.flush()
+            except Exception as e:
+                logger.error(f"❌ {self.name} write-behind flush failed: {str(e)}")
+                ok = False
+            self._failed_flushes = 0 if ok else self._failed_flushes + 1
+
+    def _after_fork(self):
+        # Updates queued in the parent stay the parent's to write; the child starts empty
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}
+        self._flusher = None
+        self._failed_flushes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled, pending=len(self._pending))
+
+
+def flush_all_queues():
+    """Flush every write-behind queue of this process (shutdown hook)"""
+    for queue in _queues:
+        if queue.enabled:
+            try:
+                if not queue.flush():
+                    logger.error(f"❌ {queue.name} write-behind exited with {queue.stats()['pending']} updates unwritten")
+            except Exception as e:
+                logger.error(f"❌ Error flushing {queue.name} write-behind queue: {str(e)}")
+
+
+def _after_fork_in_child():
+    for queue in _queues:
+        queue._after_fork()
+
+
+atexit.register(flush_all_queues)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)